@@ -0,0 +1,377 @@
+# bfsujason@163.com
+
+# POSTagger 和 SEMTagger 的公共基类
+
+import json
+import asyncio
+import logging
+import weakref
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.timing import tracer
+from src.utils import clean_text, split_sents, pack_sents
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# Prompt 模板中待标注文本的标记及占位符
+_TEXT_MARKER = '**Text**:'
+_TEXT_PLACEHOLDER = '\x00TEXT\x00'
+
+class BaseTagger:
+    """
+    标注器公共方法 (大模型标注、批量标注、异步标注等)
+    子类需设置 TAG_KEY，并实现 _local_tag(text)、_local_tag_pipe(texts, ...) 和 _convert_llm_response(response)
+    """
+
+    # 标注结果中赋码列表的键名
+    TAG_KEY = None
+
+    # 分块模式：每块的 token 上限 (None 表示不分块) 及并发请求数
+    chunk_tokens = None
+    chunk_concurrency = 4
+
+    def tag(self, text):
+        raise NotImplementedError
+
+    def tag_batch(self, texts, max_concurrency=8):
+        """
+        批量标注
+        llm 模式下使用线程池并发请求大模型
+        所有线程共用同一个 LLMClient 及其缓存
+        local 模式下使用 tag_pipe() 批量推理
+
+        :param texts:           输入文本列表 [list]
+        :param max_concurrency: 最大并发请求数 int (默认为 8)
+        :return:                标注结果列表 [list[dict]] (与输入顺序一致)
+        """
+        texts = list(texts)
+
+        if self.mode == 'local':
+            return list(self.tag_pipe(texts))
+
+        if max_concurrency <= 1 or len(texts) <= 1:
+            return [self.tag(text) for text in texts]
+
+        max_workers = min(max_concurrency, len(texts))
+        logger.info(f'批量标注：{len(texts)} 条文本，并发数：{max_workers}')
+
+        # executor.map 按输入顺序返回结果
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.tag, texts))
+
+    def tag_pipe(self, texts, batch_size=64, n_process=1):
+        """
+        流式批量标注 (生成器)
+        local 模式下调用 spaCy nlp.pipe 批量推理，按输入顺序逐条返回结果
+        llm 模式下逐条调用 tag()
+
+        :param texts:       输入文本 (可迭代对象)
+        :param batch_size:  spaCy 批大小 int (默认为 64)
+        :param n_process:   spaCy 进程数 int (默认为 1)
+        :return:            标注结果 dict 的生成器
+        """
+        if self.mode == 'local':
+            yield from self._local_tag_pipe(texts, batch_size=batch_size, n_process=n_process)
+        else:
+            for text in texts:
+                yield self.tag(text)
+
+    def tag_stream(self, text):
+        """
+        流式标注 (生成器)
+        llm 模式下每当大模型输出一个完整的 {"token"/"text", "tag"} 对象即产出，无需等待生成结束
+        分块模式下按块顺序依次请求
+        local 模式下标注完毕后逐个产出
+
+        :param text:    输入文本 str
+        :return:        (词, 赋码) 的生成器
+        """
+        if self.mode != 'llm':
+            result = self.tag(text) or {}
+            yield from zip(result.get('tok', []), result.get(self.TAG_KEY, []))
+            return
+
+        labels = self.usage_labels
+        result = self._preprocess(text)
+        for chunk in self._split_chunks(result):
+            with tracer.span('build_prompt', labels):
+                prompt = self._build_prompt(chunk)
+            for item in self.pipeline.stream_response(
+                prompt=prompt,
+                system_prompt=self.system_prompt,
+                labels=labels,
+            ):
+                try:
+                    tokens, tags = self._convert_llm_response([item])
+                except (KeyError, TypeError) as e:
+                    logger.warning(f'无法识别的标注结果 {item}：{e}')
+                    continue
+                yield from zip(tokens, tags)
+
+    async def atag(self, text):
+        """
+        异步标注 (协程)
+        llm 模式使用 AsyncLLMClient，local 模式在线程中运行 tag()
+
+        :param text:    输入文本 str
+        :return:        标注结果 dict (同 tag)
+        """
+        if self.mode == 'llm':
+            async with self._async_session():
+                return await self._allm_tag(text)
+        return await asyncio.to_thread(self.tag, text)
+
+    async def atag_batch(self, texts, max_concurrency=64):
+        """
+        异步批量标注 (协程)
+        单个事件循环中最多同时保持 max_concurrency 个请求
+
+        :param texts:           输入文本列表 [list]
+        :param max_concurrency: 最大并发请求数 int (默认为 64)
+        :return:                标注结果列表 [list[dict]] (与输入顺序一致)
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _atag(text):
+            async with semaphore:
+                return await self.atag(text)
+
+        # 整批共用一个客户端，批次结束时关闭
+        async with self._async_session():
+            return await asyncio.gather(*[_atag(text) for text in texts])
+
+    @contextlib.asynccontextmanager
+    async def _async_session(self):
+        """
+        在当前事件循环中使用 async_pipeline (可嵌套)
+        最后一个使用者退出时关闭客户端，避免每次 asyncio.run 遗留一个未关闭的 httpx 连接池
+        """
+        if self.mode != 'llm':
+            yield None
+            return
+        pipeline = self.async_pipeline
+        self._async_users = getattr(self, '_async_users', 0) + 1
+        try:
+            yield pipeline
+        finally:
+            self._async_users -= 1
+            if self._async_users == 0 and self._async_pipeline is pipeline:
+                self._async_pipeline = None
+                await pipeline.aclose()
+
+    @property
+    def async_pipeline(self):
+        """
+        异步大模型客户端
+        与 self.pipeline 共用模型设置、缓存 (含进程内缓存层) 及前缀缓存统计
+        AsyncOpenAI 的连接绑定首次使用它的事件循环，因此每个事件循环各创建一个
+        (多次调用 asyncio.run 时，在新的事件循环中重新创建)
+        atag() 及 atag_batch() 结束时关闭客户端；直接使用本属性时须自行 await aclose()
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        cached_loop = getattr(self, '_async_pipeline_loop', None)
+        if getattr(self, '_async_pipeline', None) is None or cached_loop is None or cached_loop() is not loop:
+            from src.llm_client import AsyncLLMClient
+
+            self._async_pipeline = AsyncLLMClient(
+                model=self.pipeline.default_model,
+                temperature=self.pipeline.temperature,
+                enable_thinking=self.pipeline.enable_thinking,
+                cache=self.pipeline.cache,
+                prompt_cache=self.pipeline.prompt_cache,
+                prompt_cache_stats=self.pipeline.prompt_cache_stats,
+                memory_cache=self.pipeline.memory_cache,
+            )
+            self._async_pipeline_loop = weakref.ref(loop) if loop is not None else (lambda: None)
+        return self._async_pipeline
+
+    @property
+    def usage_labels(self):
+        """
+        用量计量标签 (按标注器和标注集汇总)
+        """
+        return {'tagger': type(self).__name__, 'tagset': self.tagset}
+
+    def _preprocess(self, text):
+        """
+        清洗文本并分句
+
+        :param text:    输入文本 str
+        :return:        标注结果 dict (text, sent)
+        """
+        result = {}
+        labels = self.usage_labels
+        with tracer.span('clean_text', labels):
+            text = clean_text(text)
+        with tracer.span('split_sents', labels):
+            sents = split_sents(text, lang=self.lang)
+
+        result['text'] = text
+        result['sent'] = sents['sent']
+        return result
+
+    def _compile_prompt(self):
+        """
+        预编译 Prompt (构造标注器时调用一次)
+        将模板中 **Text**: 之前的静态部分 (任务说明、标注集、示例) 渲染为 system 消息
+        之后的部分作为 user 消息，每次请求只需拼接待标注文本
+        静态前缀在各请求间保持一致，便于服务端前缀缓存命中
+        """
+        tagset = self.tagset.upper()
+
+        if self.lang == 'english':
+            prompt_name = f'EN_{tagset}_PROMPT'
+            example_name = f'EN_{tagset}_EXAMPLE'
+            tagset_name = f'EN_{tagset}_TAGSET'
+        elif self.lang == 'chinese':
+            prompt_name = f'ZH_{tagset}_PROMPT'
+            example_name = f'ZH_{tagset}_EXAMPLE'
+            tagset_name = f'ZH_{tagset}_TAGSET'
+
+        prompt_tmpl = getattr(self.prompt, prompt_name)
+        example = getattr(self.prompt, example_name)
+        tagset = getattr(self.prompt, tagset_name)
+
+        # 用占位符渲染模板，再在最后一个 **Text**: 处切分
+        rendered = prompt_tmpl.format(
+            tagset=tagset,
+            example=example,
+            text=_TEXT_PLACEHOLDER,
+        )
+        text_pos = rendered.index(_TEXT_PLACEHOLDER)
+        split_pos = rendered.rindex(_TEXT_MARKER, 0, text_pos)
+
+        self.system_prompt = rendered[:split_pos]
+        self._user_prefix = rendered[split_pos:text_pos]
+        self._user_suffix = rendered[text_pos + len(_TEXT_PLACEHOLDER):]
+
+    def _build_prompt(self, text):
+        """
+        构造 user Prompt (system Prompt 见 _compile_prompt)
+
+        :param text:    清洗后的文本 str
+        :return:        Prompt str
+        """
+        return self._user_prefix + json.dumps(text, ensure_ascii=False) + self._user_suffix
+
+    def _split_chunks(self, result):
+        """
+        分块模式下，将句子按 token 预算打包为若干块
+        未开启分块或只有一块时，返回完整文本
+
+        :param result:  标注结果 dict (text, sent)
+        :return:        各块文本 [list]
+        """
+        if not self.chunk_tokens:
+            return [result['text']]
+
+        chunks = pack_sents(result['sent'], self.chunk_tokens)
+        if len(chunks) <= 1:
+            return [result['text']]
+
+        sep = ' ' if self.lang == 'english' else ''
+        return [sep.join(chunk) for chunk in chunks]
+
+    def _fill_llm_result(self, result, responses):
+        """
+        按顺序拼接各块的分词及赋码结果
+        任一块无响应或无法解析时记录错误 (含块序号)，结果中不写入 tok 及赋码 (调用方据此判断标注失败)
+        """
+        tokens, tags = [], []
+        for index, response in enumerate(responses):
+            chunk = f'chunk {index + 1}/{len(responses)}'
+            if response is None:
+                logger.error(f'LLM tagging failed ({chunk}): no response')
+                return result
+            try:
+                chunk_tokens, chunk_tags = self._convert_llm_response(response)
+            except Exception as e:
+                logger.error(f'LLM tagging error ({chunk}): {e}')
+                return result
+            tokens.extend(chunk_tokens)
+            tags.extend(chunk_tags)
+        result['tok'] = tokens
+        result[self.TAG_KEY] = tags
+        return result
+
+    def _get_llm_response(self, chunk):
+        with tracer.span('build_prompt', self.usage_labels):
+            prompt = self._build_prompt(chunk)
+        return self.pipeline.get_response(
+            prompt=prompt,
+            system_prompt=self.system_prompt,
+            json_output=True,
+            labels=self.usage_labels,
+        )
+
+    async def _aget_llm_response(self, chunk):
+        with tracer.span('build_prompt', self.usage_labels):
+            prompt = self._build_prompt(chunk)
+        return await self.async_pipeline.get_response(
+            prompt=prompt,
+            system_prompt=self.system_prompt,
+            json_output=True,
+            labels=self.usage_labels,
+        )
+
+    def _get_chunk_response(self, index, chunks):
+        """
+        请求第 index 块，出错时记录块序号并返回 None
+        """
+        try:
+            return self._get_llm_response(chunks[index])
+        except Exception as e:
+            logger.error(f'LLM tagging error (chunk {index + 1}/{len(chunks)}): {e}')
+            return None
+
+    async def _aget_chunk_response(self, index, chunks):
+        try:
+            return await self._aget_llm_response(chunks[index])
+        except Exception as e:
+            logger.error(f'LLM tagging error (chunk {index + 1}/{len(chunks)}): {e}')
+            return None
+
+    def _llm_tag(self, text):
+        labels = self.usage_labels
+        with tracer.span('tag', labels):
+            result = self._preprocess(text)
+            chunks = self._split_chunks(result)
+
+            # 调用大模型 (多块并发请求)
+            if len(chunks) == 1:
+                responses = [self._get_chunk_response(0, chunks)]
+            else:
+                max_workers = min(self.chunk_concurrency, len(chunks))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    responses = list(executor.map(
+                        lambda index: self._get_chunk_response(index, chunks), range(len(chunks))
+                    ))
+            with tracer.span('convert', labels):
+                self._fill_llm_result(result, responses)
+
+        return result
+
+    async def _allm_tag(self, text):
+        labels = self.usage_labels
+        with tracer.span('tag', labels):
+            result = self._preprocess(text)
+            chunks = self._split_chunks(result)
+
+            # 调用大模型 (多块并发请求，至多 chunk_concurrency 个)
+            semaphore = asyncio.Semaphore(self.chunk_concurrency)
+
+            async def _aget(index):
+                async with semaphore:
+                    return await self._aget_chunk_response(index, chunks)
+
+            responses = await asyncio.gather(*[_aget(index) for index in range(len(chunks))])
+            with tracer.span('convert', labels):
+                self._fill_llm_result(result, responses)
+
+        return result
@@ -0,0 +1,418 @@
+# bfsujason@163.com
+# python -m src.annotator.doc
+
+# 标注结果的紧凑列式存储
+# 赋码按标注集映射为小整数编号，词和句子记为原文中的字符偏移，数值列使用 array 存储
+# 与标注结果 dict (text, sent, tok, pos/usas) 可无损互转
+
+import re
+import sys
+import threading
+from array import array
+
+# 各标注集对应的标注结果键名
+TAG_KEYS = {
+    'pku': 'pos',
+    'claws': 'pos',
+    'ptb': 'pos',
+    'ud': 'pos',
+    'usas': 'usas',
+}
+
+# 编号 0 保留给空赋码 (None)
+_NONE_ID = 0
+
+# 偏移为 -1 表示该词 (或句子) 在原文中找不到，原文另存于 extra
+_MISSING = -1
+
+def load_tagset_table(tagset):
+    """
+    从 Prompt 中的标注集说明读取赋码及其描述 (ptb、ud 等无说明的标注集返回空 dict)
+
+    :param tagset: pku | claws | usas | ptb | ud
+    :return: {赋码: 描述} (按标注集说明中的顺序)
+    """
+    if tagset == 'claws':
+        from src.prompt.pos_tag_prompt import EN_CLAWS_TAGSET
+        # | APPGE | Possessive pronoun, pre-nominal | ... |
+        rows = re.findall(r'^\| (?!Label\b)([^|\s*]+) \| ([^|]*?) *\|', EN_CLAWS_TAGSET, re.M)
+    elif tagset == 'pku':
+        from src.prompt.pos_tag_prompt import ZH_PKU_TAGSET
+        # | **a** | Adjective | ... |
+        rows = re.findall(r'^\| \*\*([^*]+)\*\* \| ([^|]*?) *\|', ZH_PKU_TAGSET, re.M)
+    elif tagset == 'usas':
+        from src.prompt.sem_tag_prompt import EN_USAS_TAGSET
+        # A1.1.1\tGeneral actions/making
+        rows = [line.split('\t', 1) for line in EN_USAS_TAGSET.splitlines() if '\t' in line]
+    else:
+        rows = []
+
+    table = {}
+    for label, desc in rows:
+        table.setdefault(label, desc.strip())
+    return table
+
+def _load_tagset_labels(tagset):
+    """
+    标注集的赋码列表
+    """
+    return list(load_tagset_table(tagset))
+
+class TagVocab:
+    """
+    赋码词表 (线程安全)
+    以标注集的全部赋码预先编号，标注结果中出现的其他赋码 (如 USAS 复合赋码 S2.2/T3-/S4) 按需追加
+    """
+
+    # 编号使用 array('H') 存储，上限 65535
+    MAX_SIZE = 65536
+
+    def __init__(self, tagset, labels=()):
+        """
+        :param tagset: 标注集名称
+        :param labels: 预先编号的赋码列表
+        """
+        self.tagset = tagset
+        self._lock = threading.Lock()
+        self._tags = [None]
+        self._ids = {}
+        for label in labels:
+            self.id(label)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __contains__(self, tag):
+        return tag is None or tag in self._ids
+
+    def id(self, tag):
+        """
+        :param tag: 赋码 str | None
+        :return: 编号 int (新赋码自动追加)
+        """
+        if tag is None:
+            return _NONE_ID
+        tag_id = self._ids.get(tag)
+        if tag_id is not None:
+            return tag_id
+        if not isinstance(tag, str):
+            raise TypeError(f'赋码须为字符串：{tag!r}')
+        with self._lock:
+            if tag not in self._ids:
+                if len(self._tags) >= self.MAX_SIZE:
+                    raise ValueError(f'{self.tagset} 赋码词表已满 ({self.MAX_SIZE})')
+                self._ids[tag] = len(self._tags)
+                self._tags.append(tag)
+            return self._ids[tag]
+
+    def tag(self, tag_id):
+        return self._tags[tag_id]
+
+    @property
+    def tags(self):
+        """
+        按编号排列的赋码列表 (编号 0 为 None)，只追加不修改
+        """
+        return list(self._tags)
+
+    def encode(self, tags):
+        return array('H', [self.id(tag) for tag in tags])
+
+    def decode(self, tag_ids):
+        tags = self._tags
+        return [tags[tag_id] for tag_id in tag_ids]
+
+# 进程内共享的赋码词表 (每个标注集一个)
+_vocabs = {}
+_vocabs_lock = threading.Lock()
+
+def get_vocab(tagset):
+    """
+    获取标注集的共享赋码词表
+
+    :param tagset: pku | claws | usas | ptb | ud
+    :return: TagVocab 实例
+    """
+    with _vocabs_lock:
+        if tagset not in _vocabs:
+            _vocabs[tagset] = TagVocab(tagset, _load_tagset_labels(tagset))
+        return _vocabs[tagset]
+
+def _locate(text, spans):
+    """
+    按顺序在原文中查找各片段的字符偏移
+
+    :return: (起始偏移 array, 结束偏移 array, 找不到的片段 {序号: 片段})
+    """
+    starts, ends = array('i'), array('i')
+    extra = {}
+    cursor = 0
+    for i, span in enumerate(spans):
+        start = text.find(span, cursor) if isinstance(span, str) and span else -1
+        if start < 0:
+            starts.append(_MISSING)
+            ends.append(_MISSING)
+            extra[i] = span
+            continue
+        cursor = start + len(span)
+        starts.append(start)
+        ends.append(cursor)
+    return starts, ends, extra
+
+def _restore(text, starts, ends, extra):
+    return [
+        extra[i] if start == _MISSING else text[start:end]
+        for i, (start, end) in enumerate(zip(starts, ends))
+    ]
+
+class AnnotatedDoc:
+    """
+    单篇标注结果 (列式)
+    [text]:         原文 str
+    [tok_starts]:   各词的起始偏移 array('i')
+    [tok_ends]:     各词的结束偏移 array('i')
+    [tag_ids]:      各词的赋码编号 array('H')
+    [sent_starts]:  各句的起始偏移 array('i')
+    [sent_ends]:    各句的结束偏移 array('i')
+    [extra]:        原文中找不到的词 {'_tok': {序号: 词}, '_sent': {序号: 句子}}、缺失字段标记及其他字段
+    """
+
+    __slots__ = ('tagset', 'vocab', 'text', 'tok_starts', 'tok_ends', 'tag_ids',
+                 'sent_starts', 'sent_ends', 'extra')
+
+    def __init__(self, tagset, text, tok_starts, tok_ends, tag_ids,
+                 sent_starts, sent_ends, extra=None):
+        self.tagset = tagset
+        self.vocab = get_vocab(tagset)
+        self.text = text
+        self.tok_starts = tok_starts
+        self.tok_ends = tok_ends
+        self.tag_ids = tag_ids
+        self.sent_starts = sent_starts
+        self.sent_ends = sent_ends
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, result, tagset):
+        """
+        :param result: 标注结果 dict (text, sent, tok, pos/usas)
+        :param tagset: 标注集名称
+        :return: AnnotatedDoc 实例
+        """
+        tag_key = TAG_KEYS[tagset]
+        text = result.get('text') or ''
+        vocab = get_vocab(tagset)
+
+        tok_starts, tok_ends, extra_toks = _locate(text, result.get('tok', []))
+        sent_starts, sent_ends, extra_sents = _locate(text, result.get('sent', []))
+        tag_ids = vocab.encode(result.get(tag_key, []))
+
+        extra = {key: value for key, value in result.items() if key not in ('text', 'sent', 'tok', tag_key)}
+        if 'text' not in result:
+            extra['_no_text'] = True
+        if 'tok' not in result:
+            extra['_no_tok'] = True
+        if 'sent' not in result:
+            extra['_no_sent'] = True
+        if tag_key not in result:
+            extra['_no_tag'] = True
+        if extra_toks:
+            extra['_tok'] = extra_toks
+        if extra_sents:
+            extra['_sent'] = extra_sents
+        return cls(tagset, text, tok_starts, tok_ends, tag_ids, sent_starts, sent_ends, extra)
+
+    def to_dict(self):
+        """
+        :return: 标注结果 dict (与 from_dict 的输入一致)
+        """
+        extra = self.extra
+        result = {}
+        if not extra.get('_no_text'):
+            result['text'] = self.text
+        if not extra.get('_no_sent'):
+            result['sent'] = self.sents
+        if not extra.get('_no_tok'):
+            result['tok'] = self.tokens
+        if not extra.get('_no_tag'):
+            result[TAG_KEYS[self.tagset]] = self.tags
+        for key, value in extra.items():
+            if not key.startswith('_'):
+                result[key] = value
+        return result
+
+    @property
+    def tokens(self):
+        return _restore(self.text, self.tok_starts, self.tok_ends, self.extra.get('_tok', {}))
+
+    @property
+    def sents(self):
+        return _restore(self.text, self.sent_starts, self.sent_ends, self.extra.get('_sent', {}))
+
+    @property
+    def tags(self):
+        return self.vocab.decode(self.tag_ids)
+
+    def __len__(self):
+        return len(self.tok_starts)
+
+    def __iter__(self):
+        """
+        :return: (词, 赋码) 的迭代器
+        """
+        return zip(self.tokens, self.tags)
+
+    def __repr__(self):
+        return f'AnnotatedDoc(tagset={self.tagset!r}, tokens={len(self)}, text={self.text[:20]!r})'
+
+class AnnotatedCorpus:
+    """
+    语料级标注结果 (列式)
+    所有文档的词、赋码及句子偏移分别存入同一 array，按文档记录起止位置
+    无效文本的标注结果 (None) 原样保留
+    """
+
+    def __init__(self, tagset):
+        """
+        :param tagset: 标注集名称 pku | claws | usas | ptb | ud
+        """
+        if tagset not in TAG_KEYS:
+            raise ValueError(f'不支持的标注集 {tagset}\n支持标注集: {list(TAG_KEYS.keys())}')
+        self.tagset = tagset
+        self.vocab = get_vocab(tagset)
+
+        self.texts = []
+        self.extras = []
+        # 各文档在词 / 句子列中的起始位置 (长度为文档数 + 1)
+        self.doc_tok = array('Q', [0])
+        self.doc_sent = array('Q', [0])
+
+        self.tok_starts = array('i')
+        self.tok_ends = array('i')
+        self.tag_ids = array('H')
+        self.sent_starts = array('i')
+        self.sent_ends = array('i')
+
+    @classmethod
+    def from_dicts(cls, results, tagset):
+        corpus = cls(tagset)
+        corpus.extend(results)
+        return corpus
+
+    def append(self, result):
+        """
+        :param result: 标注结果 dict 或 None
+        """
+        if result is None:
+            self.texts.append(None)
+            self.extras.append(None)
+        else:
+            doc = result if isinstance(result, AnnotatedDoc) else AnnotatedDoc.from_dict(result, self.tagset)
+            self.texts.append(doc.text)
+            self.extras.append(doc.extra or None)
+            self.tok_starts.extend(doc.tok_starts)
+            self.tok_ends.extend(doc.tok_ends)
+            self.tag_ids.extend(doc.tag_ids)
+            self.sent_starts.extend(doc.sent_starts)
+            self.sent_ends.extend(doc.sent_ends)
+        self.doc_tok.append(len(self.tok_starts))
+        self.doc_sent.append(len(self.sent_starts))
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        """
+        :return: AnnotatedDoc 实例 (无效文本为 None)
+        """
+        if index < 0:
+            index += len(self)
+        if self.texts[index] is None and self.extras[index] is None:
+            return None
+        tok_slice = slice(self.doc_tok[index], self.doc_tok[index + 1])
+        sent_slice = slice(self.doc_sent[index], self.doc_sent[index + 1])
+        return AnnotatedDoc(
+            self.tagset,
+            self.texts[index],
+            self.tok_starts[tok_slice],
+            self.tok_ends[tok_slice],
+            self.tag_ids[tok_slice],
+            self.sent_starts[sent_slice],
+            self.sent_ends[sent_slice],
+            self.extras[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_dicts(self):
+        """
+        :return: 标注结果列表 [list[dict | None]]
+        """
+        return [None if doc is None else doc.to_dict() for doc in self]
+
+    @property
+    def num_tokens(self):
+        return len(self.tag_ids)
+
+    def tag_counts(self):
+        """
+        赋码频次 (直接统计编号列，无需还原字符串)
+
+        :return: {赋码: 频次}
+        """
+        counts = [0] * len(self.vocab)
+        for tag_id in self.tag_ids:
+            counts[tag_id] += 1
+        return {self.vocab.tag(tag_id): count for tag_id, count in enumerate(counts) if count}
+
+    def as_numpy(self):
+        """
+        数值列的 NumPy 视图 (共用内存，不复制)
+
+        :return: dict {列名: numpy.ndarray}
+        """
+        import numpy as np
+
+        columns = ('doc_tok', 'doc_sent', 'tok_starts', 'tok_ends', 'tag_ids', 'sent_starts', 'sent_ends')
+        return {
+            name: np.frombuffer(getattr(self, name), dtype=getattr(self, name).typecode)
+            for name in columns
+        }
+
+    def nbytes(self):
+        """
+        估计内存占用 (字节)
+        """
+        size = sum(
+            column.itemsize * len(column)
+            for column in (self.doc_tok, self.doc_sent, self.tok_starts, self.tok_ends,
+                           self.tag_ids, self.sent_starts, self.sent_ends)
+        )
+        return size + sum(sys.getsizeof(text) for text in self.texts if text is not None)
+
+if __name__ == '__main__':
+
+    print(f'\n测试 1: 赋码词表')
+    print(f'{"=" * 30}')
+    for tagset in ('claws', 'pku', 'usas'):
+        print(f'[{tagset}]：{len(get_vocab(tagset)) - 1} 个赋码')
+
+    print(f'\n测试 2: 无损互转')
+    print(f'{"=" * 30}')
+    result = {
+        'text': '那天晚上我没走掉。陈清扬把我拽住。',
+        'sent': ['那天晚上我没走掉。', '陈清扬把我拽住。'],
+        'tok': ['那', '天', '晚上', '我', '没', '走', '掉', '。', '陈清扬', '把', '我', '拽住', '。'],
+        'pos': ['r', 'q', 't', 'r', 'd', 'v', 'v', 'w', 'nr', 'p', 'r', 'v', 'w'],
+    }
+    corpus = AnnotatedCorpus.from_dicts([result, None, result], tagset='pku')
+    print(f'[文档 0]：{corpus[0]}')
+    print(f'[无损互转]：{corpus.to_dicts() == [result, None, result]}')
+    print(f'[赋码频次]：{corpus.tag_counts()}')
+    print(f'[内存占用]：{corpus.nbytes()} 字节')
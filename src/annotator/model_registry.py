@@ -0,0 +1,182 @@
+# bfsujason@163.com
+# python -m src.annotator.model_registry
+
+# 本地预训练模型注册表
+# 每个模型在进程内只加载一次，各标注器共用同一实例
+
+import gc
+import logging
+import threading
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# === 模型加载函数 ===
+
+def _load_hanlp_tok_zh():
+    # === 加载中文分词模型 ===
+    # FINE_ELECTRA_SMALL_ZH
+    # 模型介绍：https://hanlp.hankcs.com/docs/api/hanlp/pretrained/tok.html
+    # 下载地址：https://file.hankcs.com/hanlp/tok/fine_electra_small_20220615_231803.zip
+    import hanlp
+
+    logger.info('加载 HanLP 中文分词模型 ...')
+    model = hanlp.load(hanlp.pretrained.tok.FINE_ELECTRA_SMALL_ZH)
+    logger.info('HanLP 中文分词模型加载完毕！')
+    return model
+
+def _load_hanlp_pos_pku():
+    # === 加载中文词性标注模型 ===
+    # PKU_POS_ELECTRA_SMALL
+    # 模型介绍：https://hanlp.hankcs.com/docs/api/hanlp/pretrained/pos.html
+    # 下载地址：https://file.hankcs.com/hanlp/pos/pos_pku_electra_small_20220217_142436.zip
+    import hanlp
+
+    logger.info('加载 HanLP 中文词性标注模型 ...')
+    model = hanlp.load(hanlp.pretrained.pos.PKU_POS_ELECTRA_SMALL)
+    logger.info('HanLP 中文词性标注模型加载完毕！')
+    return model
+
+def _load_spacy_en_trf():
+    # === 加载英文词性标注模型 ===
+    # 模型介绍：https://spacy.io/models/en#en_core_web_trf
+    import spacy
+
+    logger.info('加载 Spacy 英文词性标注模型 ...')
+    model = spacy.load('en_core_web_trf', disable=['ner', 'parser'])
+    logger.info('Spacy 英文词性标注模型加载完毕！')
+    return model
+
+def _load_pymusas_zh():
+    # === 加载中文语义标注模型 ===
+    # 模型介绍: https://ucrel.github.io/pymusas/usage/how_to/tag_text_with/rule_based_tagger
+    # 语义词表：https://github.com/UCREL/Multilingual-USAS/tree/master/Chinese
+    import spacy
+
+    logger.info('加载 PyMUSAS 中文语义标注模型 ...')
+    model = spacy.load('zh_core_web_sm', exclude=['parser', 'ner'])
+    chinese_tagger_pipeline = spacy.load('cmn_dual_upos2usas_contextual_none')
+    model.add_pipe('pymusas_rule_based_tagger', source=chinese_tagger_pipeline)
+    logger.info('PyMUSAS 中文语义标注模型加载完毕！')
+    return model
+
+def _load_pymusas_en():
+    # === 加载英文语义标注模型 ===
+    # 模型介绍：https://ucrel.github.io/pymusas/usage/how_to/tag_text_with/rule_based_tagger
+    # 语义词表：https://github.com/UCREL/Multilingual-USAS/tree/master/English
+    import spacy
+
+    logger.info('加载 PyMUSAS 英文语义标注模型 ...')
+    model = spacy.load('en_core_web_sm', exclude=['parser', 'ner'])
+    english_tagger_pipeline = spacy.load('en_dual_none_contextual_none')
+    model.add_pipe('pymusas_rule_based_tagger', source=english_tagger_pipeline)
+    logger.info('PyMUSAS 英文语义标注模型加载完毕！')
+    return model
+
+class ModelRegistry:
+    """
+    本地预训练模型注册表 (线程安全)
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader):
+        """
+        注册模型加载函数
+
+        :param name: 模型名称 str
+        :param loader: 加载函数 (无参数，返回模型实例)
+        """
+        with self._lock:
+            self._loaders[name] = loader
+
+    def get(self, name):
+        """
+        获取模型 (首次调用时加载)
+
+        :param name: 模型名称 str
+        :return: 模型实例
+        """
+        with self._lock:
+            if name not in self._models:
+                if name not in self._loaders:
+                    raise ValueError(
+                        f'未注册的模型 {name}\n'
+                        f'已注册模型: {list(self._loaders.keys())}'
+                    )
+                self._models[name] = self._loaders[name]()
+            return self._models[name]
+
+    def preload(self, *names):
+        """
+        预先加载模型
+
+        :param names: 模型名称 (为空时加载全部已注册模型)
+        """
+        for name in names or list(self._loaders.keys()):
+            self.get(name)
+
+    def unload(self, *names):
+        """
+        释放模型 (已创建的标注器仍持有原模型实例)
+
+        :param names: 模型名称 (为空时释放全部模型)
+        """
+        with self._lock:
+            for name in names or list(self._models.keys()):
+                if self._models.pop(name, None) is not None:
+                    logger.info(f'释放模型：{name}')
+        gc.collect()
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    @property
+    def loaded(self):
+        """
+        已加载的模型名称 [list]
+        """
+        return list(self._models.keys())
+
+# 进程内共享的注册表
+registry = ModelRegistry()
+registry.register('hanlp_tok_zh', _load_hanlp_tok_zh)
+registry.register('hanlp_pos_pku', _load_hanlp_pos_pku)
+registry.register('spacy_en_trf', _load_spacy_en_trf)
+registry.register('pymusas_zh', _load_pymusas_zh)
+registry.register('pymusas_en', _load_pymusas_en)
+
+def load_model(name):
+    return registry.get(name)
+
+def preload(*names):
+    registry.preload(*names)
+
+def unload(*names):
+    registry.unload(*names)
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    print(f'\n测试 1: 预加载中文模型')
+    print(f'{"=" * 30}')
+    preload('hanlp_tok_zh', 'hanlp_pos_pku')
+    print(f'[已加载模型]：{registry.loaded}')
+
+    print(f'\n测试 2: 共用模型实例')
+    print(f'{"=" * 30}')
+    from src.annotator.pos_tagger import POSTagger
+    from src.annotator.sem_tagger import SEMTagger
+    zh_pos_tagger = POSTagger(lang='chinese', tagset='pku', mode='local')
+    zh_sem_tagger = SEMTagger(lang='chinese', tagset='usas', mode='local')
+    print(f'[已加载模型]：{registry.loaded}')
+
+    print(f'\n测试 3: 释放模型')
+    print(f'{"=" * 30}')
+    unload()
+    print(f'[已加载模型]：{registry.loaded}')
@@ -3,15 +3,18 @@
 # 单元测试：
 # python -m src.annotator.pos_tagger
 
-import json
 import logging
 
-from src.utils import clean_text, split_sents
+from src.utils import bucket_apply
+from src.annotator.base_tagger import BaseTagger
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-class POSTagger:
+class POSTagger(BaseTagger):
+
+    TAG_KEY = 'pos'
+
     def __init__(
         self,
         lang,
@@ -19,6 +22,8 @@ class POSTagger:
         mode='local',
         llm_model=None,
         enable_thinking=False,
+        chunk_tokens=None,
+        chunk_concurrency=4,
     ):
         """
         :param lang:            语种 str
@@ -49,6 +54,10 @@ class POSTagger:
         :param enable_thinking: 思考模式 | Boolean
                                 [True]:     开启
                                 [False]:    关闭          
+        :param chunk_tokens:    分块模式 int | None (仅 llm 模式)
+                                按句子打包为不超过该 token 数的文本块，逐块请求后按顺序拼接
+                                [None]:     不分块
+        :param chunk_concurrency: 分块模式下的并发请求数 int (默认为 4)
         :return:                POSTagger Pipeline 实例                               
         """
         
@@ -80,8 +89,12 @@ class POSTagger:
         self.tagset = tagset
         self.mode = mode
         self.enable_thinking = enable_thinking
+        self.chunk_tokens = chunk_tokens
+        self.chunk_concurrency = chunk_concurrency
         
         if mode == 'local':
+            # 模型在进程内只加载一次，见 model_registry
+            from src.annotator.model_registry import load_model
             from src.annotator.tokenizer import Tokenizer
             self.tokenizer = Tokenizer(lang=lang, mode='local')
             if lang == 'chinese':
@@ -96,24 +109,20 @@ class POSTagger:
                
                 import hanlp
                 
-                logger.info('加载 HanLP 中文词性标注模型 ...')
-                pos_tagger = hanlp.load(hanlp.pretrained.pos.PKU_POS_ELECTRA_SMALL)
+                pos_tagger = load_model('hanlp_pos_pku')
+                self.pos_model = pos_tagger
                 self.pipeline = hanlp.pipeline() \
                     .append(pos_tagger, input_key='tok', output_key='pos')
-                logger.info('HanLP 中文词性标注模型加载完毕！')
             elif lang == 'english':
                 
                 # === 加载英文词性标注模型 ===
                 # 模型介绍：https://spacy.io/models/en#en_core_web_trf
                 # 使用方法：https://spacy.io/usage/linguistic-features
                 
-                import spacy
                 from spacy.tokens import Doc
                 
-                logger.info('加载 Spacy 英文词性标注模型 ...')
-                self.pipeline = spacy.load('en_core_web_trf', disable=['ner', 'parser'])
+                self.pipeline = load_model('spacy_en_trf')
                 self.doc = Doc
-                logger.info('Spacy 英文词性标注模型加载完毕！')    
         elif mode == 'llm':
             from src.llm_client import LLMClient
             from src.prompt import pos_tag_prompt
@@ -122,6 +131,7 @@ class POSTagger:
             self.pipeline = LLMClient(model=llm_model, enable_thinking=enable_thinking)
             self.llm_model = self.pipeline.default_model
             self.prompt = pos_tag_prompt
+            self._compile_prompt()
             logger.info('LLM 词性标注模型加载完毕！')
     
     # A wrapper for _local_tag() and _llm_tag()
@@ -139,55 +149,12 @@ class POSTagger:
         elif self.mode == 'local':
             return self._local_tag(text)
             
-    def _llm_tag(self, text):
-        tagset = self.tagset.upper()
-            
+    def _local_tag(self, text):
         if self.lang == 'english':
-            prompt_name = f'EN_{tagset}_PROMPT'
-            example_name = f'EN_{tagset}_EXAMPLE'
-            tagset_name = f'EN_{tagset}_TAGSET'
-        elif self.lang == 'chinese':
-            prompt_name = f'ZH_{tagset}_PROMPT'
-            example_name = f'ZH_{tagset}_EXAMPLE'
-            tagset_name = f'ZH_{tagset}_TAGSET'
-        
-        prompt_tmpl = getattr(self.prompt, prompt_name)
-        example = getattr(self.prompt, example_name)
-        tagset = getattr(self.prompt, tagset_name)
-        
-        result = {}
-        text = clean_text(text)
-        sents = split_sents(text, lang=self.lang)
-        
-        result['text'] = text
-        result['sent'] = sents['sent']
-        
-        # 构造 Prompt
-        prompt = prompt_tmpl.format(
-            tagset=tagset,
-            example=example,
-            #tokens=json.dumps(toks, ensure_ascii=False),
-            text=json.dumps(text, ensure_ascii=False),
-        )
-        #print(prompt)
-        
-        # 调用大模型
-        try:
-            response = self.pipeline.get_response(
-                prompt=prompt,
-                json_output=True,
-            )
-            #print(response)
-            tokens, tags = self._convert_llm_response(response)
-            result['tok'] = tokens
-            result['pos'] = tags
-            
-        except Exception as e:
-            logging.error(f'LLM tagging error: {e}')
-                
-        return result
+            doc, result = self._local_doc(text)
+            doc = self.pipeline(doc)
+            return self._convert_spacy_doc(doc, result)
         
-    def _local_tag(self, text):
         result = {}
         tok_sents = self.tokenizer.tokenize(text)
         #print(tok_sents)
@@ -196,20 +163,78 @@ class POSTagger:
         result['text'] = tok_sents['text']
         result['sent'] = tok_sents['sent']
         
-        if self.lang == 'english':
-            doc = self.doc(self.pipeline.vocab, words=toks)
-            doc = self.pipeline(doc)
-            result['tok'] = [token.text for token in doc]
-            if self.tagset == 'ud':
-                result['pos'] = [token.pos_ for token in doc]
-            elif self.tagset == 'ptb':
-                result['pos'] = [token.tag_ for token in doc]
-        elif self.lang == 'chinese':
+        if self.lang == 'chinese':
             doc = self.pipeline(tok_sents)
             result['tok'] = toks
             result['pos'] = [tag for sent in doc['pos'] for tag in sent]
         return result
         
+    def _local_tag_pipe(self, texts, batch_size=64, n_process=1):
+        """
+        批量标注 (英文使用 spaCy nlp.pipe 批量推理，中文使用 HanLP 分桶批量推理)
+        按输入顺序逐条返回结果
+        """
+        if self.lang == 'chinese':
+            # 每次汇总 batch_size * 16 篇文档的句子
+            group = []
+            for text in texts:
+                group.append(text)
+                if len(group) >= batch_size * 16:
+                    yield from self._local_tag_corpus(group, batch_size)
+                    group = []
+            if group:
+                yield from self._local_tag_corpus(group, batch_size)
+            return
+        
+        docs = (self._local_doc(text) for text in texts)
+        for doc, result in self.pipeline.pipe(
+            docs,
+            as_tuples=True,
+            batch_size=batch_size,
+            n_process=n_process,
+        ):
+            yield self._convert_spacy_doc(doc, result)
+        
+    def _local_tag_corpus(self, texts, batch_size=64):
+        """
+        语料级批量标注 (中文)
+        汇总所有文档的句子，按长度分桶后批量分词及 PKU 词性标注，再按文档拆分结果
+        """
+        results = self.tokenizer.tokenize_corpus(texts, batch_size=batch_size)
+        
+        all_toks = [toks for result in results for toks in result['tok']]
+        all_tags = bucket_apply(self.pos_model, all_toks, batch_size)
+        
+        start = 0
+        for result in results:
+            end = start + len(result['sent'])
+            tok_sents = result.pop('tok')
+            result['tok'] = [tok for sent in tok_sents for tok in sent]
+            result['pos'] = [tag for sent in all_tags[start:end] for tag in sent]
+            start = end
+        return results
+        
+    def _local_doc(self, text):
+        """
+        分词并构造 spaCy Doc (英文)
+        
+        :return: (Doc, 标注结果 dict)
+        """
+        result = {}
+        tok_sents = self.tokenizer.tokenize(text)
+        toks = [tok for sent in tok_sents['tok'] for tok in sent]
+        result['text'] = tok_sents['text']
+        result['sent'] = tok_sents['sent']
+        return self.doc(self.pipeline.vocab, words=toks), result
+        
+    def _convert_spacy_doc(self, doc, result):
+        result['tok'] = [token.text for token in doc]
+        if self.tagset == 'ud':
+            result['pos'] = [token.pos_ for token in doc]
+        elif self.tagset == 'ptb':
+            result['pos'] = [token.tag_ for token in doc]
+        return result
+        
     @staticmethod
     def _convert_llm_response(response):
         tokens, tags = [], []
@@ -285,3 +310,32 @@ if __name__ == '__main__':
     )
     en_doc = en_pos_tagger.tag(en_text)
     print(f'[标注结果]：{en_doc}')
+    
+    print(f'\n测试 5: LLM 英文词性标注 (批量)')
+    print(f'{"=" * 30}')
+    en_texts = [
+        'I did not leave that night.',
+        'Chen Qingyang caught me and asked me to stay.',
+    ]
+    en_docs = en_pos_tagger.tag_batch(en_texts, max_concurrency=2)
+    for en_doc in en_docs:
+        print(f'[标注结果]：{en_doc}')
+    
+    print(f'\n测试 6: LLM 英文词性标注 (异步批量)')
+    print(f'{"=" * 30}')
+    import asyncio
+    en_docs = asyncio.run(en_pos_tagger.atag_batch(en_texts, max_concurrency=64))
+    for en_doc in en_docs:
+        print(f'[标注结果]：{en_doc}')
+    
+    print(f'\n测试 7: LLM 英文词性标注 (再次调用 asyncio.run)')
+    print(f'{"=" * 30}')
+    # 新的事件循环中重新创建异步客户端 (使用未缓存的文本，确保实际发出请求)
+    en_texts = [
+        'That night I stayed.',
+        'We talked about friendship until dawn.',
+    ]
+    en_docs = asyncio.run(en_pos_tagger.atag_batch(en_texts, max_concurrency=64))
+    for en_doc in en_docs:
+        print(f'[标注结果]：{en_doc}')
+    print(f'[标注成功]：{all("tok" in en_doc for en_doc in en_docs)}')
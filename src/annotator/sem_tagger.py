@@ -4,17 +4,19 @@
 # python -m src.annotator.sem_tagger
 
 import re
-import json
 import logging
 import warnings
 warnings.filterwarnings("ignore")
 
-from src.utils import clean_text, split_sents
+from src.annotator.base_tagger import BaseTagger
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-class SEMTagger:
+class SEMTagger(BaseTagger):
+
+    TAG_KEY = 'usas'
+
     def __init__(
         self,
         lang,
@@ -22,6 +24,8 @@ class SEMTagger:
         mode='local',
         llm_model=None,
         enable_thinking=False,
+        chunk_tokens=None,
+        chunk_concurrency=4,
     ):
         """
         :param lang:            语种 str
@@ -46,6 +50,10 @@ class SEMTagger:
         :param enable_thinking: 思考模式 | Boolean
                                 [True]:     开启
                                 [False]:    关闭
+        :param chunk_tokens:    分块模式 int | None (仅 llm 模式)
+                                按句子打包为不超过该 token 数的文本块，逐块请求后按顺序拼接
+                                [None]:     不分块
+        :param chunk_concurrency: 分块模式下的并发请求数 int (默认为 4)
         :return:                DEPParser Pipeline 实例
         :return:                SEMTagger Pipeline 实例
         """
@@ -78,10 +86,13 @@ class SEMTagger:
         self.tagset = tagset
         self.mode = mode
         self.enable_thinking = enable_thinking
+        self.chunk_tokens = chunk_tokens
+        self.chunk_concurrency = chunk_concurrency
         
         if mode == 'local':
-            import spacy
             from spacy.tokens import Doc
+            # 模型在进程内只加载一次，见 model_registry
+            from src.annotator.model_registry import load_model
             from src.annotator.tokenizer import Tokenizer
             
             self.doc = Doc
@@ -91,22 +102,12 @@ class SEMTagger:
                 # === 加载中文语义标注模型 ===
                 # 模型介绍: https://ucrel.github.io/pymusas/usage/how_to/tag_text_with/rule_based_tagger
                 # 语义词表：https://github.com/UCREL/Multilingual-USAS/tree/master/Chinese
-
-                logger.info('加载 PyMUSAS 中文语义标注模型 ...')
-                self.pipeline = spacy.load('zh_core_web_sm', exclude=['parser', 'ner'])
-                chinese_tagger_pipeline = spacy.load('cmn_dual_upos2usas_contextual_none')
-                self.pipeline.add_pipe('pymusas_rule_based_tagger', source=chinese_tagger_pipeline)
-                logger.info('PyMUSAS 中文语义标注模型加载完毕！')
+                self.pipeline = load_model('pymusas_zh')
             elif lang == 'english':
                 # === 加载英文语义标注模型 ===
                 # 模型介绍：https://ucrel.github.io/pymusas/usage/how_to/tag_text_with/rule_based_tagger
                 # 语义词表：https://github.com/UCREL/Multilingual-USAS/tree/master/English
-                
-                logger.info('加载 PyMUSAS 英文句法标注模型 ...')
-                self.pipeline = spacy.load('en_core_web_sm', exclude=['parser', 'ner'])
-                english_tagger_pipeline = spacy.load('en_dual_none_contextual_none')
-                self.pipeline.add_pipe('pymusas_rule_based_tagger', source=english_tagger_pipeline)
-                logger.info('PyMUSAS 英文语义标注模型加载完毕！')
+                self.pipeline = load_model('pymusas_en')
             
         elif mode == 'llm':
             from src.llm_client import LLMClient
@@ -116,6 +117,7 @@ class SEMTagger:
             self.pipeline = LLMClient(model=llm_model)
             self.llm_model = self.pipeline.default_model
             self.prompt = sem_tag_prompt
+            self._compile_prompt()
             logger.info(f'LLM 语义标注模型加载完毕！')
             
     # A wrapper for _local_tag() and _llm_tag()
@@ -133,65 +135,11 @@ class SEMTagger:
         elif self.mode == 'local':
             return self._local_tag(text)
             
-    def _llm_tag(self, text):
-        tagset = self.tagset.upper()
-        
-        if self.lang == 'english':
-            prompt_name = f'EN_{tagset}_PROMPT'
-            example_name = f'EN_{tagset}_EXAMPLE'
-            tagset_name = f'EN_{tagset}_TAGSET'
-        elif self.lang == 'chinese':
-            prompt_name = f'ZH_{tagset}_PROMPT'
-            example_name = f'ZH_{tagset}_EXAMPLE'
-            tagset_name = f'ZH_{tagset}_TAGSET'
-        
-        prompt_tmpl = getattr(self.prompt, prompt_name)
-        example = getattr(self.prompt, example_name)
-        tagset = getattr(self.prompt, tagset_name)
-        
-        result = {}
-        text = clean_text(text)
-        sents = split_sents(text, lang=self.lang)
-        
-        result['text'] = text
-        result['sent'] = sents['sent']
-        
-        # 构造 Prompt
-        prompt = prompt_tmpl.format(
-            tagset=tagset,
-            example=example,
-            text=json.dumps(text, ensure_ascii=False),
-            #tokens=json.dumps(toks, ensure_ascii=False),
-        )
-        #print(prompt)
-        
-        # 调用大模型
-        try:
-            response = self.pipeline.get_response(
-                prompt=prompt,
-                json_output=True,
-            )
-            #print(response)
-            tokens, tags = self._convert_llm_response(response)
-            result['tok'] = tokens
-            result['usas'] = tags
-            
-        except Exception as e:
-            logging.error(f'LLM tagging error: {e}')
-                
-        return result
-        
     def _local_tag(self, text):
         if not text or not isinstance(text, str):
             return None
         
-        result = {}
-        tok_sents = self.tokenizer.tokenize(text)
-        result['text'] = tok_sents['text']
-        result['sent'] = tok_sents['sent']
-        
-        toks = [tok for sent in tok_sents['tok'] for tok in sent]
-        doc = self.doc(self.pipeline.vocab, words=toks)
+        doc, result = self._local_doc(text)
         doc = self.pipeline(doc)
         
         '''
@@ -207,6 +155,47 @@ class SEMTagger:
 
         return result
     
+    def _local_tag_pipe(self, texts, batch_size=64, n_process=1):
+        """
+        批量标注 (spaCy nlp.pipe 批量推理)
+        按输入顺序逐条返回结果，无效文本返回 None
+        """
+        def _docs():
+            for text in texts:
+                if not text or not isinstance(text, str):
+                    # 占位，保持输出顺序
+                    yield self.doc(self.pipeline.vocab, words=[]), None
+                else:
+                    yield self._local_doc(text)
+        
+        for doc, result in self.pipeline.pipe(
+            _docs(),
+            as_tuples=True,
+            batch_size=batch_size,
+            n_process=n_process,
+        ):
+            if result is None:
+                yield None
+                continue
+            tokens, tags = self._convert_usas_results(doc)
+            result['tok'] = tokens
+            result['usas'] = tags
+            yield result
+    
+    def _local_doc(self, text):
+        """
+        分词并构造 spaCy Doc
+        
+        :return: (Doc, 标注结果 dict)
+        """
+        result = {}
+        tok_sents = self.tokenizer.tokenize(text)
+        result['text'] = tok_sents['text']
+        result['sent'] = tok_sents['sent']
+        
+        toks = [tok for sent in tok_sents['tok'] for tok in sent]
+        return self.doc(self.pipeline.vocab, words=toks), result
+    
     def _convert_usas_results(self, doc):
         tokens, tags = [], []
         processed_mwe = []
@@ -7,7 +7,7 @@ from collections import defaultdict
 
 from tqdm import tqdm
 
-from src.utils import clean_text, split_sents
+from src.utils import clean_text, split_sents, bucket_apply
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -62,11 +62,13 @@ class Tokenizer:
                 # 模型介绍：https://hanlp.hankcs.com/docs/api/hanlp/pretrained/tok.html
                 # 下载地址：https://file.hankcs.com/hanlp/tok/fine_electra_small_20220615_231803.zip
                 # 使用方法：https://github.com/hankcs/HanLP/blob/doc-zh/plugins/hanlp_demo/hanlp_demo/zh/tok_stl.ipynb
-                logger.info('加载 HanLP 中文分词模型 ...')
-                tokenizer = hanlp.load(hanlp.pretrained.tok.FINE_ELECTRA_SMALL_ZH)
+                # 模型在进程内只加载一次，见 model_registry
+                from src.annotator.model_registry import load_model
+                
+                tokenizer = load_model('hanlp_tok_zh')
+                self.model = tokenizer
                 self.pipeline = hanlp.pipeline() \
                     .append(tokenizer, input_key='sent', output_key='tok')
-                logger.info('HanLP 中文分词模型加载完毕！')
             elif lang == 'english':
                 # === 加载英文分词模型 ===
                 # 使用方法：https://github.com/hankcs/HanLP/blob/doc-zh/plugins/hanlp_demo/hanlp_demo/en/demo_tok.py
@@ -75,6 +77,7 @@ class Tokenizer:
                 
                 logger.info('加载 HanLP 英文分词模型 ...')
                 tokenizer = tokenize_english
+                self.model = lambda sents: [tokenize_english(sent) for sent in sents]
                 self.pipeline = hanlp.pipeline() \
                     .append(tokenizer, input_key='sent', output_key='tok')
                 logger.info('HanLP 英文分词模型加载完毕！')
@@ -101,6 +104,35 @@ class Tokenizer:
         elif self.mode == 'local':
             return self._local_tok(text)
             
+    def tokenize_corpus(self, texts, batch_size=256):
+        """
+        语料级批量分词 (仅 local 模式)
+        汇总所有文档的句子，按长度分桶后批量分词，再按文档拆分结果
+        
+        :param texts:       输入文本列表 [list]
+        :param batch_size:  每批句子数 int (默认为 256)
+        :return:            标注结果列表 [list[dict]] (与 tokenize 相同，与输入顺序一致)
+        """
+        if self.mode != 'local':
+            return [self.tokenize(text) for text in texts]
+        
+        results, all_sents = [], []
+        for text in texts:
+            text = clean_text(text)
+            sents = split_sents(text, lang=self.lang)
+            results.append({'text': text, 'sent': sents['sent']})
+            all_sents.extend(sents['sent'])
+        
+        all_toks = bucket_apply(self.model, all_sents, batch_size)
+        
+        # 按文档拆分
+        start = 0
+        for result in results:
+            end = start + len(result['sent'])
+            result['tok'] = all_toks[start:end]
+            start = end
+        return results
+        
     def _llm_tok(self, text):
         if self.lang == 'english':
             prompt_name = f'EN_TOK_PROMPT'
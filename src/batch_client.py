@@ -0,0 +1,496 @@
+# bfsujason@163.com
+# python -m src.batch_client
+
+# 离线调用大模型 Batch API
+# 百炼 Batch 接口：https://help.aliyun.com/zh/model-studio/batch-interfaces-compatible-with-openai
+
+import os
+import json
+import time
+import logging
+
+import openai
+
+from src.config import Config
+from src.llm_client import BaseLLMClient
+from src.usage import BATCH_PRICE_FACTOR
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# Batch 任务的终止状态
+FINAL_STATUS = {'completed', 'failed', 'expired', 'cancelled'}
+
+class BatchLLMClient(BaseLLMClient):
+    """
+    批量调用大模型 API (Batch 模式)
+
+    1. 由标注器的 Prompt 生成 JSONL 请求文件
+    2. 上传文件并提交 Batch 任务，轮询任务状态
+    3. 下载并解析结果，写入与 LLMClient 相同的缓存
+
+    之后调用标注器的 tag() 即可直接命中缓存
+    """
+
+    def __init__(self,
+        model=None,
+        temperature=0.1,
+        enable_thinking=False,
+        cache=None,
+        memory_cache=None,
+        base_url=None,
+        api_key=None,
+        batch_dir=None,
+    ):
+        """
+        :param model: 模型名称 (默认为 kimi-k2.5)
+        :param temperature: 采样温度系数 (默认为 0.1)
+        :param enable_thinking: 思考模式 (默认为关闭)
+        :param cache: 共用的 diskcache.Cache 或 CacheBackend 实例 (默认按 Config 打开)
+        :param memory_cache: 共用的进程内缓存层 MemoryCache (默认按 Config 新建)
+        :param base_url: Batch API 地址 (默认读取 Config，可指向本地测试服务)
+        :param api_key: API Key (默认读取 Config)
+        :param batch_dir: JSONL 请求文件目录 (默认读取 Config)
+        """
+        self.base_url = base_url or Config.LLM_BASE_URL
+        self.api_key = api_key or Config.LLM_API_KEY
+        self.batch_dir = batch_dir or Config.LLM_BATCH_DIR
+        super().__init__(
+            model=model,
+            temperature=temperature,
+            enable_thinking=enable_thinking,
+            cache=cache,
+            memory_cache=memory_cache,
+        )
+
+        # 待提交的请求 {custom_id: request}
+        self.requests = {}
+        # 各请求是否为 JSON 输出 {custom_id: bool}
+        self.json_output = {}
+        # 各请求的用量计量标签 {custom_id: dict}
+        self.labels = {}
+
+    def _create_client(self):
+        return openai.OpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+        )
+
+    def add_request(
+        self,
+        prompt,
+        system_prompt=None,
+        max_tokens=4096,
+        thinking_budget=4096,
+        json_output=False,
+        labels=None,
+    ):
+        """
+        添加一条请求 (已缓存或已添加的请求自动跳过)
+        参数同 LLMClient.get_response
+
+        :return: custom_id (即缓存键)
+        """
+        model = self.default_model
+        messages = self._build_messages(prompt, system_prompt)
+        key_params = {
+            'model': model,
+            'temperature': self.temperature,
+            'max_tokens': max_tokens,
+            'enable_thinking': self.enable_thinking,
+            'thinking_budget': thinking_budget,
+            'json_output': json_output,
+        }
+        cache_key = self._build_cache_key(messages=messages, **key_params)
+
+        if cache_key in self.requests or self._read_cache(cache_key, messages, key_params)[0]:
+            return cache_key
+
+        request_kwargs = self._build_request_kwargs(
+            model=model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=False,
+            enable_thinking=self.enable_thinking,
+            thinking_budget=thinking_budget,
+            json_output=json_output,
+        )
+        body = self._batch_body(request_kwargs)
+        self.requests[cache_key] = {
+            'custom_id': cache_key,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': body,
+        }
+        self.json_output[cache_key] = json_output
+        self.labels[cache_key] = labels
+        return cache_key
+
+    @staticmethod
+    def _batch_body(request_kwargs):
+        """
+        将 SDK 请求参数转换为 Batch 请求体
+        Batch 接口按原样转发请求体：extra_body 是 OpenAI SDK 的参数，其内容须合并到顶层
+        Batch 接口不支持流式输出，去掉 stream
+
+        :param request_kwargs: _build_request_kwargs 生成的请求参数
+        :return: 请求体 dict
+        """
+        body = {k: v for k, v in request_kwargs.items() if k not in ('extra_body', 'stream', 'stream_options')}
+        body.update(request_kwargs.get('extra_body') or {})
+        return body
+
+    def add_texts(self, tagger, texts):
+        """
+        按标注器 (llm 模式) 的 Prompt 添加待标注文本
+        分块模式下逐块添加
+
+        :param tagger: POSTagger 或 SEMTagger 实例
+        :param texts: 输入文本列表 [list]
+        :return: 新增请求数
+        """
+        if tagger.pipeline.default_model != self.default_model:
+            logger.warning(
+                f'标注器模型 ({tagger.pipeline.default_model}) 与 Batch 模型 '
+                f'({self.default_model}) 不一致，tag() 将无法命中缓存'
+            )
+
+        count = len(self.requests)
+        for text in texts:
+            result = tagger._preprocess(text)
+            for chunk in tagger._split_chunks(result):
+                self.add_request(
+                    tagger._build_prompt(chunk),
+                    system_prompt=tagger.system_prompt,
+                    json_output=True,
+                    labels=tagger.usage_labels,
+                )
+        return len(self.requests) - count
+
+    def write_jsonl(self, name='batch', max_requests=50000):
+        """
+        写入 JSONL 请求文件
+        百炼单个文件最多 50,000 条请求，超出时拆分为多个文件
+
+        :param name: 文件名前缀
+        :param max_requests: 单个文件的最大请求数
+        :return: 文件路径列表 [list]
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        requests = list(self.requests.values())
+
+        paths = []
+        for i in range(0, len(requests), max_requests):
+            path = os.path.join(self.batch_dir, f'{name}_{i // max_requests:04d}.jsonl')
+            with open(path, 'wt', encoding='utf-8') as fout, \
+                    open(self._meta_path(path), 'wt', encoding='utf-8') as fmeta:
+                for request in requests[i:i + max_requests]:
+                    custom_id = request['custom_id']
+                    fout.write(json.dumps(request, ensure_ascii=False) + '\n')
+                    # 各请求的元数据 (Batch 接口不接受额外字段，另存文件供 download 重新载入)
+                    meta = {
+                        'custom_id': custom_id,
+                        'json_output': self.json_output.get(custom_id, True),
+                        'labels': self.labels.get(custom_id),
+                    }
+                    fmeta.write(json.dumps(meta, ensure_ascii=False) + '\n')
+            paths.append(path)
+        logger.info(f'写入 {len(requests)} 条请求，共 {len(paths)} 个文件')
+        return paths
+
+    def submit(self, path, completion_window='24h'):
+        """
+        上传请求文件并提交 Batch 任务
+
+        :param path: JSONL 请求文件路径
+        :param completion_window: 任务完成时限
+        :return: Batch 任务 ID
+        """
+        with open(path, 'rb') as fin:
+            input_file = self.client.files.create(file=fin, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window=completion_window,
+        )
+        logger.info(f'Batch 任务已提交：{batch.id} ({os.path.basename(path)})')
+
+        # 记录任务对应的请求文件，其他进程 download 时据此载入请求元数据
+        with open(os.path.join(self.batch_dir, f'{batch.id}.json'), 'wt', encoding='utf-8') as fout:
+            json.dump({'batch_id': batch.id, 'input_file': os.path.abspath(path)}, fout, ensure_ascii=False)
+        return batch.id
+
+    @staticmethod
+    def _meta_path(path):
+        """
+        请求文件对应的元数据文件路径 (batch_0000.jsonl -> batch_0000.meta.jsonl)
+        """
+        return os.path.splitext(path)[0] + '.meta.jsonl'
+
+    def _load_requests(self, batch_id):
+        """
+        由 batch_dir 中的记录载入任务的请求及元数据 (内存中已有的请求不覆盖)
+        用于在提交任务以外的进程中 download
+
+        :param batch_id: Batch 任务 ID
+        :return: 载入的请求数
+        """
+        index_path = os.path.join(self.batch_dir, f'{batch_id}.json')
+        if not os.path.exists(index_path):
+            return 0
+        with open(index_path, 'rt', encoding='utf-8') as fin:
+            path = json.load(fin)['input_file']
+
+        count = 0
+        with open(path, 'rt', encoding='utf-8') as fin:
+            for line in fin:
+                if line.strip():
+                    request = json.loads(line)
+                    if request['custom_id'] not in self.requests:
+                        self.requests[request['custom_id']] = request
+                        count += 1
+
+        meta_path = self._meta_path(path)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'rt', encoding='utf-8') as fin:
+                for line in fin:
+                    if line.strip():
+                        meta = json.loads(line)
+                        self.json_output.setdefault(meta['custom_id'], meta['json_output'])
+                        self.labels.setdefault(meta['custom_id'], meta['labels'])
+        return count
+
+    def wait(self, batch_id, poll_interval=60, timeout=None):
+        """
+        轮询 Batch 任务直至结束
+
+        :param batch_id: Batch 任务 ID
+        :param poll_interval: 轮询间隔秒数
+        :param timeout: 最长等待秒数 (None 表示不限)
+        :return: Batch 任务对象
+        """
+        start = time.monotonic()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts:
+                logger.info(f'Batch 任务 {batch_id}：{batch.status} '
+                            f'({counts.completed}/{counts.total} 完成，{counts.failed} 失败)')
+            else:
+                logger.info(f'Batch 任务 {batch_id}：{batch.status}')
+
+            if batch.status in FINAL_STATUS:
+                return batch
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f'Batch 任务 {batch_id} 超时未完成')
+            time.sleep(poll_interval)
+
+    def download(self, batch):
+        """
+        下载 Batch 结果，解析后写入缓存
+
+        :param batch: Batch 任务对象或任务 ID
+        :return: 写入缓存的条目数
+        """
+        if isinstance(batch, str):
+            batch = self.client.batches.retrieve(batch)
+        self._load_requests(batch.id)
+
+        if batch.error_file_id:
+            errors = self.client.files.content(batch.error_file_id).text
+            num_errors = sum(1 for line in errors.splitlines() if line.strip())
+            logger.warning(f'Batch 任务 {batch.id} 有 {num_errors} 条请求失败')
+
+        if not batch.output_file_id:
+            logger.error(f'Batch 任务 {batch.id} 无输出文件 (状态：{batch.status})')
+            return 0
+
+        output = self.client.files.content(batch.output_file_id).text
+
+        count = 0
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id = record['custom_id']
+            response = record.get('response') or {}
+            if response.get('status_code') != 200:
+                logger.warning(f'请求失败：{custom_id} {record.get("error")}')
+                continue
+
+            self._record_usage(
+                self.default_model,
+                response['body'].get('usage'),
+                labels=self.labels.pop(custom_id, None),
+                price_factor=BATCH_PRICE_FACTOR,
+            )
+            content = response['body']['choices'][0]['message']['content'] or ''
+            result = content.strip()
+
+            # 解析 JSON (未知请求按 JSON 输出处理)
+            if self.json_output.pop(custom_id, True):
+                result = self._parse_json(content)
+
+            # 写入缓存
+            self.cache_tiers.set(custom_id, result)
+            self.requests.pop(custom_id, None)
+            count += 1
+
+        logger.info(f'Batch 任务 {batch.id}：{count} 条结果写入缓存 (前缀缓存命中率 {self.prompt_cache_stats.hit_rate:.1%})')
+        return count
+
+    def run(self, name='batch', poll_interval=60, timeout=None):
+        """
+        写入请求文件、提交任务、等待完成并下载结果
+
+        :param name: 文件名前缀
+        :param poll_interval: 轮询间隔秒数
+        :param timeout: 单个任务的最长等待秒数
+        :return: 写入缓存的条目数
+        """
+        if not self.requests:
+            logger.info('没有待提交的请求 (均已缓存)')
+            return 0
+
+        batch_ids = [self.submit(path) for path in self.write_jsonl(name=name)]
+
+        count = 0
+        for batch_id in batch_ids:
+            batch = self.wait(batch_id, poll_interval=poll_interval, timeout=timeout)
+            count += self.download(batch)
+        return count
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    import re
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from src.cache import open_cache
+    from src.annotator.pos_tagger import POSTagger
+
+    class StubBatchHandler(BaseHTTPRequestHandler):
+        """
+        本地 Batch 测试服务 (仅实现 files 及 batches 接口，提交后立即完成)
+        回复内容为 {"echo": user 消息}
+        """
+
+        files = {}
+        batches = {}
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, content_type='application/json', status=200):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            match = re.fullmatch(r'/v1/files/([\w-]+)/content', self.path)
+            if match and match.group(1) in self.files:
+                return self._send(self.files[match.group(1)], content_type='application/jsonl')
+            match = re.fullmatch(r'/v1/batches/([\w-]+)', self.path)
+            if match and match.group(1) in self.batches:
+                return self._send(self.batches[match.group(1)])
+            self._send({'error': {'message': 'not found'}}, status=404)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path == '/v1/files':
+                # multipart/form-data：取 file 字段的内容
+                boundary = self.headers.get_param('boundary').encode('utf-8')
+                part = next(p for p in body.split(b'--' + boundary) if b'name="file"' in p)
+                content = part.split(b'\r\n\r\n', 1)[1][:-2]
+                file_id = f'file-{len(self.files)}'
+                self.files[file_id] = content
+                return self._send({'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': 0,
+                                   'filename': 'batch.jsonl', 'purpose': 'batch', 'status': 'processed'})
+            if self.path == '/v1/batches':
+                params = json.loads(body)
+                output = []
+                for line in self.files[params['input_file_id']].decode('utf-8').splitlines():
+                    request = json.loads(line)
+                    reply = json.dumps({'echo': request['body']['messages'][-1]['content']}, ensure_ascii=False)
+                    output.append(json.dumps({
+                        'id': f'req-{len(output)}',
+                        'custom_id': request['custom_id'],
+                        'response': {'status_code': 200, 'body': {
+                            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}}],
+                            'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+                        }},
+                    }, ensure_ascii=False))
+                output_file_id = f'file-{len(self.files)}'
+                self.files[output_file_id] = '\n'.join(output).encode('utf-8')
+                batch_id = f'batch-{len(self.batches)}'
+                self.batches[batch_id] = {
+                    'id': batch_id, 'object': 'batch', 'endpoint': params['endpoint'],
+                    'input_file_id': params['input_file_id'], 'completion_window': params['completion_window'],
+                    'status': 'completed', 'output_file_id': output_file_id, 'created_at': 0,
+                    'request_counts': {'total': len(output), 'completed': len(output), 'failed': 0},
+                }
+                return self._send(self.batches[batch_id])
+            self._send({'error': {'message': 'not found'}}, status=404)
+
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), StubBatchHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f'http://127.0.0.1:{stub.server_address[1]}/v1'
+    tmp_dir = tempfile.mkdtemp()
+    stub_kwargs = {
+        'base_url': stub_url,
+        'api_key': 'sk-stub',
+        'batch_dir': os.path.join(tmp_dir, 'batch'),
+        'cache': open_cache(os.path.join(tmp_dir, 'cache')),
+    }
+
+    print(f'\n测试 1: 本地 Batch 测试服务 (提交与下载在不同客户端)')
+    print(f'{"=" * 30}')
+    submitter = BatchLLMClient(**stub_kwargs)
+    submitter.add_request('那天晚上我没走掉。', json_output=True, labels={'tagger': 'stub'})
+    submitter.add_request('陈清扬把我拽住。', json_output=False, labels={'tagger': 'stub'})
+    paths = submitter.write_jsonl(name='stub')
+
+    # 请求文件中的请求体：思考参数位于顶层，不含 SDK 专用的 extra_body 及 stream
+    with open(paths[0], 'rt', encoding='utf-8') as fin:
+        body = json.loads(fin.readline())['body']
+    assert 'extra_body' not in body and 'stream' not in body, body
+    assert body['enable_thinking'] is False and body['thinking_budget'] == 4096, body
+    print(f'[请求体]：{sorted(body)}')
+    batch_ids = [submitter.submit(path) for path in paths]
+
+    # 新的客户端只凭 Batch 任务 ID 下载，请求元数据由 batch_dir 载入
+    downloader = BatchLLMClient(**stub_kwargs)
+    print(f'[写入缓存]：{sum(downloader.download(batch_id) for batch_id in batch_ids)} 条')
+    print(f'[待提交请求]：{len(downloader.requests)} 条')
+    checker = BatchLLMClient(**stub_kwargs)
+    for prompt in ['那天晚上我没走掉。', '陈清扬把我拽住。']:
+        key = checker.add_request(prompt, json_output=prompt.endswith('掉。'))
+        print(f'[缓存结果]：{checker.cache_tiers.get(key, count=False)[1]!r}')
+    print(f'[用量标签]：{[record["tagger"] for record in downloader.usage_meter.records]}')
+    stub.shutdown()
+
+    llm_model = 'qwen3-max'
+    zh_texts = [
+        '那天晚上我没走掉。',
+        '陈清扬把我拽住，以伟大友谊的名义叫我留下来。',
+    ]
+
+    print(f'\n测试 2: Batch 中文词性标注')
+    print(f'{"=" * 30}')
+    zh_pos_tagger = POSTagger(lang='chinese', tagset='pku', mode='llm', llm_model=llm_model)
+    batch_client = BatchLLMClient(model=llm_model, cache=zh_pos_tagger.pipeline.cache)
+    batch_client.add_texts(zh_pos_tagger, zh_texts)
+    batch_client.run(poll_interval=30)
+
+    # 结果已写入缓存
+    for zh_text in zh_texts:
+        print(f'[标注结果]：{zh_pos_tagger.tag(zh_text)}')
@@ -0,0 +1,1190 @@
+# bfsujason@163.com
+# python -m src.cache
+
+# 大模型缓存工具：缓存键生成、旧版缓存迁移、缓存值压缩、容量与有效期设置、缓存后端、进程内缓存层及请求合并
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import pickle
+import struct
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import diskcache
+from diskcache.core import MODE_PICKLE, UNKNOWN
+
+from src.config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 缓存键版本
+# 1: 模型名称 + 完整 Prompt 拼接 (已弃用)
+# 2: 模型名称 + 请求参数的 SHA-256 摘要
+CACHE_KEY_VERSION = 2
+CACHE_KEY_VERSION_KEY = '__cache_key_version__'
+
+# 旧版缓存键的分隔符
+_LEGACY_SEP = '|||'
+
+def make_cache_key(
+    model,
+    messages,
+    enable_thinking=False,
+    temperature=0.1,
+    max_tokens=4096,
+    thinking_budget=4096,
+    json_output=False,
+):
+    """
+    生成定长缓存键
+    对全部请求参数做规范化 JSON 序列化后计算 SHA-256 摘要
+    保留模型名称作为前缀，便于按模型维护缓存
+
+    :param model: 大模型名称
+    :param messages: 消息列表 [{'role': ..., 'content': ...}]
+    :param enable_thinking: 思考模式
+    :param temperature: 采样温度系数
+    :param max_tokens: 最大输出长度
+    :param thinking_budget: 思考过程的最大长度 (仅思考模式下计入)
+    :param json_output: JSON 格式输出
+    :return: 缓存键 str，形如 kimi-k2.5:<64 位十六进制摘要>
+    """
+    params = {
+        'model': model,
+        'messages': [
+            {'role': message['role'], 'content': message['content']}
+            for message in messages
+        ],
+        'enable_thinking': bool(enable_thinking),
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'json_output': bool(json_output),
+    }
+    if enable_thinking:
+        params['thinking_budget'] = thinking_budget
+
+    payload = json.dumps(
+        params,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return f'{model}:{digest}'
+
+def parse_legacy_key(cache_key):
+    """
+    解析旧版缓存键
+    格式：[THINK|||]model|||[system_prompt|||]prompt
+
+    :param cache_key: 旧版缓存键
+    :return: (model, messages, enable_thinking)，无法解析时返回 None
+    """
+    if not isinstance(cache_key, str) or _LEGACY_SEP not in cache_key:
+        return None
+
+    parts = cache_key.split(_LEGACY_SEP)
+    enable_thinking = False
+    if parts[0] == 'THINK':
+        enable_thinking = True
+        parts = parts[1:]
+
+    model, contents = parts[0], parts[1:]
+    if len(contents) == 1:
+        messages = [{'role': 'user', 'content': contents[0]}]
+    elif len(contents) == 2:
+        messages = [
+            {'role': 'system', 'content': contents[0]},
+            {'role': 'user', 'content': contents[1]},
+        ]
+    else:
+        # Prompt 中含有分隔符，无法还原消息
+        return None
+    return model, messages, enable_thinking
+
+def migrate_cache(cache, temperature=0.1, max_tokens=4096, thinking_budget=4096):
+    """
+    将旧版缓存键迁移为摘要缓存键 (仅在首次打开时执行)
+    旧版缓存键不含采样参数，按 LLMClient 的默认参数补全
+    JSON 模式由缓存值类型推断 (字符串为普通输出)
+
+    :param cache: diskcache.Cache 实例
+    :return: 迁移条目数
+    """
+    if cache.get(CACHE_KEY_VERSION_KEY) == CACHE_KEY_VERSION:
+        return 0
+
+    migrated, dropped = 0, 0
+    with cache.transact():
+        # 其他进程可能已完成迁移
+        if cache.get(CACHE_KEY_VERSION_KEY) == CACHE_KEY_VERSION:
+            return 0
+
+        legacy_keys = [
+            key for key in cache.iterkeys()
+            if isinstance(key, str) and _LEGACY_SEP in key
+        ]
+        for key in legacy_keys:
+            parsed = parse_legacy_key(key)
+            value = cache.get(key)
+            if parsed is not None:
+                model, messages, enable_thinking = parsed
+                new_key = make_cache_key(
+                    model,
+                    messages,
+                    enable_thinking=enable_thinking,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    thinking_budget=thinking_budget,
+                    json_output=not isinstance(value, str),
+                )
+                write_cache(cache, new_key, value)
+                migrated += 1
+            else:
+                dropped += 1
+            del cache[key]
+
+        cache.set(CACHE_KEY_VERSION_KEY, CACHE_KEY_VERSION)
+
+    if migrated or dropped:
+        logger.info(f'缓存键迁移完毕！迁移：{migrated} 条 丢弃：{dropped} 条')
+    return migrated
+
+# === 缓存值压缩 ===
+
+# 压缩格式：文件头 (标识、版本、压缩算法、赋码表、字典编号) + 压缩后的 JSON
+# 标识以 0xff 开头，不会与 pickle 数据混淆 (旧版缓存值按 pickle 读取)
+_CODEC_MAGIC = b'\xffC'
+_CODEC_VERSION = 1
+_CODEC_HEADER = struct.Struct('<2sBBBI')
+
+_COMPRESSORS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+# 可由赋码还原 desc 的标注集 (编号写入文件头，0 表示未去除 desc)
+_DESC_TABLES = {1: 'claws', 2: 'pku', 3: 'usas'}
+
+# 压缩字典文件 (位于缓存目录)：codec.dict 为当前字典，codec-<编号>.dict 保留各版本字典用于读取旧条目
+_DICT_FILE = 'codec.dict'
+_DICT_ARCHIVE = 'codec-{:08x}.dict'
+
+# 编码标记文件 (位于缓存目录)：记录缓存值的编码版本，提示须以 open_cache() 打开
+# 直接用 diskcache.Cache 打开时 pickle 无法读取压缩后的缓存值 (UnpicklingError)
+_MARKER_FILE = 'codec.json'
+
+_desc_tables = {}
+
+def _get_desc_table(table_id):
+    if table_id not in _desc_tables:
+        from src.annotator.doc import load_tagset_table
+        _desc_tables[table_id] = load_tagset_table(_DESC_TABLES[table_id])
+    return _desc_tables[table_id]
+
+def _is_json(value):
+    """
+    值能否经 JSON 无损往返 (大模型 JSON 输出均为此类)
+    """
+    if value is None or type(value) in (str, bool, int, float):
+        return True
+    if type(value) is list:
+        return all(_is_json(item) for item in value)
+    if type(value) is dict:
+        return all(type(key) is str and _is_json(item) for key, item in value.items())
+    return False
+
+def _desc_strippable(item):
+    # desc 紧跟在 tag 之后，还原时可保持键的顺序
+    if type(item) is not dict or 'desc' not in item or 'tag' not in item:
+        return False
+    keys = list(item)
+    return keys.index('desc') == keys.index('tag') + 1
+
+def strip_desc(value):
+    """
+    去除标注结果中可由赋码推导的 desc (与标注集说明中的描述完全一致时)
+
+    :param value: 缓存值 (如 [{'token': ..., 'tag': ..., 'desc': ...}])
+    :return: (赋码表编号, 去除 desc 后的值)，无法去除时编号为 0
+    """
+    if type(value) is not list or not value or not all(_desc_strippable(item) for item in value):
+        return 0, value
+
+    # 选择匹配条目最多的标注集
+    best_id, best_count = 0, 0
+    for table_id in _DESC_TABLES:
+        table = _get_desc_table(table_id)
+        count = sum(1 for item in value if table.get(item['tag']) == item['desc'])
+        if count > best_count:
+            best_id, best_count = table_id, count
+    if not best_id:
+        return 0, value
+
+    table = _get_desc_table(best_id)
+    stripped = []
+    for item in value:
+        if table.get(item['tag']) == item['desc']:
+            item = {key: item_value for key, item_value in item.items() if key != 'desc'}
+        stripped.append(item)
+    return best_id, stripped
+
+def restore_desc(table_id, value):
+    """
+    按标注集说明补回 desc (strip_desc 的逆操作)
+    """
+    if not table_id:
+        return value
+    table = _get_desc_table(table_id)
+    restored = []
+    for item in value:
+        if 'desc' not in item:
+            rebuilt = {}
+            for key, item_value in item.items():
+                rebuilt[key] = item_value
+                if key == 'tag':
+                    rebuilt['desc'] = table.get(item_value)
+            item = rebuilt
+        restored.append(item)
+    return restored
+
+def _dict_id(data):
+    return zlib.crc32(data) or 1
+
+class ValueCodec:
+    """
+    缓存值编解码：去除 desc → 紧凑 JSON → zlib / zstd 压缩 (可选压缩字典)
+    """
+
+    def __init__(self, compressor='zlib', level=None, dict_dir=None):
+        """
+        :param compressor: none | zlib | zstd (zstd 需安装 zstandard)
+        :param level: 压缩级别 (默认 zlib 为 6，zstd 为 3)
+        :param dict_dir: 压缩字典所在目录 (通常为缓存目录)
+        """
+        if compressor not in _COMPRESSORS:
+            raise ValueError(f'不支持的缓存压缩算法 {compressor}，可选：{" | ".join(_COMPRESSORS)}')
+        self.compressor = compressor
+        self.level = level
+        self.dict_dir = dict_dir
+        self._lock = threading.Lock()
+        # {字典编号: 字典内容}
+        self._dicts = {}
+        self._zstd = {}
+        self.dict_id = 0
+        self.load_dictionary()
+
+    # === 压缩字典 ===
+
+    def load_dictionary(self):
+        """
+        读取当前压缩字典 (codec.dict)，不存在时不使用字典
+        """
+        self.dict_id = 0
+        if self.dict_dir is None:
+            return
+        path = os.path.join(self.dict_dir, _DICT_FILE)
+        if os.path.exists(path):
+            with open(path, 'rb') as fin:
+                data = fin.read()
+            self.dict_id = _dict_id(data)
+            self._dicts[self.dict_id] = data
+
+    def _get_dictionary(self, dict_id):
+        if not dict_id:
+            return None
+        with self._lock:
+            if dict_id not in self._dicts:
+                path = os.path.join(self.dict_dir or '', _DICT_ARCHIVE.format(dict_id))
+                if not os.path.exists(path):
+                    raise ValueError(f'缺少缓存压缩字典：{path}')
+                with open(path, 'rb') as fin:
+                    self._dicts[dict_id] = fin.read()
+            return self._dicts[dict_id]
+
+    def _zstd_codec(self, dict_id):
+        # (压缩器, 解压器) 按字典缓存，zstandard 对象非线程安全，按线程区分
+        import zstandard
+
+        key = (dict_id, threading.get_ident())
+        if key not in self._zstd:
+            data = self._get_dictionary(dict_id)
+            dict_data = zstandard.ZstdCompressionDict(data) if data else None
+            level = 3 if self.level is None else self.level
+            self._zstd[key] = (
+                zstandard.ZstdCompressor(level=level, dict_data=dict_data),
+                zstandard.ZstdDecompressor(dict_data=dict_data),
+            )
+        return self._zstd[key]
+
+    # === 编解码 ===
+
+    @staticmethod
+    def serialize(value):
+        """
+        :return: (赋码表编号, JSON 字节串)
+        """
+        table_id, value = strip_desc(value)
+        data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return table_id, data
+
+    def encode(self, value):
+        """
+        :param value: 可 JSON 序列化的缓存值
+        :return: 字节串
+        """
+        table_id, data = self.serialize(value)
+        compressor = self.compressor
+        dict_id = self.dict_id if compressor != 'none' else 0
+
+        if compressor == 'zlib':
+            zdict = self._get_dictionary(dict_id)
+            level = 6 if self.level is None else self.level
+            compress = zlib.compressobj(level, zdict=zdict) if zdict else zlib.compressobj(level)
+            data = compress.compress(data) + compress.flush()
+        elif compressor == 'zstd':
+            data = self._zstd_codec(dict_id)[0].compress(data)
+
+        header = _CODEC_HEADER.pack(_CODEC_MAGIC, _CODEC_VERSION, _COMPRESSORS[compressor], table_id, dict_id)
+        return header + data
+
+    def decode(self, blob):
+        """
+        :param blob: encode() 生成的字节串
+        :return: 缓存值
+        """
+        _, version, compressor, table_id, dict_id = _CODEC_HEADER.unpack_from(blob)
+        if version != _CODEC_VERSION:
+            raise ValueError(f'不支持的缓存值格式版本：{version}')
+        data = memoryview(blob)[_CODEC_HEADER.size:]
+
+        if compressor == _COMPRESSORS['zlib']:
+            zdict = self._get_dictionary(dict_id)
+            decompress = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+            data = decompress.decompress(data) + decompress.flush()
+        elif compressor == _COMPRESSORS['zstd']:
+            data = self._zstd_codec(dict_id)[1].decompress(data)
+
+        return restore_desc(table_id, json.loads(bytes(data).decode('utf-8')))
+
+    @staticmethod
+    def is_encoded(blob):
+        return blob[:len(_CODEC_MAGIC)] == _CODEC_MAGIC
+
+class CodecDisk(diskcache.Disk):
+    """
+    diskcache 的序列化层：JSON 类缓存值经 ValueCodec 压缩后存储，其余值按 diskcache 默认方式存储
+    旧版 (pickle) 缓存值照常读取
+    写入的目录不能再用默认的 diskcache.Disk 读取，应通过 open_cache() 打开 (检查并写入编码标记文件)
+
+    cache = diskcache.Cache(directory, disk=CodecDisk)
+    """
+
+    def __init__(self, directory, codec=None, codec_level=None, **kwargs):
+        """
+        :param directory: 缓存目录
+        :param codec: none | zlib | zstd (默认读取 Config.LLM_CACHE_CODEC)
+                      none 时按 diskcache 默认方式 (pickle) 写入，目录仍可由 diskcache.Cache 读取
+        :param codec_level: 压缩级别
+        """
+        super().__init__(directory, **kwargs)
+        self.codec = ValueCodec(codec or Config.LLM_CACHE_CODEC, codec_level, dict_dir=directory)
+
+    def store(self, value, read, key=UNKNOWN):
+        # 不压缩时及字符串、数值、字节串、文件按 diskcache 默认方式存储
+        if (read or self.codec.compressor == 'none'
+                or type(value) in (str, bytes, int, float) or not _is_json(value)):
+            return super().store(value, read, key=key)
+
+        blob = self.codec.encode(value)
+        if len(blob) < self.min_file_size:
+            return 0, MODE_PICKLE, None, sqlite3.Binary(blob)
+        filename, full_path = self.filename(key, value)
+        self._write(full_path, io.BytesIO(blob), 'xb')
+        return len(blob), MODE_PICKLE, filename, None
+
+    def fetch(self, mode, filename, value, read):
+        if mode != MODE_PICKLE:
+            return super().fetch(mode, filename, value, read)
+
+        if value is None:
+            with open(os.path.join(self._directory, filename), 'rb') as fin:
+                blob = fin.read()
+        else:
+            blob = bytes(value)
+        if ValueCodec.is_encoded(blob):
+            return self.codec.decode(blob)
+        return pickle.loads(blob)
+
+# === 容量与有效期 ===
+
+# 单位不区分大小写，B 可省略 (500M 即 500MB)
+_SIZE_UNITS = {
+    '': 1, 'B': 1,
+    'K': 1024, 'KB': 1024,
+    'M': 1024 ** 2, 'MB': 1024 ** 2,
+    'G': 1024 ** 3, 'GB': 1024 ** 3,
+    'T': 1024 ** 4, 'TB': 1024 ** 4,
+}
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_size(text):
+    """
+    :param text: 容量，如 500MB、20GB、500M 或字节数
+    :return: 字节数 int
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*', str(text))
+    unit = match.group(2).upper() if match else None
+    if unit not in _SIZE_UNITS:
+        raise ValueError(f'无法解析缓存容量：{text!r} (单位可选：B、KB、MB、GB、TB)')
+    return int(float(match.group(1)) * _SIZE_UNITS[unit])
+
+def parse_duration(text):
+    """
+    :param text: 时长，如 90d、12h 或秒数
+    :return: 秒数 int (0 或空表示不过期，返回 None)
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)?\s*([smhd]?)\s*', str(text or ''))
+    if not match:
+        raise ValueError(f'无法解析缓存有效期：{text}')
+    seconds = int(float(match.group(1) or 0) * _DURATION_UNITS[match.group(2)])
+    return seconds or None
+
+def parse_ttl(text):
+    """
+    :param text: 各模型有效期，如 glm-4.7=7d,*=180d
+    :return: {模型名称: 秒数或 None}
+    """
+    ttl = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        model, sep, duration = item.partition('=')
+        if not sep:
+            raise ValueError(f'无法解析缓存有效期 (格式为 模型=时长)：{item}')
+        ttl[model.strip()] = parse_duration(duration)
+    return ttl
+
+_ttl_cache = {}
+
+def cache_ttl(model):
+    """
+    按 Config.LLM_CACHE_TTL 查询模型的缓存有效期
+
+    :return: 秒数 (不过期时为 None)
+    """
+    text = Config.LLM_CACHE_TTL
+    if text not in _ttl_cache:
+        _ttl_cache[text] = parse_ttl(text)
+    ttl = _ttl_cache[text]
+    return ttl.get(model, ttl.get('*'))
+
+def key_model(cache_key):
+    """
+    :param cache_key: 缓存键 (形如 kimi-k2.5:<摘要>)
+    :return: 模型名称 (非摘要缓存键返回 None)
+    """
+    if isinstance(cache_key, str) and ':' in cache_key and _LEGACY_SEP not in cache_key:
+        return cache_key.rsplit(':', 1)[0]
+    return None
+
+def write_cache(cache, cache_key, value):
+    """
+    写入缓存：按模型设置有效期，并以模型名称作为标签 (evict_model 按标签删除)
+    """
+    model = key_model(cache_key)
+    cache.set(cache_key, value, expire=cache_ttl(model), tag=model)
+
+def check_codec_marker(directory):
+    """
+    检查缓存目录的编码标记文件 (codec.json)，不存在时写入
+    标记的编码版本高于当前代码支持的版本时报错，而不是在 diskcache 内部解码失败
+
+    :param directory: 缓存目录
+    :return: 编码版本
+    """
+    path = os.path.join(directory, _MARKER_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, 'rt', encoding='utf-8') as fin:
+                version = int(json.load(fin)['codec_version'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'无法读取缓存编码标记文件 {path}：{e}') from None
+        if version > _CODEC_VERSION:
+            raise ValueError(
+                f'缓存目录 {directory} 的编码版本为 {version}，当前代码只支持 {_CODEC_VERSION} 及以下版本，请更新代码'
+            )
+        return version
+
+    os.makedirs(directory, exist_ok=True)
+    marker = {
+        'codec_version': _CODEC_VERSION,
+        'disk': 'src.cache.CodecDisk',
+        'note': 'Values are encoded by src.cache.CodecDisk. Open this directory with src.cache.open_cache(); '
+                'a bare diskcache.Cache fails with UnpicklingError.',
+    }
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wt', encoding='utf-8') as fout:
+        json.dump(marker, fout, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return _CODEC_VERSION
+
+def open_cache(directory=None, **settings):
+    """
+    打开大模型缓存 (值经 CodecDisk 压缩，容量上限及淘汰策略读取 Config)
+    淘汰策略为 least-recently-stored 时读取缓存不写库；least-recently-used 等策略每次命中都要更新访问记录
+    缓存目录中的 codec.json 标记编码版本 (见 check_codec_marker)
+
+    :param directory: 缓存目录 (默认为 Config.LLM_CACHE_DIR)
+    :param settings: 其他 diskcache 设置 (如 size_limit、eviction_policy、cull_limit)
+    :return: diskcache.Cache 实例
+    """
+    directory = directory or Config.LLM_CACHE_DIR
+    settings.setdefault('size_limit', parse_size(Config.LLM_CACHE_SIZE_LIMIT))
+    settings.setdefault('eviction_policy', Config.LLM_CACHE_EVICTION)
+    if settings['eviction_policy'] not in diskcache.EVICTION_POLICY:
+        raise ValueError(
+            f'不支持的缓存淘汰策略 {settings["eviction_policy"]}，'
+            f'可选：{" | ".join(diskcache.EVICTION_POLICY)}'
+        )
+    check_codec_marker(directory)
+    return diskcache.Cache(directory, disk=CodecDisk, **settings)
+
+# === 进程内缓存层 ===
+
+# 未命中标记 (缓存值可能为 None)
+_MISSING = object()
+
+# 协程等待其他调用方结果时的轮询间隔 (秒)
+_POLL_INTERVAL = 0.05
+
+def estimate_size(value):
+    """
+    估算缓存值占用的内存字节数 (递归累加 list、dict 及字符串)
+    """
+    size = sys.getsizeof(value)
+    if type(value) is list:
+        size += sum(estimate_size(item) for item in value)
+    elif type(value) is dict:
+        size += sum(sys.getsizeof(key) + estimate_size(item) for key, item in value.items())
+    return size
+
+class MemoryCache:
+    """
+    进程内 LRU 缓存 (线程安全)
+    按条目数及字节数限制，超出时淘汰最久未用的条目
+
+    注意：命中时返回缓存中的对象本身，调用方不应修改
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=0):
+        """
+        :param max_entries: 条目数上限 (0 表示不启用)
+        :param max_bytes: 字节数上限 (0 表示不限制)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        # {缓存键: (缓存值, 字节数, 过期时间)}
+        self._items = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, _, expire_time = item
+            if expire_time is not None and expire_time <= time.time():
+                self._pop(key)
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, expire=None):
+        """
+        :param expire: 有效期秒数 (None 表示不过期)
+        """
+        if not self.enabled:
+            return
+        size = estimate_size(value) if self.max_bytes else 0
+        expire_time = time.time() + expire if expire else None
+        with self._lock:
+            # 先移除旧值 (新值超出字节数上限而不缓存时，也不能保留旧值)
+            self._pop(key)
+            if self.max_bytes and size > self.max_bytes:
+                return
+            self._items[key] = (value, size, expire_time)
+            self.nbytes += size
+            while len(self._items) > self.max_entries or (self.max_bytes and self.nbytes > self.max_bytes):
+                self._pop(next(iter(self._items)))
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+def new_memory_cache():
+    """
+    按 Config 新建进程内缓存层
+    """
+    return MemoryCache(Config.LLM_MEMORY_CACHE_SIZE, parse_size(Config.LLM_MEMORY_CACHE_BYTES))
+
+# === 缓存后端 ===
+
+class CacheBackend:
+    """
+    缓存后端接口 (TieredCache 中位于进程内缓存层之后的一级)
+    默认为本地 diskcache (DiskCacheBackend)，多节点共用缓存时为 HTTPCacheBackend (src.cache_server)
+    """
+
+    # 命中统计中的层级名称
+    tier = 'backend'
+    # acquire() 是否可能长时间阻塞 (等待其他节点)
+    blocking = False
+    # acquire() 是否同时完成查询 (未命中时 TieredCache 不再单独调用 lookup()，省去一次请求)
+    lookup_with_lease = False
+
+    def lookup(self, key):
+        """
+        :return: (是否命中, 缓存值, 过期时间戳或 None)
+        """
+        raise NotImplementedError
+
+    def store(self, key, value, expire=None, tag=None):
+        """
+        :param expire: 有效期秒数 (None 表示不过期)
+        :param tag: 标签 (模型名称)
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def acquire(self, key, timeout=None, fallback_key=None):
+        """
+        申请缓存键的租约 (跨节点请求合并)
+        未命中时调用方取得租约，之后 store() 写入结果或 release() 放弃
+        他处持有租约时等待其结果 (至多 timeout 秒)
+        默认实现不跨进程合并，只重新查询一次
+
+        :param fallback_key: 兼容键 (仅 lookup_with_lease 的后端使用)，key 未命中而兼容键命中时以 key 写入
+        :return: (是否命中, 缓存值, 过期时间戳或 None)
+        """
+        return self.lookup(key)
+
+    def release(self, key):
+        """
+        放弃租约 (请求失败时)
+        """
+
+    def close(self):
+        pass
+
+class DiskCacheBackend(CacheBackend):
+    """
+    本地 diskcache 后端
+    """
+
+    tier = 'disk'
+
+    def __init__(self, cache):
+        """
+        :param cache: diskcache.Cache 实例
+        """
+        self.cache = cache
+
+    def lookup(self, key):
+        # 一次 SQLite 查询 (不先判断 key in cache)
+        value, expire_time = self.cache.get(key, default=_MISSING, expire_time=True)
+        if value is _MISSING:
+            return False, None, None
+        return True, value, expire_time
+
+    def store(self, key, value, expire=None, tag=None):
+        self.cache.set(key, value, expire=expire, tag=tag)
+
+    def delete(self, key):
+        return self.cache.delete(key)
+
+    def close(self):
+        self.cache.close()
+
+def as_backend(cache):
+    """
+    :param cache: CacheBackend 或 diskcache.Cache 实例
+    :return: CacheBackend 实例
+    """
+    if isinstance(cache, CacheBackend):
+        return cache
+    return DiskCacheBackend(cache)
+
+def open_default_cache():
+    """
+    按 Config 打开缓存：设置了 LLM_CACHE_URL 时连接共享缓存服务，否则打开本地缓存目录
+
+    :return: HTTPCacheBackend 或 diskcache.Cache 实例
+    """
+    if Config.LLM_CACHE_URL:
+        from src.cache_server import HTTPCacheBackend
+        return HTTPCacheBackend(Config.LLM_CACHE_URL)
+    return open_cache(Config.LLM_CACHE_DIR)
+
+class _Lease:
+    """
+    进程内租约：持有者请求大模型，其他调用方等待 event
+    """
+
+    __slots__ = ('key', 'event', 'remote')
+
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+        # 是否持有后端 (跨节点) 租约
+        self.remote = False
+
+class TieredCache:
+    """
+    两级缓存：进程内 LRU (memory) → 缓存后端 (disk 或共享缓存服务)
+    每个缓存键只查询一次：先查内存，未命中时查询后端 (diskcache 为一次 SQLite 查询) 并回填内存
+    分别统计各级的命中及未命中次数
+
+    请求合并：缓存未命中时先 acquire() 取得租约，同一缓存键同时只有一个调用方请求大模型
+    其他调用方 (本进程内的线程，或经共享缓存服务的其他节点) 等待其写入的结果
+    """
+
+    def __init__(self, backend, memory=None, lease_timeout=None):
+        """
+        :param backend: CacheBackend 或 diskcache.Cache 实例
+        :param memory: MemoryCache 实例 (默认按 Config 新建)
+        :param lease_timeout: 等待其他调用方结果的最长秒数 (默认读取 Config)，超时后自行请求
+        """
+        self.backend = as_backend(backend)
+        self.memory = memory if memory is not None else new_memory_cache()
+        self.lease_timeout = lease_timeout or Config.LLM_CACHE_LEASE_TIMEOUT
+        self._lock = threading.Lock()
+        # 正在请求的缓存键 {缓存键: _Lease}
+        self._inflight = {}
+        # aacquire() 申请后端租约的线程池 (首次使用时创建)
+        self._executor = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                'memory': {'hits': 0, 'misses': 0},
+                self.backend.tier: {'hits': 0, 'misses': 0},
+            }
+            # 等待其他调用方结果而省去的请求数
+            self.coalesced = 0
+
+    def _count(self, tier, hit):
+        with self._lock:
+            self.stats[tier]['hits' if hit else 'misses'] += 1
+
+    def _record_fallback_hit(self):
+        # 缓存键未命中、兼容键命中：将该次后端未命中改记为命中
+        with self._lock:
+            counts = self.stats[self.backend.tier]
+            counts['misses'] -= 1
+            counts['hits'] += 1
+
+    def _fill_memory(self, key, value, expire_time):
+        self.memory.set(key, value, expire=expire_time - time.time() if expire_time else None)
+
+    def _get_memory(self, key, count=True):
+        if not self.memory.enabled:
+            return False, None
+        value = self.memory.get(key, _MISSING)
+        if count:
+            self._count('memory', value is not _MISSING)
+        if value is _MISSING:
+            return False, None
+        return True, value
+
+    def get(self, key, count=True, fallback_key=None):
+        """
+        :param count: 计入命中统计 (查询兼容键时不计入)
+        :param fallback_key: 兼容键 (旧版缓存键)，未命中而兼容键命中时以 key 写入并计为命中
+        :return: (是否命中, 缓存值)
+        """
+        found, value = self._get_memory(key, count)
+        if found:
+            return True, value
+
+        found, value, expire_time = self.backend.lookup(key)
+        if count:
+            self._count(self.backend.tier, found)
+        if found:
+            self._fill_memory(key, value, expire_time)
+            return True, value
+
+        if fallback_key is not None:
+            found, value = self.get(fallback_key, count=False)
+            if found:
+                if count:
+                    self._record_fallback_hit()
+                self.set(key, value)
+                return True, value
+        return False, None
+
+    def get_or_acquire(self, key, fallback_key=None):
+        """
+        查询缓存，未命中时取得租约 (即 get() 后 acquire())
+        后端支持时 (共享缓存服务) 后端查询、兼容键查询与申请租约合为一次请求
+
+        :param fallback_key: 兼容键 (同 get())
+        :return: (是否命中, 缓存值, 租约)，同 acquire()
+        """
+        if not self.backend.lookup_with_lease:
+            found, value = self.get(key, fallback_key=fallback_key)
+            if found:
+                return True, value, None
+            return self.acquire(key)
+
+        found, value = self._get_memory(key)
+        if found:
+            return True, value, None
+        return self.acquire(key, fallback_key=fallback_key, lookup=True)
+
+    async def aget_or_acquire(self, key, fallback_key=None):
+        """
+        get_or_acquire() 的协程版本
+        """
+        if not self.backend.lookup_with_lease:
+            found, value = self.get(key, fallback_key=fallback_key)
+            if found:
+                return True, value, None
+            return await self.aacquire(key)
+
+        found, value = self._get_memory(key)
+        if found:
+            return True, value, None
+        return await self.aacquire(key, fallback_key=fallback_key, lookup=True)
+
+    def set(self, key, value):
+        """
+        写入两级缓存 (后端按模型设置有效期及标签)
+        """
+        model = key_model(key)
+        expire = cache_ttl(model)
+        self.backend.store(key, value, expire=expire, tag=model)
+        self.memory.set(key, value, expire=expire)
+
+    def _claim(self, key):
+        """
+        :return: (租约, 是否由本调用方持有)
+        """
+        with self._lock:
+            lease = self._inflight.get(key)
+            if lease is None:
+                lease = self._inflight[key] = _Lease(key)
+                return lease, True
+            return lease, False
+
+    def _get_coalesced(self, key, lookup):
+        # 原持有者写入结果后读取 (lookup 时本次查询计为后端未命中)
+        found, value = self.get(key, count=False)
+        with self._lock:
+            if found:
+                self.coalesced += 1
+            if lookup:
+                self.stats[self.backend.tier]['misses'] += 1
+        return found, value
+
+    def _acquired(self, lease, result, lookup):
+        # 后端租约申请结果：已有结果时直接返回，否则持有后端租约
+        # lookup 时结果即本次查询的命中与否，否则命中说明其他节点在 get() 之后写入了结果
+        found, value, expire_time = result
+        if lookup:
+            self._count(self.backend.tier, found)
+        elif found:
+            with self._lock:
+                self.coalesced += 1
+        if found:
+            self._fill_memory(lease.key, value, expire_time)
+            self.release(lease)
+            return True, value, None
+        lease.remote = True
+        return False, None, lease
+
+    def acquire(self, key, fallback_key=None, lookup=False):
+        """
+        取得缓存键的租约 (get() 未命中后调用)
+
+        :param fallback_key: 兼容键 (后端 lookup_with_lease 时随租约申请一并查询)
+        :param lookup: 调用方未先查询后端 (get_or_acquire)，按后端结果计入命中统计
+        :return: (是否命中, 缓存值, 租约)
+                 命中 (其他调用方已写入结果) 时租约为 None
+                 未命中时调用方持有租约，请求结束后须调用 release(租约)
+        """
+        while True:
+            lease, owner = self._claim(key)
+            if owner:
+                break
+            # 本进程内已有调用方在请求同一缓存键
+            if not lease.event.wait(self.lease_timeout):
+                logger.warning(f'等待缓存结果超时，自行请求：{key}')
+                if lookup:
+                    self._count(self.backend.tier, False)
+                return False, None, None
+            found, value = self._get_coalesced(key, lookup)
+            if found:
+                return True, value, None
+            # 原调用方请求失败，重新竞争租约 (已计入统计)
+            lookup = False
+
+        # 后端租约 (共享缓存服务在各节点间合并请求)
+        try:
+            result = self.backend.acquire(key, self.lease_timeout, fallback_key)
+        except Exception:
+            self.release(lease)
+            raise
+        return self._acquired(lease, result, lookup)
+
+    async def aacquire(self, key, fallback_key=None, lookup=False):
+        """
+        acquire() 的协程版本
+        等待时不占用线程 (轮询租约状态)；可能长时间等待的后端 (共享缓存服务) 在专用线程池中申请租约
+        """
+        while True:
+            lease, owner = self._claim(key)
+            if owner:
+                break
+            deadline = time.monotonic() + self.lease_timeout
+            while not lease.event.is_set():
+                if time.monotonic() >= deadline:
+                    logger.warning(f'等待缓存结果超时，自行请求：{key}')
+                    if lookup:
+                        self._count(self.backend.tier, False)
+                    return False, None, None
+                await asyncio.sleep(_POLL_INTERVAL)
+            found, value = self._get_coalesced(key, lookup)
+            if found:
+                return True, value, None
+            lookup = False
+
+        try:
+            if self.backend.blocking:
+                # 不使用默认线程池 (事件循环的 DNS 解析等依赖默认线程池)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix='cache-lease')
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.backend.acquire, key, self.lease_timeout, fallback_key,
+                )
+            else:
+                result = self.backend.acquire(key, self.lease_timeout, fallback_key)
+        except BaseException:
+            self.release(lease)
+            raise
+        return self._acquired(lease, result, lookup)
+
+    def release(self, lease):
+        """
+        释放租约并唤醒等待的调用方 (已写入结果时后端租约随写入释放)
+
+        :param lease: acquire() 返回的租约 (None 时忽略)
+        """
+        if lease is None:
+            return
+        with self._lock:
+            if self._inflight.get(lease.key) is lease:
+                del self._inflight[lease.key]
+        if lease.remote:
+            lease.remote = False
+            self.backend.release(lease.key)
+        lease.event.set()
+
+    def report(self):
+        """
+        :return: dict {tier: {hits, misses, hit_rate}}，memory 层另含 entries 及 nbytes，另含 coalesced
+        """
+        with self._lock:
+            report = {tier: dict(counts) for tier, counts in self.stats.items()}
+            coalesced = self.coalesced
+        for counts in report.values():
+            lookups = counts['hits'] + counts['misses']
+            counts['hit_rate'] = round(counts['hits'] / lookups, 4) if lookups else 0.0
+        report['memory']['entries'] = len(self.memory)
+        report['memory']['nbytes'] = self.memory.nbytes
+        report['coalesced'] = coalesced
+        return report
+
+    def __repr__(self):
+        report = self.report()
+        tiers = ', '.join(
+            f'{tier}={report[tier]["hits"]}/{report[tier]["hits"] + report[tier]["misses"]}'
+            for tier in self.stats
+        )
+        return f'TieredCache({tiers}, coalesced={report["coalesced"]})'
+
+def evict_model(cache, model, chunk_size=1000):
+    """
+    删除某个模型的全部缓存 (如已停用的 glm-4.7)
+    先按标签删除，再按缓存键前缀删除未带标签的旧条目
+
+    :param cache: diskcache.Cache 实例
+    :param model: 模型名称
+    :return: 删除条目数
+    """
+    removed = cache.evict(model)
+    prefix = f'{model}:'
+    keys = [key for key in cache.iterkeys() if isinstance(key, str) and key.startswith(prefix)]
+    for start in range(0, len(keys), chunk_size):
+        with cache.transact():
+            for key in keys[start:start + chunk_size]:
+                removed += cache.delete(key)
+    logger.info(f'已删除模型 {model} 的缓存：{removed} 条')
+    return removed
+
+def cache_stats(cache):
+    """
+    :return: dict (entries, volume, size_limit, eviction_policy, models {模型名称: 条目数})
+    """
+    models = {}
+    for key in cache.iterkeys():
+        model = key_model(key) or '-'
+        models[model] = models.get(model, 0) + 1
+    return {
+        'entries': sum(models.values()),
+        'volume': cache.volume(),
+        'size_limit': cache.size_limit,
+        'eviction_policy': cache.eviction_policy,
+        'models': dict(sorted(models.items())),
+    }
+
+def train_dictionary(cache, dict_size=32768, max_samples=5000):
+    """
+    以缓存中的标注结果训练压缩字典，之后写入的条目使用新字典 (已有条目仍可读取)
+    zstd 使用 zstandard.train_dictionary，zlib 使用按出现频次排列的高频片段 (高频片段置于末尾)
+
+    :param cache: open_cache() 打开的缓存
+    :param dict_size: 字典大小 (zlib 最多使用 32KB)
+    :param max_samples: 最多采样的条目数
+    :return: 字典编号 (无可用样本时返回 0)
+    """
+    codec = cache.disk.codec
+    samples = []
+    for key in cache.iterkeys():
+        value = cache.get(key)
+        if not isinstance(value, (str, bytes, int, float)) and _is_json(value):
+            samples.append(ValueCodec.serialize(value)[1])
+            if len(samples) >= max_samples:
+                break
+    if not samples:
+        return 0
+
+    data = None
+    if codec.compressor == 'zstd':
+        import zstandard
+        try:
+            data = zstandard.train_dictionary(dict_size, samples).as_bytes()
+        except zstandard.ZstdError as e:
+            logger.warning(f'zstd 字典训练失败 (样本过少)，改用高频片段：{e}')
+    if data is None:
+        # 以条目中的各元素 (如 {"token":"的","tag":"u"}) 为片段
+        counts = {}
+        for sample in samples:
+            for fragment in sample.split(b'},{'):
+                counts[fragment] = counts.get(fragment, 0) + 1
+        fragments = sorted((fragment for fragment, count in counts.items() if count > 1), key=counts.get)
+        data = b''.join(fragments)[-min(dict_size, 32768):]
+        if not data:
+            return 0
+
+    dict_id = _dict_id(data)
+    for file_name in (_DICT_ARCHIVE.format(dict_id), _DICT_FILE):
+        with open(os.path.join(codec.dict_dir, file_name), 'wb') as fout:
+            fout.write(data)
+    codec.load_dictionary()
+    logger.info(f'压缩字典训练完毕！样本：{len(samples)} 条 字典：{len(data)} 字节 编号：{dict_id:08x}')
+    return dict_id
+
+def recompress_cache(cache):
+    """
+    以当前压缩设置重写缓存中的全部条目 (旧版 pickle 条目转为压缩格式，保留过期时间及标签)
+
+    :param cache: open_cache() 打开的缓存
+    :return: 重写条目数
+    """
+    volume = cache.volume()
+    count = 0
+    for key in list(cache.iterkeys()):
+        value, expire_time, tag = cache.get(key, expire_time=True, tag=True)
+        if value is None and key not in cache:
+            continue
+        expire = max(expire_time - time.time(), 0) if expire_time else None
+        # 旧条目补充模型标签
+        cache.set(key, value, expire=expire, tag=tag if tag is not None else key_model(key))
+        count += 1
+    logger.info(f'缓存重写完毕！条目：{count} 条 占用：{volume / 1024:.0f}KB → {cache.volume() / 1024:.0f}KB')
+    return count
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    import tempfile
+
+    print(f'\n测试 1: 缓存键生成')
+    print(f'{"=" * 30}')
+    messages = [{'role': 'user', 'content': 'Text: 北风如刀，满地冰霜。'}]
+    cache_key = make_cache_key('kimi-k2.5', messages, json_output=True)
+    print(f'[缓存键]：{cache_key}')
+
+    print(f'\n测试 2: 旧版缓存迁移')
+    print(f'{"=" * 30}')
+    with open_cache(tempfile.mkdtemp()) as cache:
+        cache['kimi-k2.5|||Text: 北风如刀，满地冰霜。'] = [{'token': '北风', 'tag': 'n'}]
+        migrate_cache(cache)
+        print(f'[迁移结果]：{cache.get(cache_key)}')
+
+    print(f'\n测试 3: 缓存值压缩')
+    print(f'{"=" * 30}')
+    value = [
+        {'token': '北风', 'tag': 'n', 'desc': 'Common noun'},
+        {'token': '如', 'tag': 'v', 'desc': 'Verb'},
+        {'token': '刀', 'tag': 'n', 'desc': 'Common noun'},
+    ]
+    codec = ValueCodec('zlib')
+    blob = codec.encode(value)
+    print(f'[去除 desc]：{strip_desc(value)}')
+    print(f'[压缩大小]：{len(pickle.dumps(value))} → {len(blob)} 字节')
+    print(f'[还原结果]：{codec.decode(blob) == value}')
+
+    print(f'\n测试 4: 编码标记文件')
+    print(f'{"=" * 30}')
+    cache_dir = tempfile.mkdtemp()
+    open_cache(cache_dir).close()
+    print(f'[标记文件]：{sorted(os.listdir(cache_dir))}')
+    with open(os.path.join(cache_dir, _MARKER_FILE), 'wt', encoding='utf-8') as fout:
+        json.dump({'codec_version': _CODEC_VERSION + 1}, fout)
+    try:
+        open_cache(cache_dir)
+    except ValueError as e:
+        print(f'[版本过高]：{e}')
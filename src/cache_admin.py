@@ -0,0 +1,61 @@
+# bfsujason@163.com
+# python -m src.cache_admin stats
+# python -m src.cache_admin evict glm-4.7
+
+# 大模型缓存维护命令
+# stats：各模型条目数及占用空间
+# evict：删除已停用模型的全部缓存
+# expire：删除已过期条目
+# cull：删除过期条目并按淘汰策略缩减到容量上限
+# recompress：以当前压缩设置重写全部条目 (可先训练压缩字典)
+
+import argparse
+import logging
+
+from src.config import Config
+from src.cache import cache_stats, evict_model, open_cache, recompress_cache, train_dictionary
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.cache_admin', description='大模型缓存维护')
+    parser.add_argument('--dir', default=Config.LLM_CACHE_DIR, help='缓存目录 (默认读取 Config)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('stats', help='各模型条目数及占用空间')
+    evict = commands.add_parser('evict', help='删除指定模型的全部缓存')
+    evict.add_argument('models', nargs='+', help='模型名称，如 glm-4.7')
+    commands.add_parser('expire', help='删除已过期条目')
+    commands.add_parser('cull', help='删除过期条目并缩减到容量上限')
+    recompress = commands.add_parser('recompress', help='以当前压缩设置重写全部条目')
+    recompress.add_argument('--train-dict', action='store_true', help='先训练压缩字典')
+    args = parser.parse_args(argv)
+
+    with open_cache(args.dir) as cache:
+        if args.command == 'stats':
+            stats = cache_stats(cache)
+            print(f'缓存目录：{args.dir}')
+            print(f'条目数：  {stats["entries"]}')
+            print(f'占用空间：{stats["volume"] / 1024 ** 2:.1f}MB / {stats["size_limit"] / 1024 ** 2:.0f}MB '
+                  f'({stats["eviction_policy"]})')
+            for model, count in stats['models'].items():
+                print(f'  {model:<24} {count:>10}')
+        elif args.command == 'evict':
+            for model in args.models:
+                evict_model(cache, model)
+        elif args.command == 'expire':
+            logger.info(f'已删除过期条目：{cache.expire()} 条')
+        elif args.command == 'cull':
+            logger.info(f'已删除条目：{cache.cull()} 条 (当前占用 {cache.volume() / 1024 ** 2:.1f}MB)')
+        elif args.command == 'recompress':
+            if args.train_dict:
+                train_dictionary(cache)
+            recompress_cache(cache)
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    main()
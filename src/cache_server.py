@@ -0,0 +1,416 @@
+# bfsujason@163.com
+# python -m src.cache_server --port 8765
+# LLM_CACHE_TOKEN=<令牌> python -m src.cache_server --host 0.0.0.0 --port 8765
+
+# 共享缓存服务 (多节点标注时共用大模型缓存)
+# 服务端：以 HTTP 提供本地缓存目录 (open_cache) 的读写，并在各节点间合并请求
+# 客户端：HTTPCacheBackend，在 config 中设置 LLM_CACHE_URL 后由 LLMClient 自动使用
+#
+# 接口 (缓存值以 JSON 传输)：
+#   GET    /cache/<key>          查询，命中返回 200 {"value": ..., "expire_time": ...}，未命中返回 404
+#   GET    /cache/<key>?wait=N   查询并申请租约：未命中时授予租约 (X-Cache-Lease: granted)
+#                                其他节点持有租约时至多等待 N 秒，期间写入结果则直接返回
+#                                &fallback=<key> 未命中时再查询兼容键 (旧版缓存键)，命中则以 <key> 写入
+#   PUT    /cache/<key>          写入 {"value": ..., "expire": ..., "tag": ...}，同时释放租约
+#   DELETE /cache/<key>          删除
+#   DELETE /lease/<key>          放弃租约 (请求失败时)
+#   GET    /stats                服务统计
+#
+# 设置了 LLM_CACHE_TOKEN 时所有请求须带 X-Cache-Token 请求头，否则返回 401
+# 未设置令牌时任何能访问端口的人都能读写、删除缓存，只应监听本机地址 (默认 127.0.0.1)
+
+import hmac
+import json
+import math
+import time
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.config import Config
+from src.cache import CacheBackend, cache_stats, migrate_cache, open_cache, write_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_LEASE_HEADER = 'X-Cache-Lease'
+_TOKEN_HEADER = 'X-Cache-Token'
+
+# 未命中标记
+_MISSING = object()
+
+# 连接失败、超时及响应格式错误
+_REQUEST_ERRORS = (OSError, http.client.HTTPException)
+
+# === 服务端 ===
+
+class CacheServer(ThreadingHTTPServer):
+    """
+    共享缓存服务 (每个连接一个线程)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cache, lease_ttl=None, token=None):
+        """
+        :param address: (host, port)
+        :param cache: diskcache.Cache 实例 (open_cache 打开)
+        :param lease_ttl: 租约有效期秒数 (默认为 Config.LLM_CACHE_LEASE_TIMEOUT)，持有者崩溃后租约到期自动失效
+        :param token: 访问令牌 (默认为 Config.LLM_CACHE_TOKEN，为空时不校验)
+        """
+        super().__init__(address, CacheRequestHandler)
+        self.cache = cache
+        self.lease_ttl = lease_ttl or Config.LLM_CACHE_LEASE_TIMEOUT
+        self.token = Config.LLM_CACHE_TOKEN if token is None else token
+        if not self.token and address[0] not in ('127.0.0.1', 'localhost', '::1'):
+            logger.warning(f'共享缓存服务监听 {address[0]} 但未设置 LLM_CACHE_TOKEN，任何人都能读写、删除缓存')
+        self._cond = threading.Condition()
+        # 租约 {缓存键: 到期时间}
+        self._leases = {}
+        self.stats = {
+            'lookups': 0,       # 查询次数
+            'hits': 0,          # 命中次数
+            'stores': 0,        # 写入次数
+            'leases': 0,        # 授予的租约数
+            'coalesced': 0,     # 等待其他节点结果后命中的次数
+            'busy': 0,          # 等待超时的次数
+        }
+
+    def _count(self, name):
+        with self._cond:
+            self.stats[name] += 1
+
+    def lookup(self, key):
+        """
+        :return: (是否命中, 缓存值, 过期时间戳)
+        """
+        self._count('lookups')
+        value, expire_time = self.cache.get(key, default=_MISSING, expire_time=True)
+        if value is _MISSING:
+            return False, None, None
+        self._count('hits')
+        return True, value, expire_time
+
+    def lookup_or_lease(self, key, wait, fallback=None):
+        """
+        查询缓存，未命中时授予租约；其他节点持有租约时等待其结果
+
+        :param fallback: 兼容键，key 未命中而兼容键命中时以 key 写入并返回
+        :return: (是否命中, 缓存值, 过期时间戳, 租约状态 granted | busy | None)
+        """
+        deadline = time.time() + wait
+        waited = False
+        while True:
+            found, value, expire_time = self.lookup(key)
+            if not found and fallback and not waited:
+                value = self.cache.get(fallback, default=_MISSING)
+                if value is not _MISSING:
+                    write_cache(self.cache, key, value)
+                    found, value, expire_time = self.lookup(key)
+            if found:
+                if waited:
+                    self._count('coalesced')
+                return True, value, expire_time, None
+
+            with self._cond:
+                now = time.time()
+                holder = self._leases.get(key)
+                if holder is None or holder <= now:
+                    self._leases[key] = now + self.lease_ttl
+                    self.stats['leases'] += 1
+                    return False, None, None, 'granted'
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.stats['busy'] += 1
+                    return False, None, None, 'busy'
+                # 等待写入或放弃租约 (notify_all) 后重新查询
+                self._cond.wait(min(remaining, holder - now))
+                waited = True
+
+    def store(self, key, value, expire=None, tag=None):
+        self.cache.set(key, value, expire=expire, tag=tag)
+        self._count('stores')
+        self.release(key)
+
+    def release(self, key):
+        with self._cond:
+            self._leases.pop(key, None)
+            self._cond.notify_all()
+
+    def report(self):
+        with self._cond:
+            report = dict(self.stats)
+            report['active_leases'] = len(self._leases)
+        report['cache'] = cache_stats(self.cache)
+        return report
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+
+    # 保持连接 (客户端复用连接)
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        """
+        校验访问令牌，失败时返回 401 并关闭连接 (请求体未读取)
+        """
+        token = self.server.token
+        if not token or hmac.compare_digest(self.headers.get(_TOKEN_HEADER, '').encode('utf-8'), token.encode('utf-8')):
+            return True
+        self.close_connection = True
+        self._send(401, {'error': 'unauthorized'})
+        return False
+
+    def _route(self):
+        """
+        :return: (资源类型 cache | lease | stats, 缓存键, 查询参数)
+        """
+        parts = urlsplit(self.path)
+        resource, _, key = parts.path.lstrip('/').partition('/')
+        return resource, unquote(key), parse_qs(parts.query)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        resource, key, query = self._route()
+        if resource == 'stats':
+            return self._send(200, self.server.report())
+        if resource != 'cache' or not key:
+            return self._send(404, {'error': 'not found'})
+
+        if 'wait' in query:
+            try:
+                wait = float(query['wait'][0])
+            except ValueError:
+                wait = math.nan
+            if not math.isfinite(wait):
+                return self._send(400, {'error': f'invalid wait: {query["wait"][0]}'})
+            wait = min(max(wait, 0.0), self.server.lease_ttl)
+            fallback = query.get('fallback', [None])[0]
+            found, value, expire_time, lease = self.server.lookup_or_lease(key, wait, fallback)
+        else:
+            (found, value, expire_time), lease = self.server.lookup(key), None
+        if found:
+            return self._send(200, {'value': value, 'expire_time': expire_time})
+        return self._send(404, None, {_LEASE_HEADER: lease} if lease else None)
+
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        resource, key, _ = self._route()
+        if resource != 'cache' or not key:
+            return self._send(404, {'error': 'not found'})
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            self.server.store(key, payload['value'], expire=payload.get('expire'), tag=payload.get('tag'))
+        except (ValueError, KeyError) as e:
+            return self._send(400, {'error': str(e)})
+        self._send(204)
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        resource, key, _ = self._route()
+        if resource == 'lease' and key:
+            self.server.release(key)
+            return self._send(204)
+        if resource == 'cache' and key:
+            self.server.cache.delete(key)
+            return self._send(204)
+        self._send(404, {'error': 'not found'})
+
+def start_server(host='127.0.0.1', port=8765, directory=None, lease_ttl=None, token=None):
+    """
+    在后台线程中启动共享缓存服务 (用于本地测试)
+
+    :param port: 端口 (0 表示随机端口，实际端口为 server.server_address[1])
+    :param directory: 缓存目录 (默认为 Config.LLM_CACHE_DIR)
+    :param token: 访问令牌 (默认为 Config.LLM_CACHE_TOKEN)
+    :return: CacheServer 实例 (server.shutdown() 停止)
+    """
+    cache = open_cache(directory)
+    migrate_cache(cache)
+    server = CacheServer((host, port), cache, lease_ttl=lease_ttl, token=token)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+# === 客户端 ===
+
+class HTTPCacheBackend(CacheBackend):
+    """
+    共享缓存服务的客户端 (线程安全，每个线程保持一个连接)
+    服务不可用时按未命中处理并记录警告，标注照常进行
+    未命中时查询、兼容键查询与申请租约合为一次请求 (acquire)
+    """
+
+    tier = 'http'
+    blocking = True
+    lookup_with_lease = True
+
+    def __init__(self, url, timeout=10, token=None):
+        """
+        :param url: 服务地址，如 http://10.0.0.5:8765
+        :param timeout: 请求超时秒数 (申请租约时另加等待时间)
+        :param token: 访问令牌 (默认为 Config.LLM_CACHE_TOKEN)
+        """
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.token = Config.LLM_CACHE_TOKEN if token is None else token
+        self._local = threading.local()
+        # 本节点持有的租约
+        self._leases = set()
+
+    def _request(self, method, path, payload=None, timeout=None):
+        """
+        :return: (状态码, 响应头, 响应 JSON)
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json; charset=utf-8'} if body is not None else {}
+        if self.token:
+            headers[_TOKEN_HEADER] = self.token
+        # 连接断开 (服务重启、空闲超时) 时重连一次
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.timeout = timeout or self.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(conn.timeout)
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        if response.status == 401:
+            # 服务端已关闭连接
+            conn.close()
+            self._local.conn = None
+            raise PermissionError('访问令牌无效 (LLM_CACHE_TOKEN 与服务端不一致)')
+        return response.status, response.headers, json.loads(data.decode('utf-8')) if data else None
+
+    def _try_request(self, action, method, path, payload=None, timeout=None):
+        """
+        发送请求，连接失败、超时或服务端错误时记录警告
+
+        :param action: 警告信息中的操作名称
+        :return: (状态码, 响应头, 响应 JSON)，失败时返回 None
+        """
+        try:
+            status, headers, data = self._request(method, path, payload, timeout=timeout)
+        except _REQUEST_ERRORS as e:
+            logger.warning(f'{action}失败 ({self.url})：{e}')
+            return None
+        if status >= 400 and status != 404:
+            logger.warning(f'{action}失败 ({self.url})：HTTP {status} {data}')
+            return None
+        return status, headers, data
+
+    @staticmethod
+    def _path(resource, key):
+        return f'/{resource}/{quote(key, safe="")}'
+
+    def lookup(self, key):
+        response = self._try_request('查询共享缓存', 'GET', self._path('cache', key))
+        if response is None or response[0] != 200:
+            return False, None, None
+        payload = response[2]
+        return True, payload['value'], payload.get('expire_time')
+
+    def store(self, key, value, expire=None, tag=None):
+        self._try_request('写入共享缓存', 'PUT', self._path('cache', key), {'value': value, 'expire': expire, 'tag': tag})
+        # 写入时服务端释放租约 (写入失败时租约到期自动失效)
+        self._leases.discard(key)
+
+    def delete(self, key):
+        return self._try_request('删除共享缓存', 'DELETE', self._path('cache', key)) is not None
+
+    def acquire(self, key, timeout=None, fallback_key=None):
+        timeout = timeout or Config.LLM_CACHE_LEASE_TIMEOUT
+        path = f'{self._path("cache", key)}?wait={timeout}'
+        if fallback_key is not None:
+            path += f'&fallback={quote(fallback_key, safe="")}'
+        response = self._try_request('查询共享缓存', 'GET', path, timeout=self.timeout + timeout)
+        if response is None:
+            return False, None, None
+        status, headers, payload = response
+        if status == 200:
+            return True, payload['value'], payload.get('expire_time')
+        if headers.get(_LEASE_HEADER) == 'granted':
+            self._leases.add(key)
+        else:
+            logger.warning(f'等待其他节点结果超时，自行请求：{key}')
+        return False, None, None
+
+    def release(self, key):
+        if key not in self._leases:
+            return
+        self._leases.discard(key)
+        self._try_request('释放租约', 'DELETE', self._path('lease', key))
+
+    def stats(self):
+        """
+        :return: 服务统计 dict (服务不可用时返回 None)
+        """
+        response = self._try_request('查询服务统计', 'GET', '/stats')
+        return response[2] if response is not None else None
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __repr__(self):
+        return f'HTTPCacheBackend({self.url!r})'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.cache_server', description='共享缓存服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (供其他机器访问时设为 0.0.0.0，并设置 LLM_CACHE_TOKEN)')
+    parser.add_argument('--port', type=int, default=8765, help='端口')
+    parser.add_argument('--dir', default=Config.LLM_CACHE_DIR, help='缓存目录 (默认读取 Config)')
+    parser.add_argument('--lease-ttl', type=int, default=None, help='租约有效期秒数')
+    args = parser.parse_args(argv)
+
+    cache = open_cache(args.dir)
+    migrate_cache(cache)
+    server = CacheServer((args.host, args.port), cache, lease_ttl=args.lease_ttl)
+    logger.info(f'共享缓存服务已启动：http://{args.host}:{args.port} (缓存目录 {args.dir})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache.close()
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    main()
@@ -17,9 +17,43 @@ class Config:
     LLM_API_KEY = os.getenv('LLM_API_KEY', 'EMPTY')
     LLM_MODEL_NAME = os.getenv('LLM_MODEL_NAME', 'kimi-k2.5')
     
+    # 请求调度设置 (0 表示不限流)
+    LLM_RPM = int(os.getenv('LLM_RPM', '0'))
+    LLM_TPM = int(os.getenv('LLM_TPM', '0'))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+    
+    # 服务端前缀缓存：implicit (服务端自动匹配) | explicit (标记 cache_control)
+    LLM_PROMPT_CACHE = os.getenv('LLM_PROMPT_CACHE', 'implicit')
+    
     # 缓存目录设置
     _LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', 'data/llm_cache')
     LLM_CACHE_DIR = os.path.join(PROJECT_ROOT, _LLM_CACHE_DIR)
+    
+    # 缓存值压缩：none (pickle，默认) | zlib | zstd (需安装 zstandard)
+    # 压缩后的缓存目录只能由 open_cache() 读取，默认不压缩
+    LLM_CACHE_CODEC = os.getenv('LLM_CACHE_CODEC', 'none')
+    
+    # 缓存容量上限 (如 500MB、20GB)，超出后按淘汰策略删除旧条目
+    LLM_CACHE_SIZE_LIMIT = os.getenv('LLM_CACHE_SIZE_LIMIT', '1GB')
+    # 淘汰策略：least-recently-stored | least-recently-used | least-frequently-used | none
+    LLM_CACHE_EVICTION = os.getenv('LLM_CACHE_EVICTION', 'least-recently-stored')
+    # 各模型缓存有效期 (如 glm-4.7=7d,*=90d；* 为其他模型，未设置表示不过期)
+    LLM_CACHE_TTL = os.getenv('LLM_CACHE_TTL', '')
+    
+    # 进程内缓存层 (位于磁盘缓存之前)：条目数上限 (0 表示不启用) / 字节数上限 (0 表示不限制)
+    LLM_MEMORY_CACHE_SIZE = int(os.getenv('LLM_MEMORY_CACHE_SIZE', '10000'))
+    LLM_MEMORY_CACHE_BYTES = os.getenv('LLM_MEMORY_CACHE_BYTES', '256MB')
+    
+    # 共享缓存服务地址 (如 http://10.0.0.5:8765，留空则使用本地缓存目录)
+    LLM_CACHE_URL = os.getenv('LLM_CACHE_URL', '')
+    # 共享缓存服务的访问令牌 (服务端与各节点设置相同的值，留空则不校验)
+    LLM_CACHE_TOKEN = os.getenv('LLM_CACHE_TOKEN', '')
+    # 请求合并：等待其他调用方 (或节点) 请求结果的最长秒数
+    LLM_CACHE_LEASE_TIMEOUT = int(os.getenv('LLM_CACHE_LEASE_TIMEOUT', '600'))
+    
+    # Batch 请求文件目录
+    _LLM_BATCH_DIR = os.getenv('LLM_BATCH_DIR', 'data/llm_batch')
+    LLM_BATCH_DIR = os.path.join(PROJECT_ROOT, _LLM_BATCH_DIR)
       
 # === 单元测试 ===
 if __name__ == '__main__':
@@ -28,5 +62,16 @@ if __name__ == '__main__':
     print(f'Base URL:    {Config.LLM_BASE_URL}')
     print(f'API Key:     {Config.LLM_API_KEY[:5]}******')
     print(f'Model Name:  {Config.LLM_MODEL_NAME}')
+    print(f'RPM / TPM:   {Config.LLM_RPM} / {Config.LLM_TPM}')
+    print(f'Max Retries: {Config.LLM_MAX_RETRIES}')
+    print(f'Prompt Cache: {Config.LLM_PROMPT_CACHE}')
     cache_dir = Config.LLM_CACHE_DIR.replace("\\", "/")
     print(f'Cache Dir:   {cache_dir}')
+    print(f'Cache Codec: {Config.LLM_CACHE_CODEC}')
+    print(f'Cache Limit: {Config.LLM_CACHE_SIZE_LIMIT} ({Config.LLM_CACHE_EVICTION})')
+    print(f'Cache TTL:   {Config.LLM_CACHE_TTL or "-"}')
+    print(f'Memory Cache: {Config.LLM_MEMORY_CACHE_SIZE} entries / {Config.LLM_MEMORY_CACHE_BYTES}')
+    print(f'Cache URL:   {Config.LLM_CACHE_URL or "-"}')
+    print(f'Cache Token: {"(set)" if Config.LLM_CACHE_TOKEN else "-"}')
+    batch_dir = Config.LLM_BATCH_DIR.replace("\\", "/")
+    print(f'Batch Dir:   {batch_dir}')
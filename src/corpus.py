@@ -0,0 +1,284 @@
+# bfsujason@163.com
+# python -m src.corpus
+
+# 内存映射的 TSV 双语语料 (随机访问)
+# 首次打开时建立行偏移索引并保存为 <语料>.idx，之后直接读取索引
+# 支持 len()、下标、切片及 shard(i, n)，均不读入整个语料
+
+import os
+import mmap
+import struct
+import logging
+from array import array
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 索引文件格式：文件头 (标识、版本、语料字节数、语料修改时间、记录数) + 各记录起始偏移 + 各记录行号
+_INDEX_MAGIC = b'TSVIDX'
+# 2: 索引不含无法按 UTF-8 解码的行
+_INDEX_VERSION = 2
+_INDEX_HEADER = struct.Struct('<6sHQqQ')
+
+class TSVCorpus:
+    """
+    内存映射的 TSV 双语语料 (原文\\t译文)
+    与 load_data、iter_tsv 一致：跳过列数不为 2 或含空列的行；无法按 UTF-8 解码的行建立索引时记录警告后跳过
+
+    corpus = TSVCorpus('data/corpus.tsv')
+    len(corpus)             # 记录数
+    corpus[0]               # 单条记录 {id, source, target, offset}
+    corpus[1000:2000]       # 切片 (TSVCorpus 视图，不复制数据)
+    corpus.shard(0, 4)      # 4 等分中的第 1 份
+    """
+
+    def __init__(self, file_name, index_file=None, rebuild=False):
+        """
+        :param file_name: .tsv 文件路径
+        :param index_file: 索引文件路径 (默认为 file_name + '.idx')
+        :param rebuild: 强制重建索引
+        """
+        self.file_name = file_name
+        self.index_file = index_file or file_name + '.idx'
+        self._mmap = None
+        self._starts, self._line_nos = self._load_index(rebuild)
+        self._rows = range(len(self._starts))
+
+    # === 索引 ===
+
+    def _file_stat(self):
+        stat = os.stat(self.file_name)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_index(self, rebuild=False):
+        size, mtime = self._file_stat()
+        if not rebuild and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'rb') as fin:
+                    magic, version, index_size, index_mtime, count = _INDEX_HEADER.unpack(
+                        fin.read(_INDEX_HEADER.size)
+                    )
+                    if (magic, version, index_size, index_mtime) == (_INDEX_MAGIC, _INDEX_VERSION, size, mtime):
+                        starts, line_nos = array('Q'), array('Q')
+                        starts.fromfile(fin, count)
+                        line_nos.fromfile(fin, count)
+                        return starts, line_nos
+                logger.info(f'语料已改变，重建索引：{self.index_file}')
+            except (struct.error, EOFError) as e:
+                logger.warning(f'索引文件损坏，重建索引：{self.index_file} ({e})')
+
+        starts, line_nos = self._build_index()
+        self._save_index(starts, line_nos, size, mtime)
+        return starts, line_nos
+
+    def _build_index(self):
+        logger.info(f'建立语料索引：{self.file_name}')
+        starts, line_nos = array('Q'), array('Q')
+        buf = self._get_mmap()
+        if buf is None:
+            return starts, line_nos
+
+        pos, line_no, size = 0, 0, len(buf)
+        while pos < size:
+            end = buf.find(b'\n', pos)
+            end = size if end < 0 else end + 1
+            fields = buf[pos:end].rstrip(b'\r\n').split(b'\t')
+            if len(fields) == 2 and all(fields):
+                try:
+                    buf[pos:end].decode('utf-8')
+                except UnicodeDecodeError as e:
+                    logger.warning(f'跳过无法解码的行：{self.file_name} 第 {line_no} 行 ({e})')
+                else:
+                    starts.append(pos)
+                    line_nos.append(line_no)
+            pos = end
+            line_no += 1
+        logger.info(f'索引建立完毕！共 {len(starts)} 条记录')
+        return starts, line_nos
+
+    def _save_index(self, starts, line_nos, size, mtime):
+        # 先写临时文件再替换，避免并发进程读到不完整的索引
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'wb') as fout:
+                fout.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, size, mtime, len(starts)))
+                starts.tofile(fout)
+                line_nos.tofile(fout)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            logger.warning(f'索引保存失败 (下次打开时重建)：{e}')
+
+    # === 读取 ===
+
+    def _get_mmap(self):
+        if self._mmap is None or self._mmap.closed:
+            if os.path.getsize(self.file_name) == 0:
+                return None
+            with open(self.file_name, 'rb') as fin:
+                self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _record(self, row):
+        buf = self._get_mmap()
+        start = self._starts[row]
+        end = self._record_end(row)
+        try:
+            source, target = buf[start:end].decode('utf-8').rstrip('\r\n').split('\t')
+        except UnicodeDecodeError as e:
+            # 索引建立时已跳过此类行，只在索引与语料不一致时出现
+            raise ValueError(f'无法解码的行：{self.file_name} 第 {self._line_nos[row]} 行 ({e})，请重建索引') from None
+        return {
+            'id': self._line_nos[row],
+            'source': source,
+            'target': target,
+            'offset': end,
+        }
+
+    def _view(self, rows):
+        view = object.__new__(TSVCorpus)
+        view.__dict__.update(self.__dict__)
+        view._rows = rows
+        return view
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        """
+        :param index: 下标 int 或切片 slice
+        :return: 记录 dict (下标) 或 TSVCorpus 视图 (切片)
+        """
+        if isinstance(index, slice):
+            return self._view(self._rows[index])
+        return self._record(self._rows[index])
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._record(row)
+
+    def shard(self, i, n):
+        """
+        将语料连续均分为 n 份，返回第 i 份 (从 0 开始)
+
+        :return: TSVCorpus 视图
+        """
+        if not 0 <= i < n:
+            raise ValueError(f'分片序号须在 [0, {n}) 之间：{i}')
+        total = len(self)
+        return self[total * i // n:total * (i + 1) // n]
+
+    def iter_chunks(self, chunksize=1000):
+        """
+        分块读取 (与 iter_tsv 的输出格式一致)
+
+        :return: 生成器，每次返回一块记录 [list[dict]]
+        """
+        rows = self._rows
+        for start in range(0, len(rows), chunksize):
+            yield [self._record(row) for row in rows[start:start + chunksize]]
+
+    def spans(self, size):
+        """
+        按记录数将语料切分为若干连续的字节区间
+        工作进程只需 read_span() 读取对应区间，无需加载索引
+
+        :param size: 每个区间的记录数
+        :return: [(起始字节偏移, 结束字节偏移, 起始行号)]
+        """
+        rows = self._rows
+        if rows.step != 1:
+            raise ValueError('带步长的切片无法按字节区间切分')
+
+        spans = []
+        for start in range(0, len(rows), size):
+            first = rows[start]
+            stop = start + size
+            end = self._starts[rows[stop]] if stop < len(rows) else self._record_end(rows[-1])
+            spans.append((self._starts[first], end, self._line_nos[first]))
+        return spans
+
+    def _record_end(self, row):
+        buf = self._get_mmap()
+        end = buf.find(b'\n', self._starts[row])
+        return len(buf) if end < 0 else end + 1
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 多进程传递时不复制内存映射，各进程按需重新打开
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+    def __repr__(self):
+        return f'TSVCorpus({self.file_name!r}, records={len(self)})'
+
+def read_span(file_name, start, end, line_no):
+    """
+    读取字节区间 [start, end) 内的记录 (区间由 TSVCorpus.spans() 生成)
+
+    :return: 记录列表 [list[dict]] (格式同 iter_tsv)
+    """
+    records = []
+    with open(file_name, 'rb') as fin:
+        fin.seek(start)
+        offset = start
+        for raw in fin:
+            if offset >= end:
+                break
+            offset += len(raw)
+            try:
+                fields = raw.decode('utf-8').rstrip('\r\n').split('\t')
+            except UnicodeDecodeError as e:
+                logger.warning(f'跳过无法解码的行：{file_name} 第 {line_no} 行 ({e})')
+                fields = None
+            if fields and len(fields) == 2 and all(fields):
+                records.append({
+                    'id': line_no,
+                    'source': fields[0],
+                    'target': fields[1],
+                    'offset': offset,
+                })
+            line_no += 1
+    return records
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    import tempfile
+
+    # 生成测试语料 (含格式错误的行)
+    tmp_dir = tempfile.mkdtemp()
+    in_file = os.path.join(tmp_dir, 'sample.tsv')
+    with open(in_file, 'wt', encoding='utf-8') as fout:
+        fout.write('那天晚上我没走掉。\tI did not leave that night.\n')
+        fout.write('格式错误的行\n')
+        fout.write('陈清扬把我拽住。\tChen Qingyang caught me.\n')
+        fout.write('以伟大友谊的名义叫我留下来。\tShe asked me to stay in the name of friendship.\n')
+
+    print(f'\n测试 1: 建立索引')
+    print(f'{"=" * 30}')
+    corpus = TSVCorpus(in_file)
+    print(f'[记录数]：{len(corpus)}')
+    print(f'[第 2 条]：{corpus[1]}')
+
+    print(f'\n测试 2: 读取已有索引')
+    print(f'{"=" * 30}')
+    corpus = TSVCorpus(in_file)
+    print(f'[切片]：{[record["id"] for record in corpus[1:]]}')
+
+    print(f'\n测试 3: 分片')
+    print(f'{"=" * 30}')
+    for i in range(2):
+        print(f'[分片 {i}]：{[record["source"] for record in corpus.shard(i, 2)]}')
@@ -0,0 +1,191 @@
+# bfsujason@163.com
+# python -m src.dedup
+
+# 句子级去重标注
+# 大模型缓存只在整段文本完全一致时命中，而语料中大量短句 (如对话标记、章节套话) 反复出现
+# 将文本分句并规范化后，全语料中每个不同的句子只标注一次，再把结果分发到各处出现的位置
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def normalize_sent(sent):
+    """
+    句子规范化：去除首尾空白，连续空白合并为一个空格
+    """
+    return re.sub(r'\s+', ' ', sent).strip()
+
+class DedupTagger:
+    """
+    句子级去重标注 (包装 POSTagger 或 SEMTagger)
+    接口与被包装的标注器一致，可直接用于 annotate_records、annotate_corpus 等
+
+    注意：每个句子单独标注，大模型看不到句子所在段落的上下文
+    """
+
+    def __init__(self, tagger, max_sents=1000000, normalize=normalize_sent):
+        """
+        :param tagger: POSTagger 或 SEMTagger 实例
+        :param max_sents: 保留的句子标注结果数上限 (超出时淘汰最久未用的句子)
+        :param normalize: 句子规范化函数
+        """
+        self.tagger = tagger
+        self.tag_key = tagger.TAG_KEY
+        self.max_sents = max_sents
+        self.normalize = normalize
+
+        self._lock = threading.Lock()
+        # {规范化句子: (分词列表, 赋码列表)}
+        self._sents = OrderedDict()
+        self.reset_stats()
+
+    def __getattr__(self, name):
+        # 其余属性 (mode、lang、tagset 等) 取自被包装的标注器
+        return getattr(self.tagger, name)
+
+    def reset_stats(self):
+        self.stats = {
+            'docs': 0,          # 标注文本数
+            'sents': 0,         # 句子总数
+            'tagged': 0,        # 实际标注的句子数
+            'reused': 0,        # 复用已有结果的句子数
+            'failed': 0,        # 标注失败的句子数
+        }
+
+    def _lookup(self, key):
+        with self._lock:
+            value = self._sents.get(key)
+            if value is not None:
+                self._sents.move_to_end(key)
+            return value
+
+    def _store(self, key, value):
+        with self._lock:
+            self._sents[key] = value
+            self._sents.move_to_end(key)
+            while len(self._sents) > self.max_sents:
+                self._sents.popitem(last=False)
+
+    def tag(self, text):
+        return self.tag_batch([text])[0]
+
+    def tag_batch(self, texts, max_concurrency=8):
+        """
+        批量标注：分句后汇总本批次中尚未标注的句子，每个句子只标注一次
+
+        :param texts: 输入文本列表 [list]
+        :param max_concurrency: 最大并发请求数 int (默认为 8)
+        :return: 标注结果列表 [list[dict]] (与 tagger.tag_batch 的格式一致)
+        """
+        texts = list(texts)
+        results, doc_keys = [], []
+        for text in texts:
+            if not isinstance(text, str):
+                results.append(None)
+                doc_keys.append(None)
+                continue
+            result = self.tagger._preprocess(text)
+            results.append(result)
+            doc_keys.append([self.normalize(sent) for sent in result['sent']])
+
+        # 本批次各句子的结果 {规范化句子: (分词列表, 赋码列表)}
+        # 分发时只读此处，不受其间 LRU 淘汰的影响
+        values = {}
+        # 本批次中尚未标注的句子 (去重后保持首次出现的顺序)
+        pending = OrderedDict()
+        num_sents = 0
+        for keys in doc_keys:
+            for key in keys or []:
+                # 空句子 (规范化后为空) 不计入统计
+                if not key:
+                    continue
+                num_sents += 1
+                if key in values or key in pending:
+                    continue
+                value = self._lookup(key)
+                if value is None:
+                    pending[key] = True
+                else:
+                    values[key] = value
+        pending = list(pending)
+
+        if pending:
+            logger.info(f'去重标注：{num_sents} 个句子，需标注 {len(pending)} 个')
+        failed = set()
+        for key, sent_result in zip(pending, self.tagger.tag_batch(pending, max_concurrency=max_concurrency)):
+            if sent_result and 'tok' in sent_result and self.tag_key in sent_result:
+                values[key] = (sent_result['tok'], sent_result[self.tag_key])
+                self._store(key, values[key])
+            else:
+                failed.add(key)
+
+        # 把句子结果分发到各文本
+        for result, keys in zip(results, doc_keys):
+            if result is None:
+                continue
+            tokens, tags = [], []
+            complete = True
+            for key in keys:
+                if not key:
+                    continue
+                value = values.get(key)
+                if value is None:
+                    complete = False
+                    break
+                tokens.extend(value[0])
+                tags.extend(value[1])
+            # 与 tagger.tag 一致：标注失败时结果中不含 tok 及赋码
+            if complete:
+                result['tok'] = tokens
+                result[self.tag_key] = tags
+
+        with self._lock:
+            self.stats['docs'] += sum(1 for result in results if result is not None)
+            self.stats['sents'] += num_sents
+            self.stats['tagged'] += len(pending) - len(failed)
+            self.stats['failed'] += len(failed)
+            self.stats['reused'] += num_sents - len(pending)
+        return results
+
+    def report(self):
+        """
+        去重统计
+
+        :return: dict (docs, sents, unique, tagged, reused, failed, saved_ratio)
+        """
+        stats = dict(self.stats)
+        stats['unique'] = len(self._sents)
+        stats['saved_ratio'] = round(stats['reused'] / stats['sents'], 4) if stats['sents'] else 0.0
+        return stats
+
+    def log_report(self):
+        stats = self.report()
+        logger.info(
+            f'句子去重：{stats["sents"]} 个句子，实际标注 {stats["tagged"]} 个，'
+            f'复用 {stats["reused"]} 个 (节省 {stats["saved_ratio"]:.1%} 的调用)'
+        )
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    from src.annotator.pos_tagger import POSTagger
+
+    llm_model = 'deepseek-v3.2'
+    texts = [
+        '“快走！”韦小宝道。',
+        '“快走！”茅十八道。',
+        '韦小宝道：“快走！”',
+    ]
+
+    print(f'\n测试 1: 句子级去重标注')
+    print(f'{"=" * 30}')
+    zh_pos_tagger = DedupTagger(POSTagger(lang='chinese', tagset='pku', mode='llm', llm_model=llm_model))
+    for result in zh_pos_tagger.tag_batch(texts):
+        print(f'[标注结果]：{result}')
+    print(f'[去重统计]：{zh_pos_tagger.report()}')
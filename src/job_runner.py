@@ -0,0 +1,201 @@
+# bfsujason@163.com
+# python -m src.job_runner
+
+# 可断点续跑的语料标注任务
+# 每块标注完成后更新进度清单 (manifest)，重启时直接定位到第一条未完成的记录
+
+import os
+import json
+import logging
+
+from tqdm import tqdm
+
+from src.usage import usage_meter
+from src.utils import iter_tsv
+from src.pipeline import annotate_records, log_prompt_cache_stats
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+class AnnotationJob:
+    """
+    可断点续跑的语料标注任务
+
+    进度清单 (JSON) 只记录续跑位置，大小固定：
+    [next_id]:      第一条未完成记录的行号，[0, next_id) 均已完成
+    [in_offset]:    输入文件中 next_id 所在行的字节偏移
+    [out_offset]:   输出文件中已完成记录的字节长度
+    [records]:      已完成的记录数
+
+    各块的 首行号\t末行号\t输出起始偏移\t输出结束偏移 逐行追加到块日志 (仅供查阅，续跑不依赖)
+    """
+
+    def __init__(
+        self,
+        in_file,
+        out_file,
+        source_taggers=None,
+        target_taggers=None,
+        chunksize=1000,
+        max_concurrency=8,
+        manifest_file=None,
+    ):
+        """
+        :param in_file: .tsv 文件路径 (原文\\t译文)
+        :param out_file: .jsonl 输出文件路径
+        :param source_taggers: 原文标注器 dict {名称: 标注器}
+        :param target_taggers: 译文标注器 dict {名称: 标注器}
+        :param chunksize: 每块行数 (即进度保存间隔)
+        :param max_concurrency: 每个标注器的最大并发请求数
+        :param manifest_file: 进度清单路径 (默认为 out_file + '.manifest.json')
+                              块日志为 manifest_file + '.chunks.log'
+        """
+        self.in_file = in_file
+        self.out_file = out_file
+        self.source_taggers = source_taggers
+        self.target_taggers = target_taggers
+        self.chunksize = chunksize
+        self.max_concurrency = max_concurrency
+        self.manifest_file = manifest_file or out_file + '.manifest.json'
+        self.chunk_log_file = self.manifest_file + '.chunks.log'
+
+    def _new_manifest(self):
+        return {
+            'version': MANIFEST_VERSION,
+            'in_file': os.path.abspath(self.in_file),
+            'in_size': os.path.getsize(self.in_file),
+            'next_id': 0,
+            'in_offset': 0,
+            'out_offset': 0,
+            'records': 0,
+            'finished': False,
+        }
+
+    def load_manifest(self):
+        """
+        读取进度清单 (不存在或输出文件缺失时新建)
+        """
+        if not os.path.exists(self.manifest_file) or not os.path.exists(self.out_file):
+            return self._new_manifest()
+
+        with open(self.manifest_file, 'rt', encoding='utf-8') as fin:
+            manifest = json.load(fin)
+
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f'不支持的进度清单版本：{manifest.get("version")}')
+        if manifest['in_size'] != os.path.getsize(self.in_file):
+            raise ValueError(
+                f'输入文件 {self.in_file} 已改变，无法续跑\n'
+                f'请删除 {self.manifest_file} 后重新标注'
+            )
+        if os.path.getsize(self.out_file) < manifest['out_offset']:
+            raise ValueError(f'输出文件 {self.out_file} 不完整，无法续跑')
+        # 旧版清单中的各块记录已移至块日志
+        manifest.pop('chunks', None)
+        return manifest
+
+    def _save_manifest(self, manifest):
+        # 先写临时文件再替换，避免进程中断时清单损坏
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'wt', encoding='utf-8') as fout:
+            json.dump(manifest, fout, ensure_ascii=False)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def run(self):
+        """
+        运行 (或续跑) 标注任务
+
+        :return: 进度清单 dict
+        """
+        manifest = self.load_manifest()
+        if manifest['finished']:
+            logger.info(f'任务已完成，共 {manifest["records"]} 条：{self.out_file}')
+            return manifest
+
+        if manifest['next_id']:
+            logger.info(f'从第 {manifest["next_id"]} 行续跑 (已完成 {manifest["records"]} 条)')
+
+        mode = 'r+b' if os.path.exists(self.out_file) else 'wb'
+        # 新任务清空块日志，续跑时追加
+        log_mode = 'at' if manifest['next_id'] else 'wt'
+        with open(self.out_file, mode) as fout, \
+                open(self.chunk_log_file, log_mode, encoding='utf-8') as flog, \
+                tqdm(desc='标注语料', unit='条', initial=manifest['records']) as pbar:
+            # 丢弃上次中断时未记入清单的输出
+            fout.truncate(manifest['out_offset'])
+            fout.seek(manifest['out_offset'])
+
+            for records in iter_tsv(
+                self.in_file,
+                chunksize=self.chunksize,
+                offset=manifest['in_offset'],
+                line_no=manifest['next_id'],
+            ):
+                outputs = annotate_records(
+                    records,
+                    source_taggers=self.source_taggers,
+                    target_taggers=self.target_taggers,
+                    max_concurrency=self.max_concurrency,
+                )
+
+                out_start = fout.tell()
+                for output in outputs:
+                    fout.write((json.dumps(output, ensure_ascii=False) + '\n').encode('utf-8'))
+                fout.flush()
+                os.fsync(fout.fileno())
+                out_end = fout.tell()
+
+                manifest['next_id'] = records[-1]['id'] + 1
+                manifest['in_offset'] = records[-1]['offset']
+                manifest['out_offset'] = out_end
+                manifest['records'] += len(outputs)
+                self._save_manifest(manifest)
+                flog.write(f'{records[0]["id"]}\t{records[-1]["id"]}\t{out_start}\t{out_end}\n')
+                flog.flush()
+                pbar.update(len(outputs))
+
+        manifest['finished'] = True
+        self._save_manifest(manifest)
+        logger.info(f'标注完毕！共 {manifest["records"]} 条，结果已写入 {self.out_file}')
+        log_prompt_cache_stats(self.source_taggers, self.target_taggers)
+        logger.info(f'大模型用量 (进程累计)：{usage_meter.total()}')
+        return manifest
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    import tempfile
+
+    from src.annotator.pos_tagger import POSTagger
+
+    # 生成测试语料
+    tmp_dir = tempfile.mkdtemp()
+    in_file = os.path.join(tmp_dir, 'sample.tsv')
+    out_file = os.path.join(tmp_dir, 'sample.jsonl')
+    with open(in_file, 'wt', encoding='utf-8') as fout:
+        fout.write('那天晚上我没走掉。\tI did not leave that night.\n')
+        fout.write('陈清扬把我拽住。\tChen Qingyang caught me.\n')
+    llm_model = 'deepseek-v3.2'
+
+    zh_pos_tagger = POSTagger(lang='chinese', tagset='pku', mode='llm', llm_model=llm_model)
+
+    print(f'\n测试 1: 可续跑的语料标注')
+    print(f'{"=" * 30}')
+    job = AnnotationJob(
+        in_file,
+        out_file,
+        source_taggers={'pos': zh_pos_tagger},
+        chunksize=1,
+    )
+    manifest = job.run()
+    print(f'[进度清单]：{manifest}')
+
+    print(f'\n测试 2: 重复运行 (已完成，直接返回)')
+    print(f'{"=" * 30}')
+    job.run()
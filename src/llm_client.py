@@ -3,25 +3,158 @@
 
 import re
 import json
+import time
 import logging
+import threading
 
 import openai
-import diskcache
 
 from src.config import Config
+from src.cache import CacheBackend, TieredCache, make_cache_key, migrate_cache, open_default_cache
+from src.scheduler import get_scheduler
+from src.timing import tracer
+from src.usage import usage_meter as shared_usage_meter, usage_to_dict
+from src.utils import estimate_tokens
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-class LLMClient:
+class PromptCacheStats:
     """
-    实时调用大模型 API (非 Batch 模式)
+    服务端前缀缓存 (Prompt Cache) 命中统计 (线程安全)
+    读取响应 usage 中的 prompt_tokens_details.cached_tokens
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.prompt_tokens = 0
+            self.cached_tokens = 0
+
+    def record(self, usage):
+        """
+        记录一次请求的 usage (SDK 对象或 dict)
+        """
+        usage = usage_to_dict(usage)
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage['prompt_tokens']
+            self.cached_tokens += usage['cached_tokens']
+
+    @property
+    def hit_rate(self):
+        """
+        缓存命中的输入 token 占比 (无请求时为 0)
+        """
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'hit_rate': round(self.hit_rate, 4),
+        }
+
+    def __repr__(self):
+        return (f'PromptCacheStats(requests={self.requests}, prompt_tokens={self.prompt_tokens}, '
+                f'cached_tokens={self.cached_tokens}, hit_rate={self.hit_rate:.1%})')
+
+class JSONStreamParser:
+    """
+    增量 JSON 解析器
+    逐段输入流式生成内容，每当一个不含嵌套对象的 JSON 对象 (如 {"token": ..., "tag": ...}) 闭合时立即解析
+    只缓存当前未闭合对象的文本，整体为 O(n)
+    对象外的文本 (Markdown 代码块标记、数组括号、外层包装对象的键名等) 均被忽略
+    """
+
+    def __init__(self):
+        self._in_string = False
+        self._escape = False
+        # 各层未闭合对象是否含有嵌套对象
+        self._has_child = []
+        # 当前最内层对象的文本
+        self._parts = []
+
+    def feed(self, text):
+        """
+        :param text: 新收到的生成内容 str
+        :return: 本段内闭合的对象列表 [list[dict]]
+        """
+        objects = []
+        start = 0 if self._parts else None
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                if self._has_child:
+                    self._has_child[-1] = True
+                self._has_child.append(False)
+                self._parts = []
+                start = i
+            elif char == '}' and self._has_child:
+                has_child = self._has_child.pop()
+                if not has_child and start is not None:
+                    self._parts.append(text[start:i + 1])
+                    obj = self._loads(''.join(self._parts))
+                    if obj is not None:
+                        objects.append(obj)
+                self._parts = []
+                start = None
+
+        if start is not None:
+            self._parts.append(text[start:])
+        return objects
+
+    @staticmethod
+    def _loads(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            logger.warning(f'JSON 对象解析失败：{text[:100]}')
+            return None
+
+def iter_json_objects(data):
+    """
+    按顺序产出已解析 JSON 中不含嵌套对象的对象 (与 JSONStreamParser 的产出一致)
+    """
+    if isinstance(data, list):
+        for item in data:
+            yield from iter_json_objects(item)
+    elif isinstance(data, dict):
+        values = [value for value in data.values() if isinstance(value, (list, dict))]
+        if not values:
+            yield data
+        for value in values:
+            yield from iter_json_objects(value)
+
+class BaseLLMClient:
+    """
+    大模型客户端公共方法 (缓存、请求参数、JSON 解析)
     """
 
     def __init__(self,
         model=None,
         temperature=0.1,
         enable_thinking=False,
+        cache=None,
+        prompt_cache=None,
+        prompt_cache_stats=None,
+        usage_meter=None,
+        memory_cache=None,
     ):
         """
         初始化客户端
@@ -30,22 +163,209 @@ class LLMClient:
         :param model: 模型名称 (默认为 kimi-k2.5)
         :param temperature: 采样温度系数 (默认为 0.1)
         :param enable_thinking: 思考模式 (默认为关闭)
+        :param cache: 共用的 diskcache.Cache 或 CacheBackend 实例 (默认按 Config 打开本地缓存或共享缓存服务)
+        :param prompt_cache: 服务端前缀缓存模式 implicit | explicit (默认读取 Config)
+        :param prompt_cache_stats: 共用的 PromptCacheStats 实例 (默认为新建)
+        :param usage_meter: 用量计量器 UsageMeter (默认为进程内共享的 src.usage.usage_meter)
+        :param memory_cache: 共用的进程内缓存层 MemoryCache (默认按 Config 新建)
         """
         logger.info('初始化大模型客户端 ...')
         
-        self.client = openai.OpenAI(
-            api_key=Config.LLM_API_KEY,
-            base_url=Config.LLM_BASE_URL,
-        )
+        self.client = self._create_client()
 
         self.default_model = model or Config.LLM_MODEL_NAME
         self.temperature = temperature
         self.enable_thinking = enable_thinking
-        self.cache = diskcache.Cache(Config.LLM_CACHE_DIR)
+        self.cache = cache if cache is not None else open_default_cache()
         #self.cache_new = diskcache.Cache('C:/llm_annotation_v9/data/llm_cache_new')
         
+        # 旧版缓存键迁移 (仅本地缓存首次打开时执行)
+        if not isinstance(self.cache, CacheBackend):
+            migrate_cache(self.cache)
+        
+        # 两级缓存：进程内 LRU → 本地缓存或共享缓存服务
+        self.cache_tiers = TieredCache(self.cache, memory_cache)
+        self.memory_cache = self.cache_tiers.memory
+        
+        # 服务端前缀缓存
+        self.prompt_cache = prompt_cache or Config.LLM_PROMPT_CACHE
+        if self.prompt_cache not in ('implicit', 'explicit'):
+            raise ValueError(f'不支持的前缀缓存模式 {self.prompt_cache}，可选：implicit | explicit')
+        self.prompt_cache_stats = prompt_cache_stats if prompt_cache_stats is not None else PromptCacheStats()
+        
+        # 用量计量
+        self.usage_meter = usage_meter if usage_meter is not None else shared_usage_meter
+        
+        # 请求调度 (同一模型在进程内共用限流额度)
+        self.scheduler = get_scheduler(self.default_model)
+        
         # 验证配置
-        logger.info(f'初始化完毕！Base URL：{Config.LLM_BASE_URL} Model：{self.default_model}')
+        logger.info(f'初始化完毕！Base URL：{self.client.base_url} Model：{self.default_model}')
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _estimate_tokens(messages):
+        """
+        估计请求的输入 token 数 (用于 TPM 限流)
+        """
+        return sum(estimate_tokens(message['content']) for message in messages)
+
+    def _record_usage(self, model, usage, labels=None, price_factor=1.0):
+        """
+        记录一次请求的 token 用量 (前缀缓存统计及用量计量)
+        """
+        self.prompt_cache_stats.record(usage)
+        self.usage_meter.record(model, usage, labels=labels, price_factor=price_factor)
+
+    @staticmethod
+    def _build_messages(prompt, system_prompt=None):
+        """
+        构建消息
+        """
+        messages = []
+        if system_prompt:
+            messages.append({'role': 'system', 'content': system_prompt})
+        messages.append({'role': 'user', 'content': prompt})
+        return messages
+
+    def _build_cache_key(
+        self,
+        model,
+        messages,
+        temperature,
+        max_tokens,
+        enable_thinking,
+        thinking_budget,
+        json_output,
+    ):
+        """
+        构建缓存键 (请求参数的定长摘要)
+        """
+        return make_cache_key(
+            model,
+            messages,
+            enable_thinking=enable_thinking,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            thinking_budget=thinking_budget,
+            json_output=json_output,
+        )
+
+    def _legacy_key(self, messages, key_params):
+        """
+        拆分 system/user 消息之前的缓存键 (整段 Prompt 作为单条 user 消息)
+
+        :return: 兼容缓存键，无 system 消息时返回 None
+        """
+        if len(messages) == 2 and messages[0]['role'] == 'system':
+            merged = [{'role': 'user', 'content': messages[0]['content'] + messages[1]['content']}]
+            return self._build_cache_key(messages=merged, **key_params)
+        return None
+
+    def _read_cache(self, cache_key, messages, key_params):
+        """
+        读取缓存
+        兼容拆分 system/user 消息之前的缓存
+        
+        :return: (是否命中, 缓存内容)
+        """
+        return self.cache_tiers.get(cache_key, fallback_key=self._legacy_key(messages, key_params))
+
+    @staticmethod
+    def _build_request_kwargs(
+        model,
+        messages,
+        temperature,
+        max_tokens,
+        stream,
+        enable_thinking,
+        thinking_budget,
+        json_output,
+        prompt_cache='implicit',
+    ):
+        """
+        设置请求参数
+        """
+        # 显式缓存：在 system 消息 (静态前缀) 上标记 cache_control
+        # 隐式缓存由服务端自动匹配相同前缀，无需标记
+        # 仅修改请求体，不影响缓存键
+        if prompt_cache == 'explicit' and messages and messages[0]['role'] == 'system':
+            system_message = {
+                'role': 'system',
+                'content': [{
+                    'type': 'text',
+                    'text': messages[0]['content'],
+                    'cache_control': {'type': 'ephemeral'},
+                }],
+            }
+            messages = [system_message] + messages[1:]
+        
+        request_kwargs = {
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'stream': stream,
+            'extra_body': {
+                'enable_thinking': enable_thinking,
+                'thinking_budget': thinking_budget,
+            },
+        }
+        
+        # 流式输出时在最后一个数据块中返回 usage (含缓存命中的 token 数)
+        if stream:
+            request_kwargs['stream_options'] = {'include_usage': True}
+        
+        # 强制输出 JSON 格式
+        # 注意：deepseek-v3.2 和 kimi-k2.5 不支持此参数
+        if json_output:
+            if model.startswith(('qwen', 'glm')):
+                request_kwargs['response_format'] = {'type': 'json_object'}
+        return request_kwargs
+
+    def _parse_json(self, content):
+        """
+        解析大模型生成内容 (JSON 格式)
+        
+        :param content: JSON 字符串
+        :return: Python 字典或列表
+        """
+        if not content:
+            return None
+            
+        try:
+            # 尝试直接解析
+            return json.loads(content)
+        except json.JSONDecodeError:
+            # 如果失败，尝试去除 Markdown 代码块标记
+            # 匹配 ```json ... ``` 或 ``` ... ``` 中的内容
+            pattern = r'```(?:json)?\s*(.*?)\s*```'
+            match = re.search(pattern, content, re.DOTALL)
+            
+            if match:
+                clean_content = match.group(1)
+                try:
+                    return json.loads(clean_content)
+                except json.JSONDecodeError:
+                    pass # 继续尝试其他解析方式
+            
+            logger.warning(f'JSON 解析失败：{content[:100]}...')
+            return None
+
+class LLMClient(BaseLLMClient):
+    """
+    实时调用大模型 API (非 Batch 模式)
+    """
+
+    def _create_client(self):
+        # 由 RequestScheduler 负责重试
+        return openai.OpenAI(
+            api_key=Config.LLM_API_KEY,
+            base_url=Config.LLM_BASE_URL,
+            max_retries=0,
+        )
 
     def get_response(
         self,
@@ -59,6 +379,7 @@ class LLMClient:
         enable_thinking=False,
         thinking_budget=4096,
         json_output=False,
+        labels=None,
     ):
         """
         发送请求并获取生成内容
@@ -72,70 +393,325 @@ class LLMClient:
         :enable_thinking: 思考模式
         :thinking_budget: 思考过程的最大程度
         :json_output: JSON 格式输出
+        :labels: 用量计量标签 {'tagger': ..., 'tagset': ...}
         :return: 解析后的 Python 字典或列表 (JSON 模式)
                  字符串 (非 JSON 模式)
-                 如果失败则返回 None
+                 如果失败则返回 None (已按 RequestScheduler 的设置重试)
         """
         model = self.default_model
         temperature = self.temperature
         enable_thinking = self.enable_thinking
         
         # 构建消息
-        messages = []
-        if system_prompt:
-            messages.append({'role': 'system', 'content': system_prompt})
-        messages.append({'role': 'user', 'content': prompt})
+        messages = self._build_messages(prompt, system_prompt)
         
         # 读取缓存
-        cache_key = '|||'.join([message['content'] for message in messages])
-        cache_key = model + '|||' + cache_key
-        
-        if enable_thinking:
-            cache_key = 'THINK'+ '|||' + cache_key
+        key_params = {
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'enable_thinking': enable_thinking,
+            'thinking_budget': thinking_budget,
+            'json_output': json_output,
+        }
+        cache_key = self._build_cache_key(messages=messages, **key_params)
         
-        if cache_key in self.cache:
+        # 未命中时取得租约 (请求合并：其他调用方正在请求同一内容时等待其结果)
+        with tracer.span('cache_lookup', labels):
+            found, result, lease = self.cache_tiers.get_or_acquire(
+                cache_key, self._legacy_key(messages, key_params),
+            )
+        if found:
             logger.info('Found in cache!')
-            #self.cache_new[cache_key] = self.cache[cache_key]
-            return self.cache[cache_key]
+            self.usage_meter.record_cache_hit(model, labels)
+            return result
         
         # 设置参数
-        request_kwargs = {
+        request_kwargs = self._build_request_kwargs(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            enable_thinking=enable_thinking,
+            thinking_budget=thinking_budget,
+            json_output=json_output,
+            prompt_cache=self.prompt_cache,
+        )
+
+        try:
+            # 调用 API (限流、重试及熔断)
+            tokens = self._estimate_tokens(messages)
+            content, usage = self.scheduler.call(
+                lambda: self._request(request_kwargs, labels),
+                tokens=tokens,
+            )
+            self.scheduler.reconcile(tokens, usage)
+            self._record_usage(model, usage, labels)
+            result = content.strip()
+            
+            # 解析 JSON
+            if json_output:
+                with tracer.span('parse', labels):
+                    result = self._parse_json(content)
+            
+            # 写入缓存
+            self.cache_tiers.set(cache_key, result)
+            
+            return result
+
+        except openai.APIError as e:
+            logger.error(f'LLM API 错误: {e}')
+            return None
+            
+        except Exception as e:
+            logger.error(f'LLM 调用错误: {e}')
+            return None
+        
+        finally:
+            self.cache_tiers.release(lease)
+
+    def stream_response(
+        self,
+        prompt,
+        system_prompt=None,
+        max_tokens=4096,
+        thinking_budget=4096,
+        labels=None,
+    ):
+        """
+        流式获取 JSON 格式的生成内容 (生成器)
+        每当一个对象 (如 {"token": ..., "tag": ...}) 在流中闭合时立即产出，无需等待生成结束
+        生成结束后完整结果写入缓存 (与 get_response(json_output=True) 共用缓存)
+        缓存命中时逐个产出缓存结果中的对象
+        
+        :param prompt: 用户 Prompt (User Message)
+        :param system_prompt: 系统 Prompt (System Message)
+        :param max_tokens: 最大输出长度
+        :param thinking_budget: 思考过程的最大程度
+        :param labels: 用量计量标签 {'tagger': ..., 'tagset': ...}
+        :return: dict 生成器 (请求失败时记录日志并提前结束)
+        """
+        model = self.default_model
+        messages = self._build_messages(prompt, system_prompt)
+        key_params = {
             'model': model,
-            'messages': messages,
-            'temperature': temperature,
+            'temperature': self.temperature,
             'max_tokens': max_tokens,
-            'stream': stream,
-            'extra_body': {
-                'enable_thinking': enable_thinking,
-                'thinking_budget': thinking_budget,
-            },
+            'enable_thinking': self.enable_thinking,
+            'thinking_budget': thinking_budget,
+            'json_output': True,
         }
+        cache_key = self._build_cache_key(messages=messages, **key_params)
         
-        # 强制输出 JSON 格式
-        # 注意：deepseek-v3.2 和 kimi-k2.5 不支持此参数
-        if json_output:
-            if model.startswith(('qwen', 'glm')):
-                request_kwargs['response_format'] = {'type': 'json_object'}
+        # 未命中时取得租约 (请求合并：其他调用方正在请求同一内容时等待其结果)
+        with tracer.span('cache_lookup', labels):
+            found, result, lease = self.cache_tiers.get_or_acquire(
+                cache_key, self._legacy_key(messages, key_params),
+            )
+        if found:
+            logger.info('Found in cache!')
+            self.usage_meter.record_cache_hit(model, labels)
+            yield from iter_json_objects(result)
+            return
+        
+        request_kwargs = self._build_request_kwargs(
+            model=model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            enable_thinking=self.enable_thinking,
+            thinking_budget=thinking_budget,
+            json_output=True,
+            prompt_cache=self.prompt_cache,
+        )
 
+        response = None
         try:
-            # 调用 API
-            response = self.client.chat.completions.create(**request_kwargs)
+            # 建立连接时限流、重试及熔断 (已开始产出后不再重试)
+            tokens = self._estimate_tokens(messages)
+            start, response = self.scheduler.call(
+                lambda: self._open_stream(request_kwargs),
+                tokens=tokens,
+            )
+            
+            parser = JSONStreamParser()
+            parts = []
+            meta = {}
+            for text in self._iter_content(response, start, labels, meta):
+                parts.append(text)
+                yield from parser.feed(text)
+            self.scheduler.reconcile(tokens, meta.get('usage'))
+            self._record_usage(model, meta.get('usage'), labels)
+            
+            # 解析完整结果并写入缓存
+            with tracer.span('parse', labels):
+                result = self._parse_json(''.join(parts))
+            self.cache_tiers.set(cache_key, result)
+
+        except openai.APIError as e:
+            logger.error(f'LLM API 错误: {e}')
+            
+        except Exception as e:
+            logger.error(f'LLM 调用错误: {e}')
+        
+        finally:
+            # 调用方提前停止迭代 (GeneratorExit) 时关闭流式响应，不等待垃圾回收
+            if response is not None:
+                response.close()
+            self.cache_tiers.release(lease)
 
-            # 获取生成内容
-            content = ''
+    def _open_stream(self, request_kwargs):
+        """
+        :return: (请求开始时间, 流式响应)
+        """
+        start = time.perf_counter()
+        return start, self.client.chat.completions.create(**request_kwargs)
+
+    @staticmethod
+    def _iter_content(response, start, labels, meta):
+        """
+        逐块产出流式响应的生成内容
+        记录首 token 时延 (ttft) 及流式输出耗时 (stream)，usage 存入 meta['usage']
+        结束时关闭响应 (调用方提前停止迭代或出错时释放 HTTP 连接)
+        """
+        first_token = None
+        try:
             for chunk in response:
+                # 最后一个数据块只含 usage，choices 为空
+                if chunk.usage:
+                    meta['usage'] = chunk.usage
+                if not chunk.choices:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    tracer.record('ttft', first_token - start, labels)
                 delta = chunk.choices[0].delta
                 # 收到content，开始进行回复
                 if hasattr(delta, 'content') and delta.content:
-                    content += delta.content
+                    yield delta.content
+        finally:
+            response.close()
+        if first_token is not None:
+            tracer.record('stream', time.perf_counter() - first_token, labels)
+
+    def _request(self, request_kwargs, labels=None):
+        """
+        调用 API 并获取生成内容
+        流式请求记录首 token 时延 (ttft) 及流式输出耗时 (stream)，非流式请求记录总耗时 (request)
+        
+        :return: (生成内容, usage)
+        """
+        start, response = self._open_stream(request_kwargs)
+
+        if not request_kwargs['stream']:
+            tracer.record('request', time.perf_counter() - start, labels)
+            return response.choices[0].message.content or '', response.usage
+
+        # 逐块追加到列表后一次拼接，避免字符串反复 +=
+        meta = {}
+        content = ''.join(self._iter_content(response, start, labels, meta))
+        return content, meta.get('usage')
+
+class AsyncLLMClient(BaseLLMClient):
+    """
+    实时调用大模型 API (asyncio 模式)
+    缓存键、JSON 解析及思考模式与 LLMClient 一致
+    单个事件循环即可同时保持大量请求，无需为每个请求创建线程
+    """
+
+    def _create_client(self):
+        # 由 RequestScheduler 负责重试
+        return openai.AsyncOpenAI(
+            api_key=Config.LLM_API_KEY,
+            base_url=Config.LLM_BASE_URL,
+            max_retries=0,
+        )
+
+    async def aclose(self):
+        """
+        关闭 AsyncOpenAI 客户端 (释放当前事件循环中的 httpx 连接池)
+        缓存不随客户端关闭
+        """
+        await self.client.close()
+
+    async def get_response(
+        self,
+        prompt,
+        system_prompt=None,
+        model=None,
+        temperature=0.1,
+        max_tokens=4096,
+        stream=True,
+        enable_thinking=False,
+        thinking_budget=4096,
+        json_output=False,
+        labels=None,
+    ):
+        """
+        发送请求并获取生成内容 (协程)
+        参数及返回值同 LLMClient.get_response
+        """
+        model = self.default_model
+        temperature = self.temperature
+        enable_thinking = self.enable_thinking
+        
+        # 构建消息
+        messages = self._build_messages(prompt, system_prompt)
+        
+        # 读取缓存
+        key_params = {
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'enable_thinking': enable_thinking,
+            'thinking_budget': thinking_budget,
+            'json_output': json_output,
+        }
+        cache_key = self._build_cache_key(messages=messages, **key_params)
+        
+        # 未命中时取得租约 (请求合并：等待时不阻塞事件循环)
+        with tracer.span('cache_lookup', labels):
+            found, result, lease = await self.cache_tiers.aget_or_acquire(
+                cache_key, self._legacy_key(messages, key_params),
+            )
+        if found:
+            logger.info('Found in cache!')
+            self.usage_meter.record_cache_hit(model, labels)
+            return result
+        
+        # 设置参数
+        request_kwargs = self._build_request_kwargs(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            enable_thinking=enable_thinking,
+            thinking_budget=thinking_budget,
+            json_output=json_output,
+            prompt_cache=self.prompt_cache,
+        )
+
+        try:
+            # 调用 API (限流、重试及熔断)
+            tokens = self._estimate_tokens(messages)
+            content, usage = await self.scheduler.acall(
+                lambda: self._request(request_kwargs, labels),
+                tokens=tokens,
+            )
+            self.scheduler.reconcile(tokens, usage)
+            self._record_usage(model, usage, labels)
             result = content.strip()
             
             # 解析 JSON
             if json_output:
-                result = self._parse_json(content)
+                with tracer.span('parse', labels):
+                    result = self._parse_json(content)
             
             # 写入缓存
-            self.cache[cache_key] = result
+            self.cache_tiers.set(cache_key, result)
             
             return result
 
@@ -147,34 +723,43 @@ class LLMClient:
             logger.error(f'LLM 调用错误: {e}')
             return None
         
-    def _parse_json(self, content):
+        finally:
+            self.cache_tiers.release(lease)
+
+    async def _request(self, request_kwargs, labels=None):
         """
-        解析大模型生成内容 (JSON 格式)
+        调用 API 并获取生成内容 (协程)
         
-        :param content: JSON 字符串
-        :return: Python 字典或列表
+        :return: (生成内容, usage)
         """
-        if not content:
-            return None
-            
+        start = time.perf_counter()
+        response = await self.client.chat.completions.create(**request_kwargs)
+
+        if not request_kwargs['stream']:
+            tracer.record('request', time.perf_counter() - start, labels)
+            return response.choices[0].message.content or '', response.usage
+
+        parts = []
+        usage = None
+        first_token = None
         try:
-            # 尝试直接解析
-            return json.loads(content)
-        except json.JSONDecodeError:
-            # 如果失败，尝试去除 Markdown 代码块标记
-            # 匹配 ```json ... ``` 或 ``` ... ``` 中的内容
-            pattern = r'```(?:json)?\s*(.*?)\s*```'
-            match = re.search(pattern, content, re.DOTALL)
-            
-            if match:
-                clean_content = match.group(1)
-                try:
-                    return json.loads(clean_content)
-                except json.JSONDecodeError:
-                    pass # 继续尝试其他解析方式
-            
-            logger.warning(f'JSON 解析失败：{content[:100]}...')
-            return None
+            async for chunk in response:
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    tracer.record('ttft', first_token - start, labels)
+                delta = chunk.choices[0].delta
+                if hasattr(delta, 'content') and delta.content:
+                    parts.append(delta.content)
+        finally:
+            # 出错或被取消时释放 HTTP 连接
+            await response.close()
+        if first_token is not None:
+            tracer.record('stream', time.perf_counter() - first_token, labels)
+        return ''.join(parts), usage
 
 if __name__ == '__main__':
 
@@ -235,4 +820,30 @@ Text: 陈清扬把我拽住，以伟大友谊的名义叫我留下来。
         print(json.dumps(result, indent=2, ensure_ascii=False))
     else:
         print('测试失败，请查看日志信息调试程序')
- 
\ No newline at end of file
+    
+    # 前缀缓存命中率 (测试 1、2 的 Prompt 相同部分较短，通常不会命中)
+    print(f'[前缀缓存]：{client.prompt_cache_stats}')
+    print(f'[用量合计]：{client.usage_meter.total()}')
+ 
+        
+    # === 测试异步输出 ===
+    
+    print(f'\n测试 3: 异步输出')
+    print(f'{"=" * 30}')
+    
+    import asyncio
+    
+    async_client = AsyncLLMClient(
+        model=model,
+        temperature=temperature,
+        enable_thinking=enable_thinking,
+        cache=client.cache,
+    )
+    result = asyncio.run(async_client.get_response(prompt=user_p, json_output=True))
+    
+    # 输出生成内容
+    if result:
+        print('测试成功！模型返回结果：')
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print('测试失败，请查看日志信息调试程序')
@@ -0,0 +1,161 @@
+# bfsujason@163.com
+# python -m src.parallel_runner
+
+# 多进程语料标注 (用于 local 模式)
+# HanLP、spaCy 和 PyMUSAS 均为 CPU 密集型，单进程受 GIL 限制
+# 启动 N 个工作进程，每个进程在初始化时加载一次标注器，按块分发语料，按输入顺序合并输出
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+
+from tqdm import tqdm
+
+from src.corpus import TSVCorpus, read_span
+from src.pipeline import annotate_records
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 工作进程内的标注器 (由 _init_worker 创建)
+_worker = {}
+
+def _build_taggers(specs):
+    """
+    :param specs: {名称: (标注器类, 参数 dict)}
+    :return: {名称: 标注器实例}
+    """
+    return {name: tagger_cls(**kwargs) for name, (tagger_cls, kwargs) in (specs or {}).items()}
+
+def _init_worker(in_file, source_specs, target_specs, max_concurrency, threads_per_worker):
+    """
+    工作进程初始化：限制推理线程数并加载标注器 (每个进程只加载一次)
+    """
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+    _worker['in_file'] = in_file
+    _worker['source_taggers'] = _build_taggers(source_specs)
+    _worker['target_taggers'] = _build_taggers(target_specs)
+    _worker['max_concurrency'] = max_concurrency
+
+def _annotate_shard(span):
+    """
+    标注语料的一个分片
+
+    :param span: (起始字节偏移, 结束字节偏移, 起始行号)
+    :return: (JSONL 文本, 记录数, 进程号, 耗时秒数)
+    """
+    start = time.perf_counter()
+    records = read_span(_worker['in_file'], *span)
+    outputs = annotate_records(
+        records,
+        source_taggers=_worker['source_taggers'],
+        target_taggers=_worker['target_taggers'],
+        max_concurrency=_worker['max_concurrency'],
+    )
+    # 在工作进程中序列化，减少进程间传递的对象数量
+    lines = ''.join(json.dumps(output, ensure_ascii=False) + '\n' for output in outputs)
+    return lines, len(outputs), os.getpid(), time.perf_counter() - start
+
+def annotate_corpus_parallel(
+    in_file,
+    out_file,
+    source_taggers=None,
+    target_taggers=None,
+    num_workers=None,
+    shard_size=1000,
+    max_concurrency=8,
+    threads_per_worker=1,
+):
+    """
+    多进程标注 TSV 双语语料
+    标注器以 (类, 参数) 的形式传入，由各工作进程自行创建 (本地模型无法在进程间传递)
+    使用 spawn 方式启动工作进程，调用脚本须置于 if __name__ == '__main__': 之下
+
+    :param in_file: .tsv 文件路径 (原文\\t译文)
+    :param out_file: .jsonl 输出文件路径 (格式同 annotate_corpus)
+    :param source_taggers: 原文标注器 {名称: (标注器类, 参数 dict)}
+                           如 {'pos': (POSTagger, {'lang': 'chinese', 'tagset': 'pku', 'mode': 'local'})}
+    :param target_taggers: 译文标注器 {名称: (标注器类, 参数 dict)}
+    :param num_workers: 工作进程数 (默认为 CPU 核数)
+    :param shard_size: 每个分片的记录数
+    :param max_concurrency: 每个标注器的最大并发请求数 (llm 模式)
+    :param threads_per_worker: 每个工作进程的 PyTorch 线程数 (避免进程数 × 线程数超过 CPU 核数)
+    :return: 各工作进程的统计 [list[dict]] (pid, shards, records, seconds, records_per_sec)
+    """
+    # 主进程建立索引并切分字节区间，工作进程按区间直接读取文件
+    with TSVCorpus(in_file) as corpus:
+        total = len(corpus)
+        shards = corpus.spans(shard_size)
+    num_workers = num_workers or os.cpu_count() or 1
+    logger.info(f'多进程标注：{total} 条记录，{len(shards)} 个分片，{num_workers} 个进程')
+
+    stats = {}
+    ctx = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with open(out_file, 'wt', encoding='utf-8') as fout, \
+            tqdm(total=total, desc='标注语料', unit='条') as pbar, \
+            ctx.Pool(
+                processes=num_workers,
+                initializer=_init_worker,
+                initargs=(in_file, source_taggers, target_taggers, max_concurrency, threads_per_worker),
+            ) as pool:
+        # imap 按分片顺序返回结果，先完成的分片在主进程中等待
+        for lines, count, pid, seconds in pool.imap(_annotate_shard, shards):
+            fout.write(lines)
+            pbar.update(count)
+
+            worker = stats.setdefault(pid, {'pid': pid, 'shards': 0, 'records': 0, 'seconds': 0.0})
+            worker['shards'] += 1
+            worker['records'] += count
+            worker['seconds'] += seconds
+    elapsed = time.perf_counter() - start
+
+    # 各工作进程的吞吐量 (不含模型加载时间)
+    stats = sorted(stats.values(), key=lambda worker: worker['pid'])
+    for worker in stats:
+        worker['records_per_sec'] = worker['records'] / worker['seconds'] if worker['seconds'] else 0.0
+        logger.info(
+            f'[进程 {worker["pid"]}] {worker["shards"]} 个分片，{worker["records"]} 条，'
+            f'{worker["records_per_sec"]:.1f} 条/秒'
+        )
+    logger.info(f'标注完毕！共 {total} 条，用时 {elapsed:.1f} 秒 '
+                f'({total / elapsed:.1f} 条/秒)，结果已写入 {out_file}')
+    return stats
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    import tempfile
+
+    from src.annotator.pos_tagger import POSTagger
+    from src.annotator.sem_tagger import SEMTagger
+
+    # 生成测试语料
+    tmp_dir = tempfile.mkdtemp()
+    in_file = os.path.join(tmp_dir, 'sample.tsv')
+    out_file = os.path.join(tmp_dir, 'sample.jsonl')
+    with open(in_file, 'wt', encoding='utf-8') as fout:
+        for _ in range(100):
+            fout.write('那天晚上我没走掉。\tI did not leave that night.\n')
+            fout.write('陈清扬把我拽住。\tChen Qingyang caught me.\n')
+
+    print(f'\n测试 1: 多进程本地标注')
+    print(f'{"=" * 30}')
+    stats = annotate_corpus_parallel(
+        in_file,
+        out_file,
+        source_taggers={'pos': (POSTagger, {'lang': 'chinese', 'tagset': 'pku', 'mode': 'local'})},
+        target_taggers={'usas': (SEMTagger, {'lang': 'english', 'tagset': 'usas', 'mode': 'local'})},
+        num_workers=2,
+        shard_size=50,
+    )
+    print(f'[进程统计]：{stats}')
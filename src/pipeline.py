@@ -0,0 +1,141 @@
+# bfsujason@163.com
+# python -m src.pipeline
+
+# 流式语料标注：分块读取 TSV 双语语料，标注后逐块追加写入 JSONL
+
+import json
+import logging
+
+from tqdm import tqdm
+
+from src.usage import usage_meter
+from src.utils import iter_tsv
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def annotate_records(records, source_taggers=None, target_taggers=None, max_concurrency=8):
+    """
+    标注一块语料记录
+
+    :param records: 记录列表 [list[dict]] (id, source, target)
+    :param source_taggers: 原文标注器 dict {名称: 标注器}，如 {'pos': zh_pos_tagger}
+    :param target_taggers: 译文标注器 dict {名称: 标注器}
+    :param max_concurrency: 每个标注器的最大并发请求数
+    :return: 标注结果列表 [list[dict]] (与输入顺序一致)
+             [id]:      行号
+             [source]:  {'text': 原文, 名称: 标注结果, ...}
+             [target]:  {'text': 译文, 名称: 标注结果, ...}
+    """
+    outputs = [
+        {
+            'id': record['id'],
+            'source': {'text': record['source']},
+            'target': {'text': record['target']},
+        }
+        for record in records
+    ]
+
+    for side, taggers in (('source', source_taggers), ('target', target_taggers)):
+        texts = [record[side] for record in records]
+        for name, tagger in (taggers or {}).items():
+            results = tagger.tag_batch(texts, max_concurrency=max_concurrency)
+            for output, result in zip(outputs, results):
+                output[side][name] = result
+    return outputs
+
+def log_prompt_cache_stats(source_taggers=None, target_taggers=None):
+    """
+    输出 llm 模式标注器本次运行的服务端前缀缓存命中率
+    (命中本地缓存的请求不计入)
+    """
+    for side, taggers in (('source', source_taggers), ('target', target_taggers)):
+        for name, tagger in (taggers or {}).items():
+            stats = getattr(getattr(tagger, 'pipeline', None), 'prompt_cache_stats', None)
+            if stats is not None and stats.requests:
+                logger.info(
+                    f'[{side}.{name}] 前缀缓存命中率：{stats.hit_rate:.1%} '
+                    f'({stats.cached_tokens}/{stats.prompt_tokens} tokens，{stats.requests} 次请求)'
+                )
+
+def write_jsonl(records, fout):
+    """
+    追加写入 JSONL 记录并立即刷新到磁盘
+    """
+    for record in records:
+        fout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    fout.flush()
+
+def annotate_corpus(
+    in_file,
+    out_file,
+    source_taggers=None,
+    target_taggers=None,
+    chunksize=1000,
+    max_concurrency=8,
+):
+    """
+    流式标注 TSV 双语语料
+    分块读取、标注，每块完成后即追加写入 JSONL，内存占用与语料大小无关
+
+    :param in_file: .tsv 文件路径 (原文\\t译文)
+    :param out_file: .jsonl 输出文件路径
+    :param source_taggers: 原文标注器 dict {名称: 标注器}
+    :param target_taggers: 译文标注器 dict {名称: 标注器}
+    :param chunksize: 每块行数
+    :param max_concurrency: 每个标注器的最大并发请求数
+    :return: 标注记录数
+    """
+    count = 0
+    with open(out_file, 'wt', encoding='utf-8') as fout, \
+            tqdm(desc='标注语料', unit='条') as pbar:
+        for records in iter_tsv(in_file, chunksize=chunksize):
+            outputs = annotate_records(
+                records,
+                source_taggers=source_taggers,
+                target_taggers=target_taggers,
+                max_concurrency=max_concurrency,
+            )
+            write_jsonl(outputs, fout)
+            count += len(outputs)
+            pbar.update(len(outputs))
+
+    logger.info(f'标注完毕！共 {count} 条，结果已写入 {out_file}')
+    log_prompt_cache_stats(source_taggers, target_taggers)
+    logger.info(f'大模型用量 (进程累计)：{usage_meter.total()}')
+    return count
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    from src.annotator.pos_tagger import POSTagger
+
+    import os
+    import tempfile
+
+    # 生成测试语料
+    tmp_dir = tempfile.mkdtemp()
+    in_file = os.path.join(tmp_dir, 'sample.tsv')
+    out_file = os.path.join(tmp_dir, 'sample.jsonl')
+    with open(in_file, 'wt', encoding='utf-8') as fout:
+        fout.write('那天晚上我没走掉。\tI did not leave that night.\n')
+        fout.write('陈清扬把我拽住。\tChen Qingyang caught me.\n')
+    llm_model = 'deepseek-v3.2'
+
+    zh_pos_tagger = POSTagger(lang='chinese', tagset='pku', mode='llm', llm_model=llm_model)
+    en_pos_tagger = POSTagger(lang='english', tagset='claws', mode='llm', llm_model=llm_model)
+
+    print(f'\n测试 1: 流式标注双语语料')
+    print(f'{"=" * 30}')
+    annotate_corpus(
+        in_file,
+        out_file,
+        source_taggers={'pos': zh_pos_tagger},
+        target_taggers={'pos': en_pos_tagger},
+        chunksize=100,
+    )
+    with open(out_file, 'rt', encoding='utf-8') as fin:
+        for line in fin:
+            print(f'[标注结果]：{line.strip()}')
@@ -0,0 +1,402 @@
+# bfsujason@163.com
+# python -m src.scheduler
+
+# 大模型请求调度：限流 (RPM/TPM)、指数退避重试、熔断
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from src.config import Config
+from src.usage import usage_to_dict
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class RateLimiter:
+    """
+    令牌桶限流器 (每分钟请求数 RPM、每分钟 token 数 TPM)
+    reserve() 只预占额度并返回需等待的秒数，由调用方自行 sleep
+    因此可同时用于线程和 asyncio
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        """
+        :param rpm: 每分钟请求数上限 (None 或 0 表示不限)
+        :param tpm: 每分钟 token 数上限 (None 或 0 表示不限)
+        """
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self._lock = threading.Lock()
+        self._updated = time.monotonic()
+        self._requests = float(self.rpm or 0)
+        self._tokens = float(self.tpm or 0)
+        self._blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def reserve(self, tokens=0):
+        """
+        预占一次请求及 tokens 个 token 的额度
+
+        :param tokens: 预计消耗的 token 数
+        :return: 需等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self.rpm:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.rpm)
+            if self.tpm and tokens:
+                # 单个请求超过桶容量时按桶容量计
+                self._tokens -= min(tokens, self.tpm)
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tpm)
+            return wait
+
+    def adjust(self, reserved, actual):
+        """
+        按实际消耗的 token 数修正预占额度 (多退少补)
+
+        :param reserved: 预占时的 token 数
+        :param actual: 响应 usage 中的实际 token 数
+        """
+        if not self.tpm:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            delta = min(actual, self.tpm) - min(reserved, self.tpm)
+            self._tokens = min(self.tpm, self._tokens - delta)
+
+    def block(self, seconds):
+        """
+        暂停所有请求 seconds 秒 (如收到 429 Retry-After)
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败 failure_threshold 次后熔断，暂停提交请求 cooldown 秒
+    冷却结束后进入半开状态，只放行一个试探请求，其余请求继续等待
+    试探成功则恢复，失败则再次熔断 (冷却时间加倍，不超过 max_cooldown)
+    """
+
+    # 半开状态下等待试探结果的轮询间隔 (秒)
+    PROBE_POLL = 1.0
+
+    def __init__(self, failure_threshold=5, cooldown=30.0, max_cooldown=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._cooldown = cooldown
+        self._open_until = 0.0
+        self._tripped = False
+        self._probe = 0
+        self._probe_seq = 0
+
+    @property
+    def is_open(self):
+        return self._tripped
+
+    def wait_time(self):
+        """
+        :return: 距熔断结束的秒数 (未熔断时为 0)
+        """
+        return max(0.0, self._open_until - time.monotonic())
+
+    def acquire(self):
+        """
+        申请提交一次请求
+
+        :return: (需等待的秒数, 试探编号)
+                 等待秒数大于 0 时应等待后重新申请；试探编号非 0 表示本次为半开状态下的试探请求
+        """
+        with self._lock:
+            if not self._tripped:
+                return 0.0, 0
+            wait = self._open_until - time.monotonic()
+            if wait > 0:
+                return wait, 0
+            if self._probe:
+                return self.PROBE_POLL, 0
+            self._probe_seq += 1
+            self._probe = self._probe_seq
+            logger.info('熔断冷却结束，放行试探请求')
+            return 0.0, self._probe
+
+    def abandon(self, probe):
+        """
+        试探请求未得出结果 (如不可重试的错误或被取消) 时释放试探名额，由下一个请求重新试探
+        """
+        with self._lock:
+            if probe and self._probe == probe:
+                self._probe = 0
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+            self._tripped = False
+            self._probe = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            # 试探失败立即再次熔断；熔断期间的其他失败 (熔断前已提交的请求) 不重复计时
+            if self._probe or (self._failures >= self.failure_threshold and not self._tripped):
+                self._open_until = time.monotonic() + self._cooldown
+                self._tripped = True
+                self._probe = 0
+                logger.warning(f'大模型服务连续失败 {self._failures} 次，暂停提交 {self._cooldown:.0f} 秒')
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+
+class RequestScheduler:
+    """
+    请求调度器
+    提交前等待限流及熔断，失败时按指数退避加随机抖动重试，并遵循 Retry-After
+    """
+
+    def __init__(
+        self,
+        rpm=None,
+        tpm=None,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        failure_threshold=5,
+        cooldown=30.0,
+    ):
+        """
+        :param rpm: 每分钟请求数上限 (None 表示不限)
+        :param tpm: 每分钟 token 数上限 (None 表示不限)
+        :param max_retries: 最大重试次数
+        :param base_delay: 退避初始等待秒数
+        :param max_delay: 退避最长等待秒数
+        :param failure_threshold: 触发熔断的连续失败次数
+        :param cooldown: 熔断冷却秒数
+        """
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, cooldown=cooldown)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def reconcile(self, tokens, usage):
+        """
+        按响应 usage 修正 TPM 预占额度 (预占时按估计的输入 token 数计算，不含输出)
+
+        :param tokens: 调用 call()/acall() 时传入的预计 token 数
+        :param usage: 响应中的 usage (SDK 对象或 dict)，为空时不修正
+        """
+        usage = usage_to_dict(usage)
+        if usage is None:
+            return
+        self.limiter.adjust(tokens, usage['prompt_tokens'] + usage['completion_tokens'])
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS
+        return False
+
+    @staticmethod
+    def _retry_after(error):
+        """
+        读取响应头中的 Retry-After (秒数或 HTTP 日期)
+
+        :return: 秒数，无此响应头时返回 None
+        """
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        headers = response.headers
+
+        retry_after_ms = headers.get('retry-after-ms')
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+
+        retry_after = headers.get('retry-after')
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _on_failure(self, error, attempt):
+        """
+        记录失败并计算下次重试前的等待秒数
+        不可重试或超过重试次数时返回 None
+        """
+        if not self.is_retryable(error):
+            return None
+
+        self.breaker.record_failure()
+        if attempt >= self.max_retries:
+            return None
+
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            delay = min(retry_after, self.max_delay) + random.uniform(0, self.base_delay)
+        else:
+            # 指数退避 + 随机抖动 (full jitter)
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+        # 限流时所有请求一起等待，避免反复触发 429
+        if isinstance(error, openai.APIStatusError) and error.status_code == 429:
+            self.limiter.block(delay)
+
+        logger.warning(f'LLM 请求失败 ({type(error).__name__})，{delay:.1f} 秒后第 {attempt + 1} 次重试')
+        return delay
+
+    def call(self, fn, tokens=0):
+        """
+        调度执行 fn()
+
+        :param fn: 发送请求的函数 (无参数)
+        :param tokens: 预计消耗的 token 数 (收到响应后以 reconcile() 修正)
+        :return: fn() 的返回值
+        """
+        attempt = 0
+        while True:
+            # 熔断 (半开状态下只放行一个试探请求)
+            wait, probe = self.breaker.acquire()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                wait = self.limiter.reserve(tokens)
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    result = fn()
+                except Exception as e:
+                    delay = self._on_failure(e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    self.breaker.record_success()
+                    return result
+            finally:
+                self.breaker.abandon(probe)
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, fn, tokens=0):
+        """
+        调度执行 await fn() (协程)
+
+        :param fn: 返回协程的函数 (无参数)
+        :param tokens: 预计消耗的 token 数 (收到响应后以 reconcile() 修正)
+        :return: await fn() 的返回值
+        """
+        attempt = 0
+        while True:
+            # 熔断 (半开状态下只放行一个试探请求)
+            wait, probe = self.breaker.acquire()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                wait = self.limiter.reserve(tokens)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    result = await fn()
+                except Exception as e:
+                    delay = self._on_failure(e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    self.breaker.record_success()
+                    return result
+            finally:
+                self.breaker.abandon(probe)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+# 进程内共享的调度器 (按模型名称区分，百炼的限流额度按模型计算)
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(model):
+    """
+    获取模型对应的共享调度器 (参数读取自 Config)
+
+    :param model: 大模型名称
+    :return: RequestScheduler 实例
+    """
+    with _schedulers_lock:
+        if model not in _schedulers:
+            _schedulers[model] = RequestScheduler(
+                rpm=Config.LLM_RPM,
+                tpm=Config.LLM_TPM,
+                max_retries=Config.LLM_MAX_RETRIES,
+            )
+        return _schedulers[model]
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.INFO)
+
+    print(f'\n测试 1: 限流 (RPM=120)')
+    print(f'{"=" * 30}')
+    limiter = RateLimiter(rpm=120)
+    waits = [limiter.reserve() for _ in range(125)]
+    print(f'[第 1 次等待]：{waits[0]:.2f} 秒')
+    print(f'[第 125 次等待]：{waits[-1]:.2f} 秒')
+
+    print(f'\n测试 2: 熔断')
+    print(f'{"=" * 30}')
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=1.0)
+    for _ in range(3):
+        breaker.record_failure()
+    print(f'[熔断状态]：{breaker.is_open} 剩余 {breaker.wait_time():.2f} 秒')
+
+    print(f'\n测试 3: 半开状态只放行一个试探请求')
+    print(f'{"=" * 30}')
+    time.sleep(breaker.wait_time())
+    first = breaker.acquire()
+    second = breaker.acquire()
+    print(f'[第 1 个请求]：等待 {first[0]:.2f} 秒 试探编号 {first[1]}')
+    print(f'[第 2 个请求]：等待 {second[0]:.2f} 秒 试探编号 {second[1]}')
+    breaker.record_success()
+    print(f'[试探成功后]：{breaker.is_open} {breaker.acquire()}')
+
+    print(f'\n测试 4: 按实际用量修正 TPM')
+    print(f'{"=" * 30}')
+    scheduler = RequestScheduler(tpm=1000)
+    print(f'[预占 100]：等待 {scheduler.limiter.reserve(100):.2f} 秒')
+    scheduler.reconcile(100, {'prompt_tokens': 120, 'completion_tokens': 980})
+    print(f'[实际 1100 后预占 100]：等待 {scheduler.limiter.reserve(100):.2f} 秒')
@@ -0,0 +1,221 @@
+# bfsujason@163.com
+# python -m src.timing
+
+# 标注耗时统计：记录 tag() 各阶段耗时 (清洗、分句、构建 Prompt、缓存查询、首 token 时延、流式输出、JSON 解析、结果转换)
+# 默认不记录 (无输出端)，添加输出端后生效：日志、内存直方图 (p50/p95/p99) 或 OpenTelemetry
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class _NullSpan:
+    """
+    未添加输出端时使用的空计时器
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    """
+    计时器 (with 语句块结束时记录耗时)
+    """
+
+    __slots__ = ('tracer', 'stage', 'labels', 'start')
+
+    def __init__(self, tracer, stage, labels):
+        self.tracer = tracer
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.stage, time.perf_counter() - self.start, self.labels)
+        return False
+
+class Tracer:
+    """
+    耗时统计
+    用法：
+        with tracer.span('parse', labels):
+            ...
+    或直接记录：
+        tracer.record('ttft', seconds, labels)
+    """
+
+    def __init__(self):
+        self.sinks = []
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        """
+        添加输出端
+
+        :param sink: 实现 record(stage, seconds, labels) 的对象
+        :return: sink
+        """
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def clear(self):
+        self.sinks = []
+
+    def span(self, stage, labels=None):
+        """
+        :param stage: 阶段名称
+        :param labels: 标签 dict {'tagger': ..., 'tagset': ...}
+        :return: 计时器 (上下文管理器)
+        """
+        if not self.sinks:
+            return _NULL_SPAN
+        return _Span(self, stage, labels)
+
+    def record(self, stage, seconds, labels=None):
+        for sink in self.sinks:
+            try:
+                sink.record(stage, seconds, labels)
+            except Exception as e:
+                logger.warning(f'耗时记录失败 ({type(sink).__name__})：{e}')
+
+def _tagger_name(labels):
+    # 按标注器及标注集区分，如 POSTagger[pku]
+    if not labels or not labels.get('tagger'):
+        return '-'
+    if labels.get('tagset'):
+        return f'{labels["tagger"]}[{labels["tagset"]}]'
+    return labels['tagger']
+
+class LoggingSink:
+    """
+    逐条输出到日志
+    """
+
+    def __init__(self, level=logging.DEBUG):
+        self.level = level
+
+    def record(self, stage, seconds, labels=None):
+        logger.log(self.level, f'[{_tagger_name(labels)}] {stage}: {seconds * 1000:.2f} ms')
+
+class HistogramSink:
+    """
+    内存直方图 (线程安全)
+    按标注器和阶段保存最近 max_samples 个耗时，统计 p50/p95/p99
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, stage, seconds, labels=None):
+        key = (_tagger_name(labels), stage)
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.max_samples)
+            self._samples[key].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    @staticmethod
+    def _percentile(values, q):
+        # 最近秩法 (values 已排序)
+        rank = math.ceil(q / 100 * len(values))
+        return values[min(len(values), max(rank, 1)) - 1]
+
+    def percentiles(self, qs=(50, 95, 99)):
+        """
+        :param qs: 百分位数
+        :return: [list[dict]] (tagger, stage, count, mean, p50, p95, p99)，单位为毫秒
+        """
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+
+        rows = []
+        for (tagger, stage), values in sorted(samples.items()):
+            row = {
+                'tagger': tagger,
+                'stage': stage,
+                'count': len(values),
+                'mean': sum(values) / len(values) * 1000,
+            }
+            for q in qs:
+                row[f'p{q}'] = self._percentile(values, q) * 1000
+            rows.append(row)
+        return rows
+
+    def report(self):
+        """
+        :return: 耗时统计表 str
+        """
+        lines = [f'{"tagger":<20} {"stage":<14} {"count":>7} {"mean":>9} {"p50":>9} {"p95":>9} {"p99":>9}']
+        for row in self.percentiles():
+            lines.append(
+                f'{row["tagger"]:<20} {row["stage"]:<14} {row["count"]:>7} '
+                f'{row["mean"]:>9.2f} {row["p50"]:>9.2f} {row["p95"]:>9.2f} {row["p99"]:>9.2f}'
+            )
+        return '\n'.join(lines) + '\n(单位：毫秒)'
+
+class OpenTelemetrySink:
+    """
+    输出为 OpenTelemetry span (需安装 opentelemetry-api 并配置 TracerProvider)
+    """
+
+    def __init__(self, name='llm_corpus_annotation'):
+        from opentelemetry import trace
+
+        self.otel_tracer = trace.get_tracer(name)
+
+    def record(self, stage, seconds, labels=None):
+        end_time = time.time_ns()
+        span = self.otel_tracer.start_span(
+            stage,
+            start_time=end_time - int(seconds * 1e9),
+            attributes={key: str(value) for key, value in (labels or {}).items()},
+        )
+        span.end(end_time=end_time)
+
+# 进程内共享的耗时统计 (默认无输出端)
+tracer = Tracer()
+
+if __name__ == '__main__':
+
+    # 打印日志信息
+    logging.basicConfig(level=logging.DEBUG)
+
+    import random
+
+    print(f'\n测试 1: 日志输出')
+    print(f'{"=" * 30}')
+    logging_sink = tracer.add_sink(LoggingSink())
+    with tracer.span('parse', {'tagger': 'POSTagger', 'tagset': 'pku'}):
+        time.sleep(0.01)
+    tracer.remove_sink(logging_sink)
+
+    print(f'\n测试 2: 耗时分布')
+    print(f'{"=" * 30}')
+    histogram = tracer.add_sink(HistogramSink())
+    for _ in range(1000):
+        tracer.record('ttft', random.lognormvariate(-1, 0.5), {'tagger': 'POSTagger', 'tagset': 'pku'})
+        tracer.record('ttft', random.lognormvariate(-0.5, 0.5), {'tagger': 'SEMTagger', 'tagset': 'usas'})
+    print(histogram.report())
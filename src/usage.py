@@ -0,0 +1,251 @@
+# bfsujason@163.com
+# python -m src.usage
+
+# 大模型用量计量：逐次请求记录 token 用量，按模型、标注器、标注集汇总并估算费用
+# 汇总结果可导出为 JSON 或 Prometheus 文本格式
+
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 参考价格 (元 / 百万 tokens)，仅用于估算费用，实际以百炼控制台计费为准
+# [input]:   输入
+# [cached]:  命中服务端前缀缓存的输入
+# [output]:  输出
+PRICES = {
+    'kimi-k2.5':        {'input': 4.0, 'cached': 0.8, 'output': 21.0},
+    'glm-5':            {'input': 4.0, 'cached': 0.8, 'output': 18.0},
+    'deepseek-v3.2':    {'input': 2.0, 'cached': 0.4, 'output': 3.0},
+    'qwen3-max':        {'input': 6.0, 'cached': 1.2, 'output': 24.0},
+}
+
+# Batch 调用按实时调用价格的 50% 计费
+BATCH_PRICE_FACTOR = 0.5
+
+# 汇总维度
+LABELS = ('model', 'tagger', 'tagset')
+
+def usage_to_dict(usage):
+    """
+    将响应中的 usage (SDK 对象或 dict) 转换为 token 计数 dict
+
+    :return: {'prompt_tokens', 'completion_tokens', 'cached_tokens'}，usage 为空时返回 None
+    """
+    if usage is None:
+        return None
+
+    def _get(obj, name):
+        if obj is None:
+            return None
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    return {
+        'prompt_tokens': _get(usage, 'prompt_tokens') or 0,
+        'completion_tokens': _get(usage, 'completion_tokens') or 0,
+        'cached_tokens': _get(_get(usage, 'prompt_tokens_details'), 'cached_tokens') or 0,
+    }
+
+class UsageMeter:
+    """
+    大模型用量计量器 (线程安全)
+    同一进程内的 LLMClient、AsyncLLMClient 和 BatchLLMClient 默认共用 usage_meter
+    """
+
+    def __init__(self, prices=None, max_records=100000):
+        """
+        :param prices: 价格表 {模型: {'input', 'cached', 'output'}} (默认为 PRICES)
+        :param max_records: 保留的逐次请求记录数 (超出时丢弃最早的记录，汇总不受影响)
+        """
+        self.prices = dict(PRICES if prices is None else prices)
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._totals = {}
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+    def estimate_cost(self, model, prompt_tokens, completion_tokens, cached_tokens=0, price_factor=1.0):
+        """
+        估算费用 (元)，价格表中没有的模型返回 None
+        """
+        price = self.prices.get(model)
+        if price is None:
+            return None
+        cached_tokens = min(cached_tokens, prompt_tokens)
+        cost = (
+            (prompt_tokens - cached_tokens) * price['input']
+            + cached_tokens * price.get('cached', price['input'])
+            + completion_tokens * price['output']
+        ) / 1e6
+        return cost * price_factor
+
+    def _totals_for(self, model, labels):
+        key = (model, labels.get('tagger') or '', labels.get('tagset') or '')
+        if key not in self._totals:
+            self._totals[key] = {
+                'requests': 0,
+                'cache_hits': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cached_tokens': 0,
+                'cost': 0.0,
+            }
+        return self._totals[key]
+
+    def record(self, model, usage, labels=None, price_factor=1.0):
+        """
+        记录一次请求的用量
+
+        :param model: 大模型名称
+        :param usage: 响应中的 usage (SDK 对象或 dict)
+        :param labels: 标签 dict {'tagger': ..., 'tagset': ...}
+        :param price_factor: 价格系数 (Batch 调用为 BATCH_PRICE_FACTOR)
+        :return: 本次请求的记录 dict (usage 为空时返回 None)
+        """
+        usage = usage_to_dict(usage)
+        if usage is None:
+            return None
+
+        labels = labels or {}
+        cost = self.estimate_cost(model, price_factor=price_factor, **usage)
+        record = {
+            'time': time.time(),
+            'model': model,
+            'tagger': labels.get('tagger'),
+            'tagset': labels.get('tagset'),
+            **usage,
+            'cost': cost,
+        }
+        with self._lock:
+            self._records.append(record)
+            totals = self._totals_for(model, labels)
+            totals['requests'] += 1
+            for name in ('prompt_tokens', 'completion_tokens', 'cached_tokens'):
+                totals[name] += usage[name]
+            totals['cost'] += cost or 0.0
+        return record
+
+    def record_cache_hit(self, model, labels=None):
+        """
+        记录一次本地缓存命中 (不产生费用)
+        """
+        with self._lock:
+            self._totals_for(model, labels or {})['cache_hits'] += 1
+
+    @property
+    def records(self):
+        """
+        逐次请求记录 [list[dict]]
+        """
+        with self._lock:
+            return list(self._records)
+
+    def summary(self):
+        """
+        按模型、标注器、标注集汇总
+
+        :return: [list[dict]]
+        """
+        with self._lock:
+            return [
+                {**dict(zip(LABELS, key)), **totals, 'cost': round(totals['cost'], 6)}
+                for key, totals in sorted(self._totals.items())
+            ]
+
+    def total(self):
+        """
+        全部用量合计 dict
+        """
+        total = {
+            'requests': 0,
+            'cache_hits': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'cached_tokens': 0,
+            'cost': 0.0,
+        }
+        for row in self.summary():
+            for name in total:
+                total[name] += row[name]
+        total['cost'] = round(total['cost'], 6)
+        return total
+
+    def to_json(self, file_name=None, with_records=False):
+        """
+        导出为 JSON
+
+        :param file_name: 输出文件路径 (为空时只返回字符串)
+        :param with_records: 是否包含逐次请求记录
+        :return: JSON 字符串
+        """
+        data = {'total': self.total(), 'summary': self.summary()}
+        if with_records:
+            data['records'] = self.records
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        if file_name:
+            with open(file_name, 'wt', encoding='utf-8') as fout:
+                fout.write(text)
+        return text
+
+    def to_prometheus(self, prefix='llm'):
+        """
+        导出为 Prometheus 文本格式 (可写入 node_exporter 的 textfile 目录)
+
+        :param prefix: 指标名称前缀
+        :return: str
+        """
+        metrics = [
+            ('requests', 'LLM API requests'),
+            ('cache_hits', 'Responses served from the local cache'),
+            ('prompt_tokens', 'Prompt tokens'),
+            ('completion_tokens', 'Completion tokens'),
+            ('cached_tokens', 'Prompt tokens served from the provider prefix cache'),
+            ('cost', 'Estimated cost in CNY'),
+        ]
+        rows = self.summary()
+
+        lines = []
+        for name, help_text in metrics:
+            metric = f'{prefix}_{name}_total'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for row in rows:
+                labels = ','.join(f'{label}="{_escape(row[label])}"' for label in LABELS)
+                lines.append(f'{metric}{{{labels}}} {row[name]}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    # Prometheus 标签值转义
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# 进程内共享的计量器
+usage_meter = UsageMeter()
+
+if __name__ == '__main__':
+
+    print(f'\n测试 1: 记录用量')
+    print(f'{"=" * 30}')
+    meter = UsageMeter()
+    usage = {'prompt_tokens': 3000, 'completion_tokens': 200, 'prompt_tokens_details': {'cached_tokens': 2800}}
+    meter.record('qwen3-max', usage, labels={'tagger': 'POSTagger', 'tagset': 'pku'})
+    meter.record('qwen3-max', usage, labels={'tagger': 'SEMTagger', 'tagset': 'usas'})
+    meter.record('qwen3-max', usage, labels={'tagger': 'SEMTagger', 'tagset': 'usas'}, price_factor=BATCH_PRICE_FACTOR)
+    meter.record_cache_hit('qwen3-max', labels={'tagger': 'POSTagger', 'tagset': 'pku'})
+    print(f'[合计]：{meter.total()}')
+
+    print(f'\n测试 2: 导出 JSON')
+    print(f'{"=" * 30}')
+    print(meter.to_json())
+
+    print(f'\n测试 3: 导出 Prometheus')
+    print(f'{"=" * 30}')
+    print(meter.to_prometheus())
@@ -5,11 +5,15 @@
 
 import re
 import json
+import logging
 
 import pandas as pd
 #from spacy import displacy
 from sentence_splitter import SentenceSplitter
 
+# 配置日志
+logger = logging.getLogger(__name__)
+
 def load_data(file_name, limit=None):
     """
     读取 TSV 格式双语语料
@@ -34,6 +38,45 @@ def load_data(file_name, limit=None):
     except Exception as e:
        print(f'读取文件 {filename} 失败: {e}')
     
+def iter_tsv(file_name, chunksize=1000, offset=0, line_no=0):
+    """
+    分块读取 TSV 格式双语语料 (流式，内存占用与语料大小无关)
+    与 load_data 一致：跳过列数不为 2 或含空列的行；无法按 UTF-8 解码的行记录警告后跳过
+    
+    :param file_name: .tsv 文件路径
+    :param chunksize: 每块行数
+    :param offset: 起始字节偏移 (用于断点续跑)
+    :param line_no: 起始偏移处的行号
+    :return: 生成器，每次返回一块记录 [list[dict]]
+             [id]:      行号 (从 0 开始)
+             [source]:  原文 str
+             [target]:  译文 str
+             [offset]:  该行结束处的字节偏移
+    """
+    chunk = []
+    with open(file_name, 'rb') as fin:
+        fin.seek(offset)
+        for raw in fin:
+            offset += len(raw)
+            try:
+                fields = raw.decode('utf-8').rstrip('\r\n').split('\t')
+            except UnicodeDecodeError as e:
+                logger.warning(f'跳过无法解码的行：{file_name} 第 {line_no} 行 ({e})')
+                fields = None
+            if fields and len(fields) == 2 and all(fields):
+                chunk.append({
+                    'id': line_no,
+                    'source': fields[0],
+                    'target': fields[1],
+                    'offset': offset,
+                })
+                if len(chunk) >= chunksize:
+                    yield chunk
+                    chunk = []
+            line_no += 1
+    if chunk:
+        yield chunk
+    
 def clean_text(text):
     clean_text = []
     text = text.strip()
@@ -75,10 +118,218 @@ def _split_zh(text, limit=1000):
 
         return sent_list
       
+def estimate_tokens(text):
+    """
+    粗略估计文本的 token 数
+    中日韩字符按 1 个 token 计，其余字符按 4 个字符 1 个 token 计
+    
+    :param text: 输入文本 str
+    :return: token 数 int
+    """
+    cjk = len(re.findall(r'[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def pack_sents(sents, max_tokens):
+    """
+    将句子按顺序打包为若干块，每块不超过 max_tokens 个 token
+    超长的单个句子单独成块
+    
+    :param sents: 句子列表 [list]
+    :param max_tokens: 每块的 token 上限 int
+    :return: 分块结果 [list[list]]
+    """
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for sent in sents:
+        sent_tokens = estimate_tokens(sent)
+        if chunk and chunk_tokens + sent_tokens > max_tokens:
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(sent)
+        chunk_tokens += sent_tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+      
+def bucket_apply(fn, items, batch_size, key=len):
+    """
+    按长度排序后分批调用 fn，再按原顺序返回结果
+    长度相近的样本同批处理，可减少批量推理时的填充
+    
+    :param fn: 批处理函数 (输入列表，返回等长列表)
+    :param items: 输入样本列表 [list]
+    :param batch_size: 批大小 int
+    :param key: 样本长度函数 (默认为 len)
+    :return: 结果列表 [list] (与输入顺序一致)
+    """
+    order = sorted(range(len(items)), key=lambda i: key(items[i]))
+    outputs = [None] * len(items)
+    for start in range(0, len(order), batch_size):
+        batch_idx = order[start:start + batch_size]
+        batch_out = fn([items[i] for i in batch_idx])
+        for i, out in zip(batch_idx, batch_out):
+            outputs[i] = out
+    return outputs
+      
 def save_results(results, out_file):
      with open(out_file, "wt", encoding="utf-8") as fout:
         for record in results:
             fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# === 列式存储 (Parquet / Arrow IPC，需安装 pyarrow) ===
+
+def _results_schema(tag_key):
+    import pyarrow as pa
+
+    return pa.schema([
+        ('text', pa.string()),
+        ('sent', pa.list_(pa.string())),
+        ('tok', pa.list_(pa.string())),
+        (tag_key, pa.list_(pa.dictionary(pa.int32(), pa.string()))),
+    ])
+
+def _list_column(rows, key, values_fn):
+    """
+    构建 list 列 (偏移数组 + 扁平值数组)，缺失的字段或结果记为 null
+    """
+    import pyarrow as pa
+
+    offsets, values, mask = [0], [], []
+    for row in rows:
+        items = row.get(key) if row is not None else None
+        mask.append(items is None)
+        values.extend(items or [])
+        offsets.append(len(values))
+    return pa.ListArray.from_arrays(
+        pa.array(offsets, type=pa.int32()),
+        values_fn(values),
+        mask=pa.array(mask, type=pa.bool_()),
+    )
+
+def results_to_table(results, tagset):
+    """
+    将标注结果转换为 pyarrow.Table
+    词和赋码为 list 列，赋码为字典编码 (编号与 AnnotatedCorpus 共用同一赋码词表)
+    只保存 text、sent、tok 及赋码字段，无效文本的结果 (None) 记为 null 行
+
+    :param results: 标注结果列表 [list[dict | None]]
+    :param tagset: 标注集名称 pku | claws | usas | ptb | ud
+    :return: pyarrow.Table
+    """
+    import pyarrow as pa
+    from src.annotator.doc import TAG_KEYS, get_vocab
+
+    tag_key = TAG_KEYS[tagset]
+    vocab = get_vocab(tagset)
+    results = list(results)
+
+    def _tags(values):
+        # 编号 0 (赋码为 None) 记为 null；词表只追加，各批次的字典互为前缀，可写入同一 Arrow 文件
+        tag_ids = [vocab.id(tag) for tag in values]
+        dictionary = [tag or '' for tag in vocab.tags]
+        return pa.DictionaryArray.from_arrays(
+            pa.array(tag_ids, type=pa.int32(), mask=pa.array([i == 0 for i in tag_ids], type=pa.bool_())),
+            pa.array(dictionary, type=pa.string()),
+        )
+
+    text = pa.array([None if row is None else row.get('text') for row in results], type=pa.string())
+    sent = _list_column(results, 'sent', lambda values: pa.array(values, type=pa.string()))
+    tok = _list_column(results, 'tok', lambda values: pa.array(values, type=pa.string()))
+    tag = _list_column(results, tag_key, _tags)
+    return pa.Table.from_arrays([text, sent, tok, tag], schema=_results_schema(tag_key))
+
+def table_to_results(table):
+    """
+    将 results_to_table 生成的表还原为标注结果列表
+    null 字段不写入结果，全部为 null 的行还原为 None
+
+    :param table: pyarrow.Table
+    :return: [list[dict | None]]
+    """
+    columns = {name: table.column(name).to_pylist() for name in table.column_names}
+    results = []
+    for i in range(table.num_rows):
+        result = {name: values[i] for name, values in columns.items() if values[i] is not None}
+        results.append(result or None)
+    return results
+
+def _iter_batches(results, batch_size):
+    batch = []
+    for result in results:
+        batch.append(result)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def save_results_parquet(results, out_file, tagset, row_group_size=10000, compression='zstd'):
+    """
+    分批写入 Parquet 文件 (每批一个 row group，内存占用与结果数量无关)
+
+    :param results: 标注结果 (可迭代对象)
+    :param out_file: .parquet 文件路径
+    :param tagset: 标注集名称
+    :param row_group_size: 每个 row group 的行数
+    :param compression: 压缩算法 zstd | snappy | gzip | none
+    :return: 写入行数
+    """
+    import pyarrow.parquet as pq
+    from src.annotator.doc import TAG_KEYS
+
+    count = 0
+    with pq.ParquetWriter(out_file, _results_schema(TAG_KEYS[tagset]), compression=compression) as writer:
+        for batch in _iter_batches(results, row_group_size):
+            writer.write_table(results_to_table(batch, tagset), row_group_size=row_group_size)
+            count += len(batch)
+    return count
+
+def load_results_parquet(in_file, columns=None, memory_map=True):
+    """
+    读取 Parquet 文件
+
+    :param in_file: .parquet 文件路径
+    :param columns: 只读取部分列 (如 ['tok', 'pos'])
+    :param memory_map: 内存映射读取
+    :return: pyarrow.Table (table_to_results 可还原为标注结果列表)
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(in_file, columns=columns, memory_map=memory_map)
+
+def save_results_arrow(results, out_file, tagset, batch_size=10000):
+    """
+    分批写入 Arrow IPC 文件 (Feather v2，未压缩，读取时可直接内存映射)
+
+    :param results: 标注结果 (可迭代对象)
+    :param out_file: .arrow 文件路径
+    :param tagset: 标注集名称
+    :param batch_size: 每个 record batch 的行数
+    :return: 写入行数
+    """
+    import pyarrow as pa
+    from src.annotator.doc import TAG_KEYS
+
+    # 后续批次新增的赋码以字典增量 (delta) 写入
+    options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    count = 0
+    with pa.OSFile(out_file, 'wb') as sink, \
+            pa.ipc.new_file(sink, _results_schema(TAG_KEYS[tagset]), options=options) as writer:
+        for batch in _iter_batches(results, batch_size):
+            writer.write_table(results_to_table(batch, tagset))
+            count += len(batch)
+    return count
+
+def load_results_arrow(in_file):
+    """
+    内存映射读取 Arrow IPC 文件 (不复制数据)
+
+    :param in_file: .arrow 文件路径
+    :return: pyarrow.Table
+    """
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(in_file, 'r')).read_all()
             
 if __name__ == '__main__':
     claws_tag_file = 'data/eval/claws7_tag.txt'